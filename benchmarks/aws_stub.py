@@ -0,0 +1,329 @@
+"""
+Offline stand-in for the IAM and CodeCommit APIs used by the service.
+
+install(client) hooks a real boto3 client on before-send and answers every HTTP attempt
+from memory, so request signing, response parsing, botocore retries, source.ratelimit and
+source.metrics run as they would against AWS. Each attempt sleeps for the injected latency
+and is answered with a throttling error with the injected probability.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qsl
+from xml.sax.saxutils import escape
+
+from botocore.awsrequest import AWSResponse
+
+ACCOUNT = '123456789012'
+IAM_ARN = f'arn:aws-cn:iam::{ACCOUNT}'
+CODECOMMIT_ARN = f'arn:aws-cn:codecommit:cn-north-1:{ACCOUNT}'
+IAM_NAMESPACE = 'https://iam.amazonaws.com/doc/2010-05-08/'
+
+
+class StubError(Exception):
+
+    def __init__(self, code, message='', status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+class RawBody(object):
+    """
+    the part of urllib3's response that AWSResponse reads
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def to_xml(value):
+    if isinstance(value, dict):
+        return ''.join(f'<{key}>{to_xml(item)}</{key}>' for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return ''.join(f'<member>{to_xml(item)}</member>' for item in value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return escape(str(value))
+
+
+def user_arn(user_name):
+    return f'{IAM_ARN}:user/{user_name}'
+
+
+def group_arn(group_name):
+    return f'{IAM_ARN}:group/{group_name}'
+
+
+def policy_arn(policy_name):
+    return f'{IAM_ARN}:policy/{policy_name}'
+
+
+def repository_metadata(repo_name):
+    return {
+        "repositoryName": repo_name,
+        "repositoryId": str(uuid.uuid5(uuid.NAMESPACE_URL, repo_name)),
+        "Arn": f'{CODECOMMIT_ARN}:{repo_name}',
+        "cloneUrlHttp": f'https://git-codecommit.cn-north-1.amazonaws.com.cn/v1/repos/{repo_name}',
+        "cloneUrlSsh": f'ssh://git-codecommit.cn-north-1.amazonaws.com.cn/v1/repos/{repo_name}',
+    }
+
+
+class StubAWS(object):
+    """
+    :param latency: seconds each attempt takes on average
+    :param jitter: fraction of latency added or removed at random
+    :param throttle_rate: probability that an attempt is answered with a throttling error
+    """
+
+    def __init__(self, latency=0.02, jitter=0.5, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.users = set()
+        self.groups = set()
+        # group -> user names, group -> attached policy arns
+        self.members = {}
+        self.attached = {}
+        self.policies = {}
+        self.repos = set()
+        self.calls = Counter()
+        self.throttled = Counter()
+
+    def seed(self, users=(), groups=(), members=(), policies=(), attached=(), repos=()):
+        """
+        :param members: (user name, group name) pairs
+        :param policies: policy names
+        :param attached: (group name, policy arn) pairs
+        """
+        with self.lock:
+            self.users.update(users)
+            self.groups.update(groups)
+            for user_name, group_name in members:
+                self.members.setdefault(group_name, set()).add(user_name)
+            for policy_name in policies:
+                self.policies[policy_arn(policy_name)] = policy_name
+            for group_name, arn in attached:
+                self.attached.setdefault(group_name, set()).add(arn)
+            self.repos.update(repos)
+
+    def stats(self):
+        with self.lock:
+            return {"calls": sum(self.calls.values()), "throttled": sum(self.throttled.values())}
+
+    def install(self, client):
+        service = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register(f'before-send.{service}', self.before_send, unique_id='aws-stub-before-send')
+        return client
+
+    def before_send(self, request=None, event_name=None, **kwargs):
+        _, service, operation = event_name.split('.', 2)
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with self.lock:
+            self.calls[operation] += 1
+            delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+            throttle = self.random.random() < self.throttle_rate
+            if throttle:
+                self.throttled[operation] += 1
+        time.sleep(max(0.0, delay))
+        if service == 'iam':
+            params = dict(parse_qsl(body.decode('utf-8')))
+            return self.iam_response(request.url, operation, params, throttle)
+        params = json.loads(body) if body else {}
+        return self.codecommit_response(request.url, operation, params, throttle)
+
+    def iam_response(self, url, operation, params, throttle):
+        request_id = str(uuid.uuid4())
+        try:
+            if throttle:
+                raise StubError('Throttling', 'Rate exceeded')
+            handler = getattr(self, f'iam_{operation}', None)
+            if handler is None:
+                raise StubError('InvalidAction', f'{operation} is not stubbed')
+            with self.lock:
+                result = handler(params)
+        except StubError as e:
+            body = (f'<ErrorResponse xmlns="{IAM_NAMESPACE}"><Error><Type>Sender</Type><Code>{e.code}</Code>'
+                    f'<Message>{escape(e.message)}</Message></Error><RequestId>{request_id}</RequestId>'
+                    f'</ErrorResponse>')
+            return AWSResponse(url, e.status, {'Content-Type': 'text/xml'}, RawBody(body.encode('utf-8')))
+        body = (f'<{operation}Response xmlns="{IAM_NAMESPACE}"><{operation}Result>{to_xml(result or {})}'
+                f'</{operation}Result><ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata>'
+                f'</{operation}Response>')
+        return AWSResponse(url, 200, {'Content-Type': 'text/xml'}, RawBody(body.encode('utf-8')))
+
+    def codecommit_response(self, url, operation, params, throttle):
+        headers = {'Content-Type': 'application/x-amz-json-1.1', 'x-amzn-RequestId': str(uuid.uuid4())}
+        try:
+            if throttle:
+                raise StubError('ThrottlingException', 'Rate exceeded')
+            handler = getattr(self, f'codecommit_{operation}', None)
+            if handler is None:
+                raise StubError('InvalidActionException', f'{operation} is not stubbed')
+            with self.lock:
+                result = handler(params)
+        except StubError as e:
+            body = json.dumps({"__type": e.code, "message": e.message})
+            return AWSResponse(url, e.status, headers, RawBody(body.encode('utf-8')))
+        return AWSResponse(url, 200, headers, RawBody(json.dumps(result or {}).encode('utf-8')))
+
+    # IAM, called with the lock held
+
+    def require_user(self, user_name):
+        if user_name not in self.users:
+            raise StubError('NoSuchEntity', f'The user with name {user_name} cannot be found.', 404)
+
+    def require_group(self, group_name):
+        if group_name not in self.groups:
+            raise StubError('NoSuchEntity', f'The group with name {group_name} cannot be found.', 404)
+
+    def iam_GetUser(self, params):
+        self.require_user(params['UserName'])
+        return {"User": {"UserName": params['UserName'], "Arn": user_arn(params['UserName'])}}
+
+    def iam_CreateUser(self, params):
+        if params['UserName'] in self.users:
+            raise StubError('EntityAlreadyExists', f"User with name {params['UserName']} already exists.", 409)
+        self.users.add(params['UserName'])
+        return {"User": {"UserName": params['UserName'], "Arn": user_arn(params['UserName'])}}
+
+    def iam_DeleteUser(self, params):
+        self.require_user(params['UserName'])
+        self.users.discard(params['UserName'])
+
+    def iam_CreateLoginProfile(self, params):
+        self.require_user(params['UserName'])
+        return {"LoginProfile": {"UserName": params['UserName']}}
+
+    def iam_DeleteLoginProfile(self, params):
+        self.require_user(params['UserName'])
+
+    def iam_CreateAccessKey(self, params):
+        self.require_user(params['UserName'])
+        return {"AccessKey": {"UserName": params['UserName'], "AccessKeyId": 'AKIA' + uuid.uuid4().hex[:16].upper(),
+                              "Status": 'Active', "SecretAccessKey": uuid.uuid4().hex}}
+
+    def iam_DeleteAccessKey(self, params):
+        self.require_user(params['UserName'])
+
+    def iam_ListUsers(self, params):
+        return {"Users": [{"UserName": name, "Arn": user_arn(name)} for name in sorted(self.users)],
+                "IsTruncated": False}
+
+    def iam_GetGroup(self, params):
+        group_name = params['GroupName']
+        self.require_group(group_name)
+        return {
+            "Group": {"GroupName": group_name, "Arn": group_arn(group_name)},
+            "Users": [{"UserName": name, "Arn": user_arn(name)} for name in sorted(self.members.get(group_name, ()))],
+            "IsTruncated": False,
+        }
+
+    def iam_CreateGroup(self, params):
+        if params['GroupName'] in self.groups:
+            raise StubError('EntityAlreadyExists', f"Group with name {params['GroupName']} already exists.", 409)
+        self.groups.add(params['GroupName'])
+        return {"Group": {"GroupName": params['GroupName'], "Arn": group_arn(params['GroupName'])}}
+
+    def iam_DeleteGroup(self, params):
+        group_name = params['GroupName']
+        self.require_group(group_name)
+        if self.members.get(group_name) or self.attached.get(group_name):
+            raise StubError('DeleteConflict', 'Cannot delete entity, must remove users from group first.', 409)
+        self.groups.discard(group_name)
+
+    def iam_ListGroups(self, params):
+        return {"Groups": [{"GroupName": name, "Arn": group_arn(name)} for name in sorted(self.groups)],
+                "IsTruncated": False}
+
+    def iam_AddUserToGroup(self, params):
+        self.require_user(params['UserName'])
+        self.require_group(params['GroupName'])
+        self.members.setdefault(params['GroupName'], set()).add(params['UserName'])
+
+    def iam_RemoveUserFromGroup(self, params):
+        self.require_group(params['GroupName'])
+        self.members.get(params['GroupName'], set()).discard(params['UserName'])
+
+    def iam_AttachGroupPolicy(self, params):
+        self.require_group(params['GroupName'])
+        self.attached.setdefault(params['GroupName'], set()).add(params['PolicyArn'])
+
+    def iam_DetachGroupPolicy(self, params):
+        self.require_group(params['GroupName'])
+        self.attached.get(params['GroupName'], set()).discard(params['PolicyArn'])
+
+    def iam_ListAttachedGroupPolicies(self, params):
+        self.require_group(params['GroupName'])
+        arns = sorted(self.attached.get(params['GroupName'], ()))
+        return {"AttachedPolicies": [{"PolicyName": arn.rsplit('/', 1)[-1], "PolicyArn": arn} for arn in arns],
+                "IsTruncated": False}
+
+    def iam_ListGroupPolicies(self, params):
+        self.require_group(params['GroupName'])
+        return {"PolicyNames": [], "IsTruncated": False}
+
+    def iam_DeleteGroupPolicy(self, params):
+        self.require_group(params['GroupName'])
+
+    def iam_CreatePolicy(self, params):
+        arn = policy_arn(params['PolicyName'])
+        if arn in self.policies:
+            raise StubError('EntityAlreadyExists', f"A policy called {params['PolicyName']} already exists.", 409)
+        self.policies[arn] = params['PolicyName']
+        return {"Policy": {"PolicyName": params['PolicyName'], "Arn": arn, "AttachmentCount": 0}}
+
+    def iam_GetPolicy(self, params):
+        arn = params['PolicyArn']
+        if arn not in self.policies:
+            raise StubError('NoSuchEntity', f'Policy {arn} does not exist.', 404)
+        attachments = sum(arn in arns for arns in self.attached.values())
+        return {"Policy": {"PolicyName": self.policies[arn], "Arn": arn, "AttachmentCount": attachments}}
+
+    def iam_DeletePolicy(self, params):
+        arn = params['PolicyArn']
+        if arn not in self.policies:
+            raise StubError('NoSuchEntity', f'Policy {arn} does not exist.', 404)
+        del self.policies[arn]
+
+    def iam_ListPolicies(self, params):
+        return {"Policies": [{"PolicyName": name, "Arn": arn} for arn, name in sorted(self.policies.items())],
+                "IsTruncated": False}
+
+    # CodeCommit, called with the lock held
+
+    def codecommit_CreateRepository(self, params):
+        repo_name = params['repositoryName']
+        if repo_name in self.repos:
+            raise StubError('RepositoryNameExistsException', f'Repository named {repo_name} already exists')
+        self.repos.add(repo_name)
+        return {"repositoryMetadata": repository_metadata(repo_name)}
+
+    def codecommit_DeleteRepository(self, params):
+        repo_name = params['repositoryName']
+        if repo_name not in self.repos:
+            # CodeCommit answers an empty body for a repository that does not exist
+            return {}
+        self.repos.discard(repo_name)
+        return {"repositoryId": repository_metadata(repo_name)['repositoryId']}
+
+    def codecommit_GetRepository(self, params):
+        repo_name = params['repositoryName']
+        if repo_name not in self.repos:
+            raise StubError('RepositoryDoesNotExistException', f'{repo_name} does not exist')
+        return {"repositoryMetadata": repository_metadata(repo_name)}
+
+    def codecommit_ListRepositories(self, params):
+        return {"repositories": [{"repositoryName": name, "repositoryId": repository_metadata(name)['repositoryId']}
+                                 for name in sorted(self.repos)]}
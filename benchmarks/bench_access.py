@@ -0,0 +1,86 @@
+"""
+Latency of the effective access queries, user -> repos and repo -> users, and of a full
+audit export from access_matrix against one user -> repos query per user.
+
+    python benchmarks/bench_access.py --users 10000 --teams 300 --repos 5000 --queries 2000
+
+Every team has one developer policy granting a repo name prefix and one single repo,
+every user is a member of three random teams.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source import create_app
+from source import db as source_db
+from source.access import get_repo_access, get_user_access, iter_access_matrix
+from source.policy import get_policy_template
+
+ARN = 'arn:aws-cn:codecommit:cn-north-1:123456789012'
+
+
+def seed(app, users, teams, repos):
+    rng = random.Random(0)
+    names = [f'svc{i % teams}-repo{i}' for i in range(repos)]
+    template = get_policy_template('developer')
+    with app.app_context():
+        source_db.init_db()
+        db = source_db.get_db()
+        db.executemany("insert into repo (repo_name, aws_arn) values (?, ?)", [(name, f'{ARN}:{name}') for name in names])
+        db.executemany(
+            "insert into policy (policy_name, detail, operator, aws_arn) values (?, ?, 1, ?)",
+            [(f'team{i}_developer', template.render([f'{ARN}:svc{i}-*', f'{ARN}:{rng.choice(names)}']),
+              f'arn:aws-cn:iam::123456789012:policy/team{i}_developer') for i in range(teams)]
+        )
+        db.executemany(
+            "insert into team_policy (team_name, policy_arn) values (?, ?)",
+            [(f'team{i}', f'arn:aws-cn:iam::123456789012:policy/team{i}_developer') for i in range(teams)]
+        )
+        db.executemany(
+            "insert or ignore into team_member (user_name, team_name) values (?, ?)",
+            [(f'user{i}@sample.com', f'team{rng.randrange(teams)}') for i in range(users) for _ in range(3)]
+        )
+        db.commit()
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--teams', type=int, default=300)
+    parser.add_argument('--repos', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app({'DATABASE': os.path.join(tempfile.mkdtemp(), 'bench.sqlite')})
+    names = seed(app, args.users, args.teams, args.repos)
+    with app.app_context():
+        # first call parses every policy into policy_resource and fills access_matrix
+        start = time.perf_counter()
+        get_user_access('user0@sample.com')
+        print(f'indexing {args.teams} policies: {(time.perf_counter() - start) * 1000:.1f} ms')
+        for label, query, keys in (
+            ('user -> repos', get_user_access, [f'user{i % args.users}@sample.com' for i in range(args.queries)]),
+            ('repo -> users', get_repo_access, [names[i % len(names)] for i in range(args.queries)]),
+        ):
+            start = time.perf_counter()
+            for key in keys:
+                query(key)
+            elapsed = time.perf_counter() - start
+            print(f'{label}: {elapsed / args.queries * 1000:.3f} ms per query')
+
+        start = time.perf_counter()
+        rows = sum(1 for _ in iter_access_matrix(0, 500))
+        print(f'matrix export: {rows} rows in {(time.perf_counter() - start) * 1000:.1f} ms')
+        start = time.perf_counter()
+        rows = sum(len(get_user_access(f'user{i}@sample.com')) for i in range(args.users))
+        print(f'per user fan-out: {rows} rows in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Overhead of the check_token decorator with and without the verified-token cache.
+
+    python benchmarks/bench_check_token.py --calls 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source import create_app
+from source.decorators import check_token
+from source.tokens import issue_token
+
+
+@check_token
+def view():
+    return 'ok'
+
+
+def run(app, headers, calls):
+    with app.test_request_context('/', headers=headers):
+        assert view() == 'ok'
+        start = time.perf_counter()
+        for _ in range(calls):
+            view()
+        return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    email = 'tom@sample.com'
+    print(f'{"token cache":<14}{"us/call":>12}')
+    for maxsize in (0, 10000):
+        app = create_app({'TOKEN_CACHE_MAXSIZE': maxsize})
+        with app.app_context():
+            headers = {'X-USER-NAME': email, 'X-USER-TOKEN': issue_token(email, 'AKIAEXAMPLE')}
+        per_call = run(app, headers, args.calls)
+        print(f'{maxsize:<14}{per_call * 1e6:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
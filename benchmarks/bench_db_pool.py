@@ -0,0 +1,71 @@
+"""
+Requests/sec of /user/get/<email> and /repo/index with and without the sqlite connection pool.
+
+    python benchmarks/bench_db_pool.py --users 5000 --repos 5000 --requests 2000
+
+IAM is not called, get_iam_user is replaced by a constant so only the database path is measured.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source import create_app
+from source import db as source_db
+from source import user as source_user
+
+
+def seed(app, users, repos):
+    with app.app_context():
+        source_db.init_db()
+        db = source_db.get_db()
+        db.executemany(
+            "insert into user (user_name, email, password, operator) values (?, ?, 'x', 1)",
+            [(f'user{i}', f'user{i}@sample.com') for i in range(users)]
+        )
+        db.executemany(
+            "insert into repo (repo_name, project_id, description) values (?, ?, 'bench')",
+            [(f'repo{i}', i % 100) for i in range(repos)]
+        )
+        db.commit()
+
+
+def run(client, path_for, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.get(path_for(i))
+        response.get_data()
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repos', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    source_user.get_iam_user = lambda email: {'User': {'UserName': email}}
+    database = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    scenarios = [
+        ('/user/get/<email>', lambda i: f'/user/get/user{i % args.users}@sample.com', args.requests),
+        ('/repo/index?limit=100', lambda i: f'/repo/index?limit=100&after={(i * 100) % args.repos}', args.requests),
+        ('/repo/index', lambda i: '/repo/index', max(args.requests // 100, 5)),
+    ]
+    seeded = False
+    print(f'{"route":<28}{"pool":>8}{"req/s":>12}')
+    for name, path_for, requests in scenarios:
+        for pool_size in (0, 8):
+            app = create_app({'DATABASE': database, 'SQLITE_POOL_SIZE': pool_size})
+            if not seeded:
+                seed(app, args.users, args.repos)
+                seeded = True
+            rate = run(app.test_client(), path_for, requests)
+            print(f'{name:<28}{pool_size:>8}{rate:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,535 @@
+"""
+Throughput and p50/p99 latency of every route of repo, user, team, project and policy,
+against a seeded database and stubbed IAM and CodeCommit. Runs fully offline.
+
+    python benchmarks/bench_routes.py --output routes.json
+    python benchmarks/bench_routes.py --aws-latency 50 --throttle-rate 0.05 --baseline routes.json
+    python benchmarks/bench_routes.py --users 2000 --repos 1000 --teams 200 --requests 50 --route /team/
+
+The database is seeded with --users users, each a member of --memberships teams, --repos
+repositories and --teams teams with one developer policy each, granting the repositories of
+the team prefix, and access_matrix is filled from them. IAM and CodeCommit are
+answered by benchmarks/aws_stub.py behind real boto3 clients, so retries, source.ratelimit
+(--rate-limit) and source.metrics run on every call.
+
+Requests go through the WSGI app in process from --concurrency threads, so the numbers do not
+include an HTTP server. Destructive scenarios work on entities set aside at the top of each
+seeded range, reads never see them, so the seeded volumes must exceed what --requests and
+--batch set aside; the script names the minimum before seeding. Results are written as JSON
+to --output and compared with a previous run by --baseline.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# never reach real credentials, config files or the instance metadata service
+os.environ.update({
+    'AWS_ACCESS_KEY_ID': 'AKIABENCHMARK',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'AWS_DEFAULT_REGION': 'cn-north-1',
+    'AWS_CONFIG_FILE': os.devnull,
+    'AWS_SHARED_CREDENTIALS_FILE': os.devnull,
+    'AWS_EC2_METADATA_DISABLED': 'true',
+})
+
+from werkzeug.security import generate_password_hash
+
+from aws_stub import CODECOMMIT_ARN, StubAWS, policy_arn
+from source import aws, create_app
+from source import db as source_db
+from source.access import index_policy_resources
+from source.policy import get_policy_template
+from source.tokens import REFRESH, issue_token
+
+PASSWORD = 'bench-password'
+
+
+def user_email(i):
+    return f'user{i}@sample.com'
+
+
+def team_name(t):
+    return f'team{t}'
+
+
+def repo_name(i, teams):
+    return f'svc{i % teams}-repo{i}'
+
+
+def team_policy_name(t):
+    return f'team{t}_developer'
+
+
+def member_teams(i, args):
+    return [(i * args.memberships + k) % args.teams for k in range(args.memberships)]
+
+
+def seed(app, stub, args):
+    """
+    fill the database and the stub with the same entities, ids are the index + 1
+    """
+    password = generate_password_hash(PASSWORD)
+    template = get_policy_template('developer')
+    repos = [repo_name(i, args.teams) for i in range(args.repos)]
+    with app.app_context():
+        source_db.init_db()
+        db = source_db.get_db()
+        with db:
+            db.executemany(
+                "insert into project (id, project_name, status, operator) values (?, ?, '正常', 1)",
+                [(p + 1, f'project{p}') for p in range(args.projects)]
+            )
+            db.executemany(
+                "insert into user (id, user_name, email, password, operator, aws_arn, ak, sk)"
+                " values (?, ?, ?, ?, 1, ?, ?, 'sk')",
+                [(i + 1, f'user{i}', user_email(i), password, f'arn:aws-cn:iam::123456789012:user/{user_email(i)}',
+                  f'AKIA{i:016d}') for i in range(args.users)]
+            )
+            db.executemany(
+                "insert into repo (id, repo_name, project_id, project_name, owner_id, owner_name, aws_arn)"
+                " values (?, ?, ?, ?, 1, 'owner', ?)",
+                [(i + 1, name, i % args.projects + 1, f'project{i % args.projects}', f'{CODECOMMIT_ARN}:{name}')
+                 for i, name in enumerate(repos)]
+            )
+            db.executemany(
+                "insert into team (id, team_name, operator, aws_arn) values (?, ?, 1, ?)",
+                [(t + 1, team_name(t), f'arn:aws-cn:iam::123456789012:group/{team_name(t)}')
+                 for t in range(args.teams)]
+            )
+            db.executemany(
+                "insert into team_project (team_id, team_name, project_id, project_name, operator)"
+                " values (?, ?, ?, ?, 1)",
+                [(t + 1, team_name(t), t % args.projects + 1, f'project{t % args.projects}')
+                 for t in range(args.teams)]
+            )
+            db.executemany(
+                "insert into policy (policy_name, detail, operator, aws_arn) values (?, ?, 1, ?)",
+                [(team_policy_name(t), template.render([f'{CODECOMMIT_ARN}:svc{t}-*']),
+                  policy_arn(team_policy_name(t))) for t in range(args.teams)]
+            )
+            db.executemany(
+                "insert into team_policy (team_name, policy_arn) values (?, ?)",
+                [(team_name(t), policy_arn(team_policy_name(t))) for t in range(args.teams)]
+            )
+            db.executemany(
+                "insert into team_member (user_name, team_name) values (?, ?)",
+                [(user_email(i), team_name(t)) for i in range(args.users) for t in member_teams(i, args)]
+            )
+        # parsing the policies adds their grant paths to access_matrix
+        index_policy_resources(db)
+        db.execute('analyze')
+        matrix_rows = db.execute('select count(*) from access_matrix').fetchone()[0]
+    stub.seed(
+        users=[user_email(i) for i in range(args.users)],
+        groups=[team_name(t) for t in range(args.teams)],
+        members=[(user_email(i), team_name(t)) for i in range(args.users) for t in member_teams(i, args)],
+        policies=[team_policy_name(t) for t in range(args.teams)],
+        attached=[(team_name(t), policy_arn(team_policy_name(t))) for t in range(args.teams)],
+        repos=repos,
+    )
+    return matrix_rows
+
+
+def batch_requests(args):
+    # batch deletes remove about as many entities as the single deletes
+    return max(args.requests // args.batch, 1)
+
+
+def minimum_sizes(args):
+    """
+    :return: dict of seeded kind -> smallest volume that leaves entities for reads after the reservations
+    """
+    n = args.requests
+    batch_deleted = batch_requests(args) * args.batch
+    return {
+        # deleted users
+        'users': n + 1,
+        # deleted repos, three distinct repos for every created policy
+        'repos': n + 3 * n + 1,
+        # deleted and batch deleted teams, then one team per add_group request, which must not repeat a
+        # (team, project) pair, and a team every user of add_member is not a member of
+        'teams': n + batch_deleted + max(n, args.memberships + 1),
+        # deleted and batch deleted projects
+        'projects': n + batch_deleted + 1,
+    }
+
+
+class Reserve(object):
+    """
+    indices of seeded entities, reads use the low end and destructive scenarios take blocks from the top
+    """
+
+    def __init__(self, kind, size):
+        self.kind = kind
+        self.size = size
+        self.top = size
+
+    def take(self, count):
+        # main() checks minimum_sizes before seeding
+        if count >= self.top:
+            raise SystemExit(f"not enough {self.kind} seeded for the destructive scenarios, raise --{self.kind}")
+        self.top -= count
+        return self.top
+
+    def pick(self, i):
+        return i % self.top
+
+
+class Scenario(object):
+    """
+    :param build: fn(i) -> dict of path and test client keyword arguments of the i-th request
+    """
+
+    def __init__(self, route, method, build, requests):
+        self.route = route
+        self.method = method
+        self.build = build
+        self.requests = requests
+
+    @property
+    def name(self):
+        return f'{self.method} {self.route}'
+
+
+def scenarios(app, args):
+    n = args.requests
+    full = args.full_requests
+    batch = args.batch
+    batch_n = batch_requests(args)
+    users = Reserve('users', args.users)
+    repos = Reserve('repos', args.repos)
+    teams = Reserve('teams', args.teams)
+    projects = Reserve('projects', args.projects)
+    deleted_users = users.take(n)
+    deleted_repos = repos.take(n)
+    # every created policy grants its own repos, so none has the document of another and is reused
+    policy_repos = repos.take(3 * n)
+    deleted_teams = teams.take(n)
+    batch_deleted_teams = teams.take(batch_n * batch)
+    deleted_projects = projects.take(n)
+    batch_deleted_projects = projects.take(batch_n * batch)
+    deleted_policies = deleted_teams
+    stamp = int(time.time())
+
+    # refresh tokens are issued up front, issuing is measured by /user/get_token
+    with app.app_context():
+        refresh_tokens = [issue_token(user_email(i), f'AKIA{i:016d}', REFRESH) for i in range(min(n, users.top))]
+
+    def email(i):
+        return user_email(users.pick(i))
+
+    def team(i):
+        return teams.pick(i)
+
+    def new_team(i):
+        # a team user i is not a member of, outside the teams set aside for deletion
+        user = users.pick(i)
+        member = set(member_teams(user, args))
+        t = (user * args.memberships + args.memberships) % teams.top
+        while t in member:
+            t = (t + 1) % teams.top
+        return t
+
+    def repo_spec(name):
+        return {"repo_name": name, "project_id": 1, "project_name": 'project0', "owner_id": 1,
+                "owner_name": 'owner', "description": 'bench'}
+
+    def user_spec(name):
+        return {"user_name": name, "email": f'{name}@sample.com', "password": PASSWORD}
+
+    return [
+        Scenario('/repo/index?limit=100', 'GET', lambda i: {"path": f'/repo/index?limit=100&after={i * 100 % repos.top}'}, n),
+        Scenario('/repo/index', 'GET', lambda i: {"path": '/repo/index'}, full),
+        Scenario('/repo/get/<repo_name>', 'GET',
+                 lambda i: {"path": f'/repo/get/{repo_name(repos.pick(i), args.teams)}'}, n),
+        Scenario('/repo/create', 'PUT', lambda i: {"path": '/repo/create', "data": repo_spec(f'bench{stamp}-repo{i}')}, n),
+        Scenario('/repo/batch_create', 'PUT', lambda i: {
+            "path": '/repo/batch_create',
+            "json": [repo_spec(f'bench{stamp}-batch{i}-{k}') for k in range(batch)],
+        }, n),
+        Scenario('/repo/delete/<repo_name>', 'DELETE',
+                 lambda i: {"path": f'/repo/delete/{repo_name(deleted_repos + i, args.teams)}'}, n),
+
+        Scenario('/user/index?limit=100', 'GET', lambda i: {"path": f'/user/index?limit=100&after={i * 100 % users.top}'}, n),
+        Scenario('/user/index', 'GET', lambda i: {"path": '/user/index'}, full),
+        Scenario('/user/get/<email>', 'GET', lambda i: {"path": f'/user/get/{email(i)}'}, n),
+        Scenario('/user/get_token', 'GET', lambda i: {
+            "path": '/user/get_token', "headers": {"X-USER-NAME": email(i), "X-USER-PASSWORD": PASSWORD},
+        }, n),
+        Scenario('/user/refresh_token', 'GET', lambda i: {
+            "path": '/user/refresh_token',
+            "headers": {"X-USER-NAME": user_email(i % len(refresh_tokens)),
+                        "X-REFRESH-TOKEN": refresh_tokens[i % len(refresh_tokens)]},
+        }, n),
+        Scenario('/user/create', 'PUT', lambda i: {"path": '/user/create', "data": user_spec(f'bench{stamp}-user{i}')}, n),
+        Scenario('/user/batch_create', 'PUT', lambda i: {
+            "path": '/user/batch_create', "json": [user_spec(f'bench{stamp}-batch{i}-{k}') for k in range(batch)],
+        }, n),
+        Scenario('/user/delete/<email>', 'DELETE', lambda i: {"path": f'/user/delete/{user_email(deleted_users + i)}'}, n),
+
+        Scenario('/team/index?limit=100', 'GET', lambda i: {"path": f'/team/index?limit=100&after={i * 100 % teams.top}'}, n),
+        Scenario('/team/index', 'GET', lambda i: {"path": '/team/index'}, full),
+        Scenario('/team/get/<team_id>', 'GET', lambda i: {"path": f'/team/get/{team(i) + 1}'}, n),
+        Scenario('/team/get_users/<team_name>', 'GET', lambda i: {"path": f'/team/get_users/{team_name(team(i))}'}, n),
+        Scenario('/team/get_policies/<team_name>', 'GET',
+                 lambda i: {"path": f'/team/get_policies/{team_name(team(i))}'}, n),
+        Scenario('/team/create', 'PUT', lambda i: {
+            "path": '/team/create', "data": {"team_name": f'bench{stamp}-team{i}', "status": '正常'},
+        }, n),
+        Scenario('/team/update_name/<team_id>', 'POST', lambda i: {
+            # renamed to its own name, members and policies keep pointing at it
+            "path": f'/team/update_name/{team(i) + 1}', "data": {"team_name": team_name(team(i))},
+        }, n),
+        Scenario('/team/update_status/<team_id>', 'POST', lambda i: {
+            "path": f'/team/update_status/{team(i) + 1}', "data": {"status": '正常'},
+        }, n),
+        Scenario('/team/add_member', 'PUT', lambda i: {
+            "path": '/team/add_member', "data": {"user_name": email(i), "team_name": team_name(new_team(i))},
+        }, n),
+        Scenario('/team/delete_member', 'DELETE', lambda i: {
+            "path": '/team/delete_member', "data": {"user_name": email(i), "team_name": team_name(new_team(i))},
+        }, n),
+        Scenario('/team/batch_add_member', 'PUT', lambda i: {
+            "path": '/team/batch_add_member',
+            "json": [{"user_name": email(i * batch + k), "team_name": team_name(new_team(i * batch + k))}
+                     for k in range(batch)],
+        }, n),
+        Scenario('/team/batch_delete_member', 'DELETE', lambda i: {
+            "path": '/team/batch_delete_member',
+            "json": [{"user_name": email(i * batch + k), "team_name": team_name(new_team(i * batch + k))}
+                     for k in range(batch)],
+        }, n),
+        Scenario('/team/attach_policy', 'PUT', lambda i: {
+            "path": '/team/attach_policy',
+            "data": {"team_name": team_name(team(i)), "policy_arn": policy_arn(team_policy_name((team(i) + 1) % teams.top))},
+        }, n),
+        Scenario('/team/detach_policy', 'DELETE', lambda i: {
+            "path": '/team/detach_policy',
+            "data": {"team_name": team_name(team(i)), "policy_arn": policy_arn(team_policy_name((team(i) + 1) % teams.top))},
+        }, n),
+        Scenario('/team/delete/<team_id>', 'DELETE', lambda i: {"path": f'/team/delete/{deleted_teams + i + 1}'}, n),
+        Scenario('/team/batch_delete', 'DELETE', lambda i: {
+            "path": '/team/batch_delete',
+            "data": {"team_ids": ','.join(str(batch_deleted_teams + i * batch + k + 1) for k in range(batch))},
+        }, batch_n),
+
+        Scenario('/project/index?limit=100', 'GET',
+                 lambda i: {"path": f'/project/index?limit=100&after={i * 100 % projects.top}'}, n),
+        Scenario('/project/index', 'GET', lambda i: {"path": '/project/index'}, full),
+        Scenario('/project/get/<project_id>', 'GET', lambda i: {"path": f'/project/get/{projects.pick(i) + 1}'}, n),
+        Scenario('/project/get_groups/<project_id>', 'GET',
+                 lambda i: {"path": f'/project/get_groups/{projects.pick(i) + 1}'}, n),
+        Scenario('/project/create', 'PUT', lambda i: {
+            "path": '/project/create', "data": {"project_name": f'bench{stamp}-project{i}', "status": '正常'},
+        }, n),
+        Scenario('/project/update_name/<project_id>', 'POST', lambda i: {
+            "path": f'/project/update_name/{projects.pick(i) + 1}', "data": {"project_name": f'project{projects.pick(i)}'},
+        }, n),
+        Scenario('/project/update_status/<project_id>', 'POST', lambda i: {
+            "path": f'/project/update_status/{projects.pick(i) + 1}', "data": {"status": '正常'},
+        }, n),
+        Scenario('/project/add_group', 'PUT', lambda i: {
+            "path": '/project/add_group',
+            "data": {"group_id": team(i) + 1, "group_name": team_name(team(i)),
+                     "project_id": (team(i) + 1) % projects.top + 1, "project_name": 'bench'},
+        }, n),
+        Scenario('/project/delete/<project_id>', 'DELETE',
+                 lambda i: {"path": f'/project/delete/{deleted_projects + i + 1}'}, n),
+        Scenario('/project/batch_delete', 'DELETE', lambda i: {
+            "path": '/project/batch_delete',
+            "data": {"project_ids": ','.join(str(batch_deleted_projects + i * batch + k + 1) for k in range(batch))},
+        }, batch_n),
+
+        Scenario('/policy/index', 'GET', lambda i: {"path": '/policy/index'}, full),
+        Scenario('/policy/get_policy/<policy_name>', 'GET',
+                 lambda i: {"path": f'/policy/get_policy/{team_policy_name(team(i))}'}, n),
+        Scenario('/policy/create?dry_run=1', 'PUT', lambda i: {
+            "path": '/policy/create',
+            "data": {"policy_type": 'developer', "dry_run": '1',
+                     "repos": ','.join(repo_name(repos.pick(i * 3 + k), args.teams) for k in range(3))},
+        }, n),
+        Scenario('/policy/create', 'PUT', lambda i: {
+            "path": '/policy/create',
+            "data": {"policy_type": 'developer',
+                     "repos": ','.join(repo_name(policy_repos + i * 3 + k, args.teams) for k in range(3))},
+        }, n),
+        Scenario('/policy/delete_policy/<policy_name>', 'DELETE',
+                 lambda i: {"path": f'/policy/delete_policy/{team_policy_name(deleted_policies + i)}'}, n),
+    ]
+
+
+def failure(response, body):
+    """
+    :return: None for a successful response, else a short description
+    """
+    if response.status_code >= 400:
+        return f'status {response.status_code}'
+    if response.mimetype != 'application/json':
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        # streamed index bodies are checked by their status only
+        return None
+    if isinstance(payload, dict) and payload.get('succeeded') is False:
+        return str(payload.get('message'))[:200]
+    return None
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(app, stub, scenario, concurrency):
+    local = threading.local()
+
+    def one(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        kwargs = scenario.build(i)
+        path = kwargs.pop('path')
+        start = time.perf_counter()
+        response = client.open(path, method=scenario.method, **kwargs)
+        body = response.get_data()
+        elapsed = time.perf_counter() - start
+        return elapsed, failure(response, body)
+
+    aws_before = stub.stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(scenario.requests)))
+    wall = time.perf_counter() - start
+    aws_after = stub.stats()
+    latencies = [elapsed for elapsed, _ in results]
+    failures = [error for _, error in results if error is not None]
+    return {
+        "route": scenario.route,
+        "method": scenario.method,
+        "requests": scenario.requests,
+        "concurrency": concurrency,
+        "errors": len(failures),
+        "first_error": failures[0] if failures else None,
+        "throughput": scenario.requests / wall,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "aws_calls": aws_after['calls'] - aws_before['calls'],
+        "aws_throttled": aws_after['throttled'] - aws_before['throttled'],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {f"{item['method']} {item['route']}": item for item in json.load(f)['results']}
+    print(f'\ncompared with {baseline_path}')
+    print(f'{"route":<46}{"req/s":>10}{"p50":>10}{"p99":>10}')
+    for item in results:
+        name = f"{item['method']} {item['route']}"
+        old = baseline.get(name)
+        if old is None:
+            print(f'{name:<46}{"new":>10}')
+            continue
+        print(f'{name:<46}{item["throughput"] / old["throughput"] - 1:>+10.1%}'
+              f'{item["p50_ms"] / old["p50_ms"] - 1:>+10.1%}{item["p99_ms"] / old["p99_ms"] - 1:>+10.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--repos', type=int, default=50000)
+    parser.add_argument('--teams', type=int, default=5000)
+    parser.add_argument('--projects', type=int, default=1000)
+    parser.add_argument('--memberships', type=int, default=5, help='teams per user')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--full-requests', type=int, default=5, help='requests of the unpaged index routes')
+    parser.add_argument('--batch', type=int, default=10, help='items per batch request')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--aws-latency', type=float, default=20, help='milliseconds per AWS attempt')
+    parser.add_argument('--aws-jitter', type=float, default=0.5, help='fraction of the latency added or removed')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='probability of a throttling error')
+    parser.add_argument('--rate-limit', action='store_true', help='keep the AWS_RATE_LIMITS of the service')
+    parser.add_argument('--route', default=None, help='only run routes containing this text')
+    parser.add_argument('--verbose', action='store_true', help='print the log of the service, e.g. slow sql')
+    parser.add_argument('--output', default='bench_routes.json')
+    parser.add_argument('--baseline', default=None, help='results of a previous run to compare with')
+    args = parser.parse_args()
+    short = [f'--{kind} {minimum}' for kind, minimum in minimum_sizes(args).items() if getattr(args, kind) < minimum]
+    if short:
+        parser.error(f'--requests {args.requests} and --batch {args.batch} need at least {", ".join(short)}')
+
+    workdir = tempfile.mkdtemp(prefix='bench-routes-')
+    app = create_app({
+        'DATABASE': os.path.join(workdir, 'bench.sqlite'),
+        'JOB_WORKERS': 0,
+        'AWS_RATE_LIMIT_DB': os.path.join(workdir, 'ratelimit.sqlite') if args.rate_limit else None,
+    })
+    if not args.verbose:
+        # slow statement warnings would be interleaved with the results
+        log = logging.FileHandler(os.path.join(workdir, 'service.log'))
+        app.logger.handlers[:] = [log]
+        app.logger.propagate = False
+        print(f'service log: {log.baseFilename}')
+    stub = StubAWS(args.aws_latency / 1000, args.aws_jitter, args.throttle_rate)
+    for service in ('iam', 'codecommit'):
+        stub.install(aws.get_client(service))
+
+    start = time.perf_counter()
+    matrix_rows = seed(app, stub, args)
+    print(f'seeded {args.users} users, {args.repos} repos, {args.teams} teams, {matrix_rows} access rows '
+          f'in {time.perf_counter() - start:.1f} s')
+
+    results = []
+    print(f'{"route":<46}{"requests":>9}{"errors":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"aws":>8}')
+    for scenario in scenarios(app, args):
+        if args.route and args.route not in scenario.name:
+            continue
+        item = run(app, stub, scenario, args.concurrency)
+        results.append(item)
+        print(f'{scenario.name:<46}{item["requests"]:>9}{item["errors"]:>8}{item["throughput"]:>10.1f}'
+              f'{item["p50_ms"]:>10.2f}{item["p99_ms"]:>10.2f}{item["aws_calls"]:>8}')
+
+    report = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "args": vars(args),
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'results written to {args.output}')
+    # the seeded database is several hundred MB at the default volumes, the log is kept
+    for name in os.listdir(workdir):
+        if name.endswith(('.sqlite', '.sqlite-wal', '.sqlite-shm')):
+            os.remove(os.path.join(workdir, name))
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Time to import source and run create_app() in a fresh interpreter, as a worker boot would.
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+from source import create_app
+create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, '-c', SNIPPET], cwd=ROOT)
+        samples.append(float(output.decode().strip().splitlines()[-1]) * 1000)
+    samples.sort()
+    print(f'create_app() over {args.runs} runs: '
+          f'median {statistics.median(samples):.1f} ms, min {samples[0]:.1f} ms, max {samples[-1]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,59 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'source.sqlite'),
-        Host='0.0.0.0',
-        Port=5000
+        HOST='0.0.0.0',
+        PORT=5000,
+        INDEX_MAX_PAGE_SIZE=1000,
+        INDEX_STREAM_BATCH=500,
+        JSON_ENCODER='auto',
+        SQLITE_POOL_SIZE=8,
+        SQLITE_STATEMENT_CACHE=256,
+        SQLITE_PRAGMAS={},
+        IAM_CACHE_TTL=300,
+        IAM_CACHE_NEGATIVE_TTL=30,
+        IAM_CACHE_MAXSIZE=10000,
+        IAM_CACHE_BACKEND=None,
+        TOKEN_CACHE_MAXSIZE=10000,
+        TOKEN_SECRET='Asia_Info_88*',
+        ACCESS_TOKEN_LIFETIME=600,
+        REFRESH_TOKEN_LIFETIME=7 * 24 * 3600,
+        BATCH_MAX_WORKERS=8,
+        AWS_CLIENT_CONFIG={},
+        AWS_EXECUTOR_WORKERS=32,
+        # requests per second and burst per API family, see source.ratelimit
+        AWS_RATE_LIMITS={
+            'iam:read': (20, 20),
+            'iam:write': (5, 10),
+            'codecommit:read': (10, 20),
+            'codecommit:write': (5, 10),
+        },
+        AWS_RATE_LIMIT_DB=os.path.join(app.instance_path, 'aws_ratelimit.sqlite'),
+        SERVER_WORKERS=None,
+        SERVER_WORKER_CLASS=None,
+        SERVER_TIMEOUT=60,
+        SERVER_KEEPALIVE=5,
+        SERVER_MIGRATE=True,
+        IAM_POLICY_MAX_SIZE=6144,
+        # repo lists too long for one policy are collapsed into prefix wildcards this long at least, 0 disables
+        POLICY_MIN_WILDCARD_PREFIX=3,
+        RECONCILE_INTERVAL=0,
+        RECONCILE_MAX_AGE=900,
+        JOB_WORKERS=2,
+        JOB_POLL_INTERVAL=1.0,
+        JOB_LEASE=300,
+        JOB_MAX_ATTEMPTS=5,
+        JOB_RETRY_BASE=2,
+        JOB_RETRY_MAX=300,
+        # seconds a queued job keeps its secrets, e.g. the password of user.create
+        JOB_SECRET_TTL=3600,
+        # snapshot directory shared by worker processes, serve() creates one for several workers
+        METRICS_DIR=None,
+        METRICS_FLUSH_INTERVAL=5,
+        # seconds, statements taking longer are logged with their query plan, None disables it
+        SQL_SLOW_THRESHOLD=0.5,
+        # per statement debug log, N+1 and full scan warnings, X-SQL-Queries and Server-Timing headers
+        SQL_PROFILE=False,
+        SQL_PROFILE_REPEAT=10
     )
 
     if test_config is None:
@@ -31,6 +82,27 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    from . import aws
+    aws.init_app(app)
+
+    from . import cache
+    cache.init_app(app)
+
+    from . import server
+    server.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
+    from . import profiler
+    profiler.init_app(app)
+
+    from . import reconcile
+    reconcile.init_app(app)
+
+    from . import jobs
+    jobs.init_app(app)
+
     from . import auth
     app.register_blueprint(auth.bp)
     from . import team
@@ -43,4 +115,6 @@ def create_app(test_config=None):
     app.register_blueprint(repo.bp)
     from . import policy
     app.register_blueprint(policy.bp)
+    from . import access
+    app.register_blueprint(access.bp)
     return app
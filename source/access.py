@@ -0,0 +1,464 @@
+"""
+Effective repo access: user -> team_member -> team_policy -> policy_resource -> repo.
+
+policy_resource holds the codecommit resources of every policy, parsed once from
+policy.detail, so both directions are a single joined query. A repo matches a resource
+when its arn lies in the range of the resource prefix and GLOBs the resource, IAM
+wildcards * and ? mean the same in GLOB.
+
+access_matrix materializes the highest level per (user, repo). Every mutation of its inputs
+adds or subtracts the grant paths it creates or removes, in the transaction of the mutation,
+so exports read one table and the matrix is never rebuilt. ``flask access check`` compares it
+with a full recompute.
+
+Deny statements lower the level a policy grants on the resources they cover, e.g. a Deny of
+codecommit:GitPush on app-* turns an Allow of developer actions on app-* or app-web into read.
+Grants are still over-reported where IAM would deny: a Deny narrower than the Allow it cuts
+into (Allow on *, Deny on app-*), a Deny in another policy of the same user, NotAction and
+NotResource statements, and conditional Denies are not evaluated.
+"""
+import fnmatch
+
+import click
+from flask import Blueprint, current_app, request
+
+from source.api_response import *
+from source.db import get_db
+
+bp = Blueprint('access', __name__, url_prefix='/access')
+
+ACCESS_LEVELS = ('read', 'write', 'admin')
+
+# action granted by each level, checked against the Action patterns of a statement
+LEVEL_ACTIONS = (
+    ('admin', 'codecommit:DeleteRepository'),
+    ('write', 'codecommit:GitPush'),
+    ('read', 'codecommit:GitPull'),
+)
+
+# AWS managed policies have no detail in the policy table
+MANAGED_POLICY_ACCESS = {
+    'AWSCodeCommitFullAccess': 'admin',
+    'AWSCodeCommitPowerUser': 'write',
+    'AWSCodeCommitReadOnly': 'read',
+}
+
+# any character sorts below it, so prefix <= arn < prefix || char(1114111) holds for every arn
+# starting with prefix
+USER_ACCESS_SQL = """
+    select r.repo_name, r.aws_arn, pr.access, m.team_name, p.policy_name
+    from team_member m
+    join team_policy tp on tp.team_name = m.team_name
+    join policy p on p.aws_arn = tp.policy_arn
+    join policy_resource pr on pr.policy_arn = tp.policy_arn
+    join repo r on r.aws_arn >= pr.prefix and r.aws_arn < pr.prefix || char(1114111)
+        and r.aws_arn glob pr.resource
+    where m.user_name = ?
+"""
+
+REPO_ACCESS_SQL = """
+    select m.user_name, pr.access, m.team_name, p.policy_name
+    from repo r
+    join policy_resource pr on r.aws_arn >= pr.prefix and r.aws_arn < pr.prefix || char(1114111)
+        and r.aws_arn glob pr.resource
+    join team_policy tp on tp.policy_arn = pr.policy_arn
+    join policy p on p.aws_arn = pr.policy_arn
+    join team_member m on m.team_name = tp.team_name
+    where r.repo_name = ?
+"""
+
+
+# grant paths, one row per (member, attached policy, resource, matching repo)
+PATHS_SQL = """
+    from team_member m
+    join team_policy tp on tp.team_name = m.team_name
+    join policy_resource pr on pr.policy_arn = tp.policy_arn
+    join repo r on r.aws_arn >= pr.prefix and r.aws_arn < pr.prefix || char(1114111)
+        and r.aws_arn glob pr.resource
+"""
+
+RECOMPUTE_SQL = f"""
+    select m.user_name, r.repo_name, sum(pr.access = 'read'), sum(pr.access = 'write'), sum(pr.access = 'admin')
+    {PATHS_SQL}
+    group by m.user_name, r.repo_name
+"""
+
+
+def as_list(value):
+    return [value] if isinstance(value, str) else value
+
+
+def statement_access(statement, denied=()):
+    """
+    :param denied: action patterns denied on the resource the statement is evaluated for
+    :return: highest access level a statement grants on codecommit, None if it grants none
+    """
+    if statement.get('Effect') != 'Allow' or 'Condition' in statement:
+        return None
+    actions = as_list(statement.get('Action', []))
+    for level, action in LEVEL_ACTIONS:
+        if any(fnmatch.fnmatchcase(action, pattern) for pattern in actions) and \
+                not any(fnmatch.fnmatchcase(action, pattern) for pattern in denied):
+            return level
+    return None
+
+
+def denied_actions(resource, denies):
+    """
+    :param denies: list of (resource patterns, action patterns) of the Deny statements of a policy
+    :return: action patterns denied on every repo a resource matches
+    """
+    patterns = []
+    for deny_resources, deny_actions in denies:
+        if any(fnmatch.fnmatchcase(resource, pattern) for pattern in deny_resources):
+            patterns.extend(deny_actions)
+    return patterns
+
+
+def codecommit_resources(statement):
+    return [resource for resource in as_list(statement.get('Resource', []))
+            if resource == '*' or ':codecommit:' in resource]
+
+
+def policy_resources(detail):
+    """
+    :param detail: policy document text
+    :return: dict of codecommit resource -> highest access level granted on it
+    """
+    statements = json.loads(detail).get('Statement', [])
+    # a conditional Deny may not apply, only unconditional ones lower the granted level
+    denies = [
+        (as_list(statement.get('Resource', [])), as_list(statement.get('Action', [])))
+        for statement in statements
+        if statement.get('Effect') == 'Deny' and 'Condition' not in statement
+    ]
+    resources = {}
+    for statement in statements:
+        for resource in codecommit_resources(statement):
+            level = statement_access(statement, denied_actions(resource, denies))
+            if level is None:
+                continue
+            current = resources.get(resource)
+            if current is None or ACCESS_LEVELS.index(level) > ACCESS_LEVELS.index(current):
+                resources[resource] = level
+    return resources
+
+
+def resource_prefix(resource):
+    end = len(resource)
+    for wildcard in '*?':
+        position = resource.find(wildcard)
+        if position != -1:
+            end = min(end, position)
+    return resource[:end]
+
+
+def index_policy_resources(db):
+    """
+    parse every policy not indexed yet into policy_resource
+    :return: number of policies indexed
+    """
+    with db:
+        return parse_pending_policies(db)
+
+
+def parse_pending_policies(db):
+    """
+    index_policy_resources without committing. A pending policy has no policy_resource rows,
+    so indexing it only adds its grant paths and may happen before or after any other mutation
+    """
+    rows = db.execute(
+        "select policy_name, detail, aws_arn from policy where resources_indexed = 0"
+    ).fetchall()
+    if not rows:
+        return 0
+    entries = []
+    for policy_name, detail, aws_arn in rows:
+        if aws_arn is None:
+            continue
+        if detail:
+            resources = policy_resources(detail)
+        elif policy_name in MANAGED_POLICY_ACCESS:
+            resources = {'*': MANAGED_POLICY_ACCESS[policy_name]}
+        else:
+            resources = {}
+        entries.extend(
+            (aws_arn, resource, resource_prefix(resource), level) for resource, level in resources.items()
+        )
+    policy_arns = {row[2] for row in rows if row[2] is not None}
+    for policy_arn in policy_arns:
+        apply_paths(db, -1, "pr.policy_arn = ?", (policy_arn,))
+    db.executemany("delete from policy_resource where policy_arn = ?", [(arn,) for arn in policy_arns])
+    db.executemany(
+        "insert or replace into policy_resource (policy_arn, resource, prefix, access) values (?, ?, ?, ?)",
+        entries
+    )
+    for policy_arn in policy_arns:
+        apply_paths(db, 1, "pr.policy_arn = ?", (policy_arn,))
+    db.executemany("update policy set resources_indexed = 1 where policy_name = ?", [(row[0],) for row in rows])
+    return len(rows)
+
+
+def apply_paths(db, sign, condition, params):
+    """
+    add (sign 1) or subtract (sign -1) the grant paths matching condition to access_matrix.
+    Paths are read from the current tables: call it after inserting an input row, before deleting one.
+    Caller commits
+    """
+    db.execute(
+        f"""
+        insert into access_matrix (user_name, repo_name, read_grants, write_grants, admin_grants)
+        select m.user_name, r.repo_name,
+            ? * sum(pr.access = 'read'), ? * sum(pr.access = 'write'), ? * sum(pr.access = 'admin')
+        {PATHS_SQL}
+        where {condition}
+        group by m.user_name, r.repo_name
+        on conflict(user_name, repo_name) do update set
+            read_grants = read_grants + excluded.read_grants,
+            write_grants = write_grants + excluded.write_grants,
+            admin_grants = admin_grants + excluded.admin_grants
+        """,
+        (sign, sign, sign) + tuple(params)
+    )
+    if sign < 0:
+        db.execute("delete from access_matrix where read_grants = 0 and write_grants = 0 and admin_grants = 0")
+
+
+def add_member_access(db, user_name, team_name):
+    apply_paths(db, 1, "m.user_name = ? and m.team_name = ?", (user_name, team_name))
+
+
+def remove_member_access(db, user_name, team_name):
+    apply_paths(db, -1, "m.user_name = ? and m.team_name = ?", (user_name, team_name))
+
+
+def remove_team_access(db, team_name):
+    apply_paths(db, -1, "m.team_name = ?", (team_name,))
+
+
+def add_policy_access(db, team_name, policy_arn):
+    apply_paths(db, 1, "tp.team_name = ? and tp.policy_arn = ?", (team_name, policy_arn))
+    # a policy created since the last index counts its paths, the new one included, when parsed
+    parse_pending_policies(db)
+
+
+def remove_policy_access(db, team_name, policy_arn):
+    apply_paths(db, -1, "tp.team_name = ? and tp.policy_arn = ?", (team_name, policy_arn))
+
+
+def add_repo_access(db, repo_name):
+    apply_paths(db, 1, "r.repo_name = ?", (repo_name,))
+
+
+def remove_repo_access(db, repo_name):
+    db.execute("delete from access_matrix where repo_name = ?", (repo_name,))
+
+
+def check_access_matrix(db, repair=False):
+    """
+    compare access_matrix with a full recompute
+    :return: list of (user_name, repo_name, stored counts, expected counts), counts are None when the row is absent
+    """
+    index_policy_resources(db)
+    stored = {
+        (row[0], row[1]): tuple(row[2:])
+        for row in db.execute("select user_name, repo_name, read_grants, write_grants, admin_grants from access_matrix")
+    }
+    expected = {(row[0], row[1]): tuple(row[2:]) for row in db.execute(RECOMPUTE_SQL)}
+    differences = [
+        (key[0], key[1], stored.get(key), expected.get(key))
+        for key in sorted(stored.keys() | expected.keys())
+        if stored.get(key) != expected.get(key)
+    ]
+    if repair and differences:
+        with db:
+            db.executemany("delete from access_matrix where user_name = ? and repo_name = ?",
+                           [(user_name, repo_name) for user_name, repo_name, _, _ in differences])
+            db.executemany(
+                "insert into access_matrix (user_name, repo_name, read_grants, write_grants, admin_grants) "
+                "values (?, ?, ?, ?, ?)",
+                [(user_name, repo_name) + counts for user_name, repo_name, _, counts in differences if counts]
+            )
+    return differences
+
+
+def min_access_arg():
+    access = request.args.get('access', 'read')
+    if access not in ACCESS_LEVELS:
+        raise ValueError(f"access must be one of {', '.join(ACCESS_LEVELS)}")
+    return ACCESS_LEVELS.index(access)
+
+
+def merge_grants(rows, key, min_level):
+    """
+    fold rows of (key..., access, team_name, policy_name) into one entry per key with the highest
+    access and every team and policy granting it
+    """
+    grants = {}
+    for row in rows:
+        *keys, access, team_name, policy_name = row
+        level = ACCESS_LEVELS.index(access)
+        grant = grants.get(keys[0])
+        if grant is None:
+            grant = grants[keys[0]] = dict(zip(key, keys), access=access, via=[])
+        elif level > ACCESS_LEVELS.index(grant['access']):
+            grant['access'] = access
+        via = {"team_name": team_name, "policy_name": policy_name, "access": access}
+        if via not in grant['via']:
+            grant['via'].append(via)
+    return sorted(
+        (grant for grant in grants.values() if ACCESS_LEVELS.index(grant['access']) >= min_level),
+        key=lambda grant: grant[key[0]]
+    )
+
+
+def get_user_access(user_name, min_level=0):
+    db = get_db()
+    index_policy_resources(db)
+    rows = db.execute(USER_ACCESS_SQL, (user_name,)).fetchall()
+    return merge_grants(rows, ('repo_name', 'aws_arn'), min_level)
+
+
+def get_repo_access(repo_name, min_level=0):
+    db = get_db()
+    index_policy_resources(db)
+    rows = db.execute(REPO_ACCESS_SQL, (repo_name,)).fetchall()
+    return merge_grants(rows, ('user_name',), min_level)
+
+
+@bp.route('/user/<string:user_name>', methods=('GET',))
+def user_access(user_name):
+    """
+    查询用户可访问的代码仓库
+    ---
+    tags:
+      - access
+    parameters:
+        - name: user_name
+          in: path
+          description: 用户名(邮箱)
+          required: true
+          schema:
+            type: string
+        - name: access
+          in: query
+          description: 最低权限
+          required: false
+          schema:
+            type: string
+            default: read
+            enum:
+              - read
+              - write
+              - admin
+    responses:
+        '200':
+          description: Successful operation
+        '505':
+          description: Server internal issue
+    """
+    try:
+        repos = get_user_access(user_name, min_access_arg())
+    except Exception as e:
+        return failed_without_data(str(e))
+    return succeeded_with_data(repos)
+
+
+@bp.route('/repo/<string:repo_name>', methods=('GET',))
+def repo_access(repo_name):
+    """
+    查询可访问代码仓库的用户
+    ---
+    tags:
+      - access
+    parameters:
+        - name: repo_name
+          in: path
+          description: 代码仓库名称
+          required: true
+          schema:
+            type: string
+        - name: access
+          in: query
+          description: 最低权限
+          required: false
+          schema:
+            type: string
+            default: read
+            enum:
+              - read
+              - write
+              - admin
+    responses:
+        '200':
+          description: Successful operation
+        '505':
+          description: Server internal issue
+    """
+    try:
+        users = get_repo_access(repo_name, min_access_arg())
+    except Exception as e:
+        return failed_without_data(str(e))
+    return succeeded_with_data(users)
+
+
+def iter_access_matrix(min_level, batch_size):
+    # the connection of the view is closed once it returns, the cursor is opened while streaming
+    levels = ACCESS_LEVELS[min_level:]
+    cursor = get_db().execute(
+        f"select user_name, repo_name, access from access_matrix "
+        f"where access in ({', '.join('?' * len(levels))}) order by user_name, repo_name",
+        levels
+    )
+    for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+        for row in rows:
+            yield {"user_name": row[0], "repo_name": row[1], "access": row[2]}
+
+
+@bp.route('/matrix', methods=('GET',))
+def matrix():
+    """
+    导出全部用户与代码仓库的访问权限
+    ---
+    tags:
+      - access
+    parameters:
+        - name: access
+          in: query
+          description: 最低权限
+          required: false
+          schema:
+            type: string
+            default: read
+            enum:
+              - read
+              - write
+              - admin
+    responses:
+        '200':
+          description: Successful operation
+        '505':
+          description: Server internal issue
+    """
+    try:
+        min_level = min_access_arg()
+        index_policy_resources(get_db())
+    except Exception as e:
+        return failed_without_data(str(e))
+    batch_size = current_app.config['INDEX_STREAM_BATCH']
+    return stream_response(iter_access_matrix(min_level, batch_size), batch_size)
+
+
+@bp.cli.command('check')
+@click.option('--repair', is_flag=True, help='rewrite the rows that differ')
+def check_command(repair):
+    """Verify access_matrix against a full recompute."""
+    differences = check_access_matrix(get_db(), repair)
+    for user_name, repo_name, stored, expected in differences:
+        click.echo(f"{user_name} {repo_name}: stored {stored}, expected {expected}")
+    if not differences:
+        click.echo("access_matrix is consistent")
+    elif repair:
+        click.echo(f"{len(differences)} rows repaired")
+    else:
+        raise click.exceptions.Exit(1)
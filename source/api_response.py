@@ -1,21 +1,116 @@
 import json
 
+from flask import current_app, g, has_request_context, request, stream_with_context
 
-def succeeded_with_data(data):
-    result = {"succeeded": True, "payload": data, "message": None}
-    return json.dumps(result, ensure_ascii=False, indent=2)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_encoder(data, pretty=False):
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def orjson_encoder(data, pretty=False):
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(data, default=str, option=option)
+
+
+# name -> callable(data, pretty) returning utf-8 bytes
+ENCODERS = {'json': json_encoder}
+if orjson is not None:
+    ENCODERS['orjson'] = orjson_encoder
+
+
+def register_encoder(name, encoder):
+    ENCODERS[name] = encoder
+
+
+def get_encoder():
+    """
+    resolve JSON_ENCODER config, 'auto' prefers the C-backed encoder when it is installed
+    """
+    name = current_app.config.get('JSON_ENCODER', 'auto')
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in ENCODERS else 'json'
+    return ENCODERS[name]
+
+
+def pretty_requested():
+    return has_request_context() and request.args.get('pretty', '0') not in ('0', 'false', '')
+
+
+def encode(data):
+    return get_encoder()(data, pretty_requested())
+
+
+def json_response(result):
+    return current_app.response_class(encode(result), mimetype='application/json')
+
+
+def succeeded_with_data(data, message=None):
+    result = {"succeeded": True, "payload": data, "message": message}
+    return json_response(result)
 
 
 def succeeded_without_data(message):
     result = {"succeeded": True, "payload": None, "message": message}
-    return json.dumps(result, ensure_ascii=False, indent=2)
+    return json_response(result)
+
+
+def mark_failed():
+    # failures are answered with status 200, source.metrics counts them as errors through this flag
+    if has_request_context():
+        g.api_failed = True
 
 
 def failed_without_data(message):
+    mark_failed()
     result = {"succeeded": False, "payload": None, "message": message}
-    return json.dumps(result, ensure_ascii=False, indent=2)
+    return json_response(result)
 
 
 def failed_with_data(data, message):
+    mark_failed()
     result = {"succeeded": False, "payload": data, "message": message}
-    return json.dumps(result, ensure_ascii=False, indent=2)
+    return json_response(result)
+
+
+def succeeded_with_page(data, next_after):
+    result = {"succeeded": True, "payload": data, "message": None, "next_after": next_after}
+    return json_response(result)
+
+
+def stream_succeeded_with_data(items, chunk_size=100):
+    """
+    yield the succeeded envelope piece by piece so that payload never sits in memory as a whole
+    :param items: iterable of json serializable objects
+    :param chunk_size: number of items written per chunk
+    """
+    encoder = get_encoder()
+    pretty = pretty_requested()
+    yield b'{"succeeded":true,"payload":['
+    chunk = []
+    separator = b''
+    for item in items:
+        chunk.append(separator)
+        chunk.append(encoder(item, pretty))
+        separator = b','
+        if len(chunk) >= chunk_size * 2:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+    yield b'],"message":null}'
+
+
+def stream_response(items, chunk_size=100):
+    return current_app.response_class(
+        stream_with_context(stream_succeeded_with_data(items, chunk_size)),
+        mimetype='application/json'
+    )
@@ -0,0 +1,79 @@
+"""
+ASGI entry point, e.g. ``uvicorn source.asgi:app`` or ``python -m source.server``.
+
+Flask stays a WSGI application: connections, keep-alive and slow clients are handled on the
+event loop, and each request runs on a pool of threads, not one thread per connection.
+AWS calls inside a request block the worker thread of that request, never the loop; views
+that make independent calls overlap them through source.aws.submit and gather.
+Requires asgiref 3.x, whose WsgiToAsgiInstance.run_wsgi_app is re-wrapped below.
+"""
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+except ImportError as e:
+    raise ImportError("asgiref is required for the ASGI entry point, pip install asgiref") from e
+
+from source import create_app
+from source.db import get_pool
+
+
+def unwrapped_run_wsgi_app():
+    """
+    the plain function asgiref wraps in a thread-sensitive sync_to_async, an asgiref internal
+    """
+    func = getattr(WsgiToAsgiInstance.__dict__.get('run_wsgi_app'), 'func', None)
+    if not callable(func):
+        raise ImportError(
+            "unsupported asgiref version, WsgiToAsgiInstance.run_wsgi_app is no longer a sync_to_async "
+            "wrapper, pin asgiref>=3.3,<4"
+        )
+    return func
+
+
+class ThreadedInstance(WsgiToAsgiInstance):
+    # asgiref runs wrapped WSGI apps thread-sensitive, i.e. one request at a time per process
+    run_wsgi_app = sync_to_async(unwrapped_run_wsgi_app(), thread_sensitive=False)
+
+
+class AsgiApp(WsgiToAsgi):
+
+    def __init__(self, flask_app):
+        super().__init__(flask_app)
+        self.flask_app = flask_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        await ThreadedInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # worker process is forked by now, connections opened here stay in it
+                with self.flask_app.app_context():
+                    pool = get_pool()
+                    if pool is not None:
+                        pool.prewarm()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                with self.flask_app.app_context():
+                    pool = get_pool()
+                    if pool is not None:
+                        pool.close_all()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(test_config=None):
+    return AsgiApp(create_app(test_config))
+
+
+def __getattr__(name):
+    # ``source.asgi:app`` is built on first access so importing AsgiApp has no side effects
+    global app
+    if name == 'app':
+        app = create_asgi_app()
+        return app
+    raise AttributeError(name)
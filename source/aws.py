@@ -0,0 +1,108 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from source import metrics, ratelimit
+
+# botocore settings applied to every client, overridden from app config by init_app
+CLIENT_CONFIG = {
+    'max_pool_connections': 50,
+    'tcp_keepalive': True,
+    'connect_timeout': 5,
+    'read_timeout': 30,
+}
+
+_clients = {}
+_clients_pid = os.getpid()
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+executor_workers = 32
+# source.ratelimit.RateLimiter installed on every new client, None disables limiting
+rate_limiter = None
+
+
+def get_client(service):
+    """
+    shared boto3 client of a service, created on first use.
+    boto3 clients are thread safe but must not cross a fork
+    """
+    global _clients, _clients_pid
+    client = _clients.get(service) if _clients_pid == os.getpid() else None
+    if client is None:
+        with _lock:
+            if _clients_pid != os.getpid():
+                _clients = {}
+                _clients_pid = os.getpid()
+            client = _clients.get(service)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+                client = boto3.session.Session().client(service, config=Config(**CLIENT_CONFIG))
+                metrics.install_aws(client)
+                if rate_limiter is not None:
+                    ratelimit.install(client, rate_limiter)
+                _clients[service] = client
+    return client
+
+
+class LazyClient(object):
+    """
+    module level stand-in for a boto3 client, resolved through get_client on first attribute access
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service), name)
+
+
+def get_executor():
+    """
+    process wide pool that runs blocking AWS calls
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix='aws')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """
+    start a blocking AWS call in the background
+    :return: concurrent.futures.Future
+    """
+    return get_executor().submit(fn, *args, **kwargs)
+
+
+def gather(*futures, timeout=None):
+    """
+    wait for every future, then return results in order or raise the first error.
+    All calls are allowed to finish so none is left running unobserved
+    """
+    results = []
+    error = None
+    for future in futures:
+        try:
+            results.append(future.result(timeout=timeout))
+        except Exception as e:
+            results.append(None)
+            error = error or e
+    if error is not None:
+        raise error
+    return results
+
+
+def init_app(app):
+    global executor_workers, rate_limiter
+    with _lock:
+        CLIENT_CONFIG.update(app.config['AWS_CLIENT_CONFIG'])
+        _clients.clear()
+        executor_workers = app.config['AWS_EXECUTOR_WORKERS']
+        rate_limiter = None
+        if app.config['AWS_RATE_LIMIT_DB']:
+            rate_limiter = ratelimit.RateLimiter(app.config['AWS_RATE_LIMIT_DB'], app.config['AWS_RATE_LIMITS'])
@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+
+def run_batch(fn, items, max_workers=None):
+    """
+    call fn on every item over a bounded thread pool, order of items is kept.
+    fn runs inside a fresh app context of the current app
+    :return: list of (result, exception), exception is None on success
+    """
+    if not items:
+        return []
+    app = current_app._get_current_object()
+    if max_workers is None:
+        max_workers = app.config['BATCH_MAX_WORKERS']
+
+    def call(item):
+        with app.app_context():
+            try:
+                return fn(item), None
+            except Exception as e:
+                return None, e
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
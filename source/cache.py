@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Blueprint
+
+from source.api_response import *
+
+bp = Blueprint('cache', __name__, url_prefix='/cache')
+
+
+class MemoryBackend(object):
+    """
+    process local LRU dict of key -> (expires, value)
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SqliteBackend(object):
+    """
+    cache shared by worker processes through a sqlite file.
+    Values are stored as json, datetimes in IAM responses come back as strings
+    """
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self.local = threading.local()
+        self.writes = 0
+        self.connection().execute(
+            "create table if not exists cache(key text primary key, value text, expires real)"
+        )
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self.connection().execute(
+            "select value from cache where key = ? and expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        conn = self.connection()
+        conn.execute(
+            "insert or replace into cache (key, value, expires) values (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + ttl)
+        )
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self.prune(conn)
+
+    def prune(self, conn):
+        conn.execute("delete from cache where expires <= ?", (time.time(),))
+        conn.execute(
+            "delete from cache where key in "
+            "(select key from cache order by expires desc limit -1 offset ?)",
+            (self.maxsize,)
+        )
+
+    def delete(self, key):
+        self.connection().execute("delete from cache where key = ?", (key,))
+
+    def clear(self):
+        self.connection().execute("delete from cache")
+
+
+class TTLCache(object):
+    """
+    read-through cache, a loader result of None is cached for negative_ttl only
+    """
+
+    def __init__(self, backend, ttl, negative_ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, loader):
+        found, value = self.backend.get(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.backend.set(key, value, self.ttl if value is not None else self.negative_ttl)
+        return value
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# shared by user, team and policy blueprints, configured by init_app
+iam_cache = TTLCache(MemoryBackend(10000), 300, 30)
+# token digest -> user name of tokens already verified by check_token, kept until token expiry
+verified_tokens = MemoryBackend(10000)
+
+
+def configure(cache, maxsize, ttl, negative_ttl, backend_path=None):
+    if backend_path:
+        cache.backend = SqliteBackend(backend_path, maxsize)
+    else:
+        cache.backend = MemoryBackend(maxsize)
+    cache.ttl = ttl
+    cache.negative_ttl = negative_ttl
+
+
+@bp.route('/stats', methods=('GET',))
+def stats():
+    """
+    展示IAM缓存命中情况
+    ---
+    tags:
+      - cache
+    responses:
+        '200':
+          description: Successful operation
+    """
+    return succeeded_with_data({"iam": iam_cache.stats()})
+
+
+def init_app(app):
+    configure(
+        iam_cache,
+        app.config['IAM_CACHE_MAXSIZE'],
+        app.config['IAM_CACHE_TTL'],
+        app.config['IAM_CACHE_NEGATIVE_TTL'],
+        app.config['IAM_CACHE_BACKEND']
+    )
+    verified_tokens.maxsize = app.config['TOKEN_CACHE_MAXSIZE']
+    verified_tokens.clear()
+    app.register_blueprint(bp)
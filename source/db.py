@@ -1,16 +1,147 @@
+import os
+import queue
 import sqlite3
+import threading
+import time
 import click
 
 from flask import current_app, g
 
+from source import metrics, profiler
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+}
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    connection reporting the duration of every statement to source.metrics,
+    and its rows and plan to source.profiler while profile is set
+    """
+    profile = None
+
+    def execute(self, sql, parameters=()):
+        if self.profile is not None:
+            return self.cursor(profiler.ProfiledCursor).execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_statement(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        if self.profile is not None:
+            return self.cursor(profiler.ProfiledCursor).executemany(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.observe_statement(sql, time.perf_counter() - start)
+
+
+class ConnectionPool(object):
+    """
+    keep idle sqlite connections around so a request does not pay for connect,
+    schema parse and pragma setup. Connections are handed to one thread at a time.
+    """
+
+    def __init__(self, database, size, pragmas, cached_statements):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            factory=TimedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        # load schema now rather than on the first query of a request
+        conn.execute('select count(*) from sqlite_master').fetchone()
+        return conn
+
+    def prewarm(self, count=None):
+        for _ in range(min(count or self.size, self.size)):
+            self.release(self.connect())
+
+    def acquire(self):
+        if self.pid != os.getpid():
+            # connections must not cross a fork, start over in the child
+            self.pid = os.getpid()
+            self.idle = queue.LifoQueue(maxsize=self.size)
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        if self.pid != os.getpid():
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    pool of current app, None when SQLITE_POOL_SIZE is 0
+    """
+    config = current_app.config
+    if config['SQLITE_POOL_SIZE'] <= 0:
+        return None
+    database = config['DATABASE']
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                pragmas = dict(DEFAULT_PRAGMAS, **config['SQLITE_PRAGMAS'])
+                pool = ConnectionPool(database, config['SQLITE_POOL_SIZE'], pragmas,
+                                      config['SQLITE_STATEMENT_CACHE'])
+                _pools[database] = pool
+    return pool
+
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        pool = get_pool()
+        if pool is None:
+            g.db = sqlite3.connect(
+                current_app.config['DATABASE'],
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                factory=TimedConnection
+            )
+            g.db.row_factory = sqlite3.Row
+        else:
+            g.db = pool.acquire()
+        profiler.start(g.db)
 
     return g.db
 
@@ -18,13 +149,56 @@ def get_db():
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        profiler.stop(db)
+        pool = get_pool()
+        if pool is None:
+            db.close()
+        else:
+            pool.release(db)
 
 
 def init_db():
     db = get_db()
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf-8'))
+    migrate_db()
+
+
+def list_migrations():
+    """
+    migrations/NNNN_description.sql sorted by version
+    :return: list of (version, file name)
+    """
+    folder = os.path.join(current_app.root_path, 'migrations')
+    migrations = []
+    for name in os.listdir(folder):
+        if name.endswith('.sql'):
+            migrations.append((int(name.split('_', 1)[0]), name))
+    return sorted(migrations)
+
+
+def migrate_db():
+    """
+    apply pending migrations in order, each one in its own transaction.
+    Applied version is tracked by PRAGMA user_version
+    :return: list of applied file names
+    """
+    db = get_db()
+    current = db.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    for version, name in list_migrations():
+        if version <= current:
+            continue
+        with current_app.open_resource(f'migrations/{name}') as f:
+            script = f.read().decode('utf-8')
+        try:
+            db.executescript(f'BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;')
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.rollback()
+            raise
+        applied.append(name)
+    return applied
 
 
 @click.command('init-db')
@@ -33,6 +207,15 @@ def init_db_command():
     click.echo('Initialized the database')
 
 
+@click.command('migrate-db')
+def migrate_db_command():
+    applied = migrate_db()
+    for name in applied:
+        click.echo(f'Applied {name}')
+    click.echo(f'Database is up to date, {len(applied)} migration(s) applied')
+
+
 def init_app(app):
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
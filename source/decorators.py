@@ -1,8 +1,11 @@
 from flask import request, g
 from functools import wraps
+import hashlib
+import time
 import jwt
 from source.api_response import *
-from werkzeug.security import check_password_hash
+from source.cache import verified_tokens
+from source.tokens import decode_token
 
 # def retrieve_token(f):
 #     @wraps(f)
@@ -17,16 +20,18 @@ from werkzeug.security import check_password_hash
 def check_token(f):
     @wraps(f)
     def get_token(*args, **kwargs):
-        secret = "Asia_Info_88*"
-
         user_name = request.headers.get('X-USER-NAME', None)
         token = request.headers.get('X-USER-TOKEN', None)
+        if user_name is None or token is None:
+            return failed_without_data(f"User {user_name} not authorized")
+        digest = hashlib.sha256(f'{user_name}\n{token}'.encode('utf-8')).digest()
+        if verified_tokens.get(digest)[0]:
+            return f(*args, **kwargs)
         try:
-            payload = jwt.decode(token, secret, algorithms="HS256")
-            iss = payload['iss']
-            identify_hash = payload['data']['hash']
-            identify = user_name + iss
-            if check_password_hash(identify_hash, identify):
+            payload = decode_token(token, user_name)
+            if payload is not None:
+                # same token is accepted without verifying again until it expires
+                verified_tokens.set(digest, user_name, payload['exp'] - time.time())
                 return f(*args, **kwargs)
             else:
                 return failed_without_data(f"User {user_name} not authorized")
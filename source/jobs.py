@@ -0,0 +1,317 @@
+"""
+Outbox of AWS mutations.
+
+A view called with ?async=1 stores its intent in the job table and returns the job id at
+once. Workers claim jobs with one UPDATE ... RETURNING, so several threads and processes
+can share the queue, and run the handler registered for the job kind. A claim is a lease:
+a job whose worker died is claimed again once JOB_LEASE seconds have passed. Failures are
+retried with exponential backoff up to JOB_MAX_ATTEMPTS. Handlers may run more than once
+and must be idempotent, current_job() tells them which attempt they are in.
+
+Payload keys a handler declares as secrets, e.g. a password, never enter the job row. They
+are kept in job_secret for JOB_SECRET_TTL seconds and deleted as soon as the job finishes.
+"""
+import os
+import threading
+
+import click
+from flask import Blueprint, current_app, g, request, url_for
+
+from source.api_response import *
+from source.db import get_db
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+# kind -> (handler, payload keys kept in job_secret instead of the job row)
+HANDLERS = {}
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class JobFailed(Exception):
+    """
+    raised by a handler when retrying cannot help
+    """
+
+
+def job_handler(kind, secrets=()):
+    """
+    register fn(payload) as the handler of a job kind, its return value is stored as the job result
+    """
+    def register(fn):
+        HANDLERS[kind] = (fn, tuple(secrets))
+        return fn
+    return register
+
+
+def current_job():
+    """
+    :return: (id, attempt) of the job whose handler runs in this app context, None outside of one
+    """
+    return g.get('job')
+
+
+def async_requested():
+    return request.args.get('async', '0') not in ('0', 'false', '')
+
+
+def enqueue(db, kind, payload):
+    """
+    record a job in the transaction of the caller, caller commits and then calls notify()
+    :return: job id
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler for job kind {kind}")
+    secrets = HANDLERS[kind][1]
+    cursor = db.execute(
+        "insert into job (kind, payload, max_attempts) values (?, ?, ?)",
+        (kind, json.dumps({key: value for key, value in payload.items() if key not in secrets}, ensure_ascii=False),
+         current_app.config['JOB_MAX_ATTEMPTS'])
+    )
+    db.executemany(
+        "insert into job_secret (job_id, name, value, expires) values (?, ?, ?, datetime('now', ?))",
+        [(cursor.lastrowid, key, payload[key], f"+{int(current_app.config['JOB_SECRET_TTL'])} seconds")
+         for key in secrets if key in payload]
+    )
+    return cursor.lastrowid
+
+
+def enqueue_response(kind, payload):
+    """
+    queue a job for a view and answer with its id and status url
+    """
+    try:
+        db = get_db()
+        job_id = enqueue(db, kind, payload)
+        db.commit()
+    except Exception as e:
+        return failed_without_data(str(e))
+    notify()
+    return succeeded_with_data(
+        {"job_id": job_id, "status": PENDING, "status_url": url_for('jobs.get_job', job_id=job_id)},
+        f"Job {job_id} queued"
+    )
+
+
+def claim(db, worker_id, lease):
+    """
+    take the oldest runnable job
+    :return: (id, kind, payload, attempts, max_attempts) or None
+    """
+    row = db.execute(
+        """
+        update job set status = 'running', attempts = attempts + 1, locked_by = ?,
+            locked_until = datetime('now', ?), updated = CURRENT_TIMESTAMP
+        where id = (
+            select id from (
+                select id from job where status = 'pending' and run_after <= datetime('now')
+                union all
+                select id from job where status = 'running' and locked_until < datetime('now')
+            ) order by id limit 1
+        )
+        returning id, kind, payload, attempts, max_attempts
+        """,
+        (worker_id, f'+{int(lease)} seconds')
+    ).fetchone()
+    db.commit()
+    return row
+
+
+def load_secrets(db, job_id):
+    return dict(db.execute(
+        "select name, value from job_secret where job_id = ? and expires > datetime('now')", (job_id,)
+    ).fetchall())
+
+
+def finish(db, job_id, worker_id, status, result=None, error=None, retry_in=None):
+    # the worker that lost its lease must not overwrite the outcome of the one that took over
+    if retry_in is not None:
+        db.execute(
+            """
+            update job set status = 'pending', error = ?, locked_by = null, locked_until = null,
+                run_after = datetime('now', ?), updated = CURRENT_TIMESTAMP
+            where id = ? and locked_by = ?
+            """,
+            (error, f'+{int(retry_in)} seconds', job_id, worker_id)
+        )
+    else:
+        cursor = db.execute(
+            """
+            update job set status = ?, result = ?, error = ?, locked_by = null,
+                locked_until = null, updated = CURRENT_TIMESTAMP
+            where id = ? and locked_by = ?
+            """,
+            (status, result, error, job_id, worker_id)
+        )
+        if cursor.rowcount:
+            db.execute("delete from job_secret where job_id = ?", (job_id,))
+    db.commit()
+
+
+def run_next(worker_id):
+    """
+    claim and run one job inside the current app context
+    :return: False when the queue had nothing to run
+    """
+    config = current_app.config
+    db = get_db()
+    job = claim(db, worker_id, config['JOB_LEASE'])
+    if job is None:
+        return False
+    job_id, kind, payload_text, attempts, max_attempts = job
+    payload = json.loads(payload_text) if payload_text else {}
+    handler, secrets = HANDLERS.get(kind, (None, ()))
+    if handler is None:
+        finish(db, job_id, worker_id, FAILED, error=f"No handler for job kind {kind}")
+        return True
+    if secrets:
+        payload.update(load_secrets(db, job_id))
+        missing = [key for key in secrets if key not in payload]
+        if missing:
+            finish(db, job_id, worker_id, FAILED,
+                   error=f"{', '.join(missing)} of job {job_id} expired, please submit it again")
+            return True
+    g.job = (job_id, attempts)
+    try:
+        result = handler(payload)
+    except Exception as e:
+        db.rollback()
+        if isinstance(e, JobFailed) or attempts >= max_attempts:
+            finish(db, job_id, worker_id, FAILED, error=str(e))
+        else:
+            retry_in = min(config['JOB_RETRY_BASE'] * 2 ** (attempts - 1), config['JOB_RETRY_MAX'])
+            finish(db, job_id, worker_id, PENDING, error=str(e), retry_in=retry_in)
+        return True
+    finally:
+        g.pop('job', None)
+    finish(db, job_id, worker_id, SUCCEEDED, result=json.dumps(result, ensure_ascii=False))
+    return True
+
+
+def run_pending(worker_id='inline'):
+    """
+    run jobs until none is runnable
+    :return: number of jobs run
+    """
+    count = 0
+    while run_next(worker_id):
+        count += 1
+    return count
+
+
+def job_to_dict(row):
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "status": row[2],
+        "attempts": row[3],
+        "max_attempts": row[4],
+        "result": json.loads(row[5]) if row[5] else None,
+        "error": row[6],
+        "run_after": str(row[7]),
+        "created": str(row[8]),
+        "updated": str(row[9]),
+    }
+
+
+@bp.route('/<int:job_id>', methods=('GET',))
+def get_job(job_id):
+    """
+    查询异步任务的状态
+    ---
+    tags:
+      - jobs
+    parameters:
+        - name: job_id
+          in: path
+          description: 任务id
+          required: true
+          schema:
+            type: integer
+            format: int32
+    responses:
+        '200':
+          description: Successful operation
+    """
+    row = get_db().execute(
+        """
+        select id, kind, status, attempts, max_attempts, result, error, run_after, created, updated
+        from job where id = ?
+        """,
+        (job_id,)
+    ).fetchone()
+    if row is None:
+        return succeeded_without_data(f"Job {job_id} not found")
+    return succeeded_with_data(job_to_dict(row))
+
+
+_wakeup = threading.Event()
+
+
+def notify():
+    """
+    wake the workers of this process, others find the job on their next poll
+    """
+    _wakeup.set()
+
+
+class JobWorker(threading.Thread):
+
+    def __init__(self, app, index):
+        super().__init__(name=f'job-worker-{index}', daemon=True)
+        self.app = app
+        self.worker_id = f'{os.getpid()}-{index}'
+
+    def run(self):
+        poll_interval = self.app.config['JOB_POLL_INTERVAL']
+        while True:
+            with self.app.app_context():
+                try:
+                    ran = run_next(self.worker_id)
+                except Exception as e:
+                    self.app.logger.warning(f"job worker failed: {str(e)}")
+                    ran = False
+            if not ran:
+                _wakeup.wait(poll_interval)
+                _wakeup.clear()
+
+
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def start_workers(app, count):
+    with _workers_lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        for index in range(len(_workers), count):
+            worker = JobWorker(app, index)
+            worker.start()
+            _workers.append(worker)
+    return list(_workers)
+
+
+def ensure_workers():
+    # started on first request so that they run in the worker process, not in a preloading master
+    if len(_workers) < current_app.config['JOB_WORKERS'] or not all(worker.is_alive() for worker in _workers):
+        start_workers(current_app._get_current_object(), current_app.config['JOB_WORKERS'])
+
+
+@bp.cli.command('work')
+@click.option('--workers', type=int, default=None, help='defaults to JOB_WORKERS config')
+@click.option('--once', is_flag=True, help='run the runnable jobs and exit')
+def work_command(workers, once):
+    """Drain the job queue."""
+    if once:
+        click.echo(f"{run_pending()} jobs run")
+        return
+    for worker in start_workers(current_app._get_current_object(), workers or current_app.config['JOB_WORKERS'] or 1):
+        worker.join()
+
+
+def init_app(app):
+    app.register_blueprint(bp)
+    if app.config['JOB_WORKERS'] > 0:
+        app.before_request(ensure_workers)
@@ -0,0 +1,276 @@
+"""
+Request, SQLite and AWS metrics in the Prometheus text exposition format at /metrics.
+
+Recording only updates dicts of the current process under a lock. With several worker
+processes each one writes a snapshot of its metrics into METRICS_DIR every
+METRICS_FLUSH_INTERVAL seconds and when it is scraped; /metrics then adds up the snapshots of
+every process. Counters of exited workers stay in the total, as they would in a single process.
+"""
+import bisect
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from flask import Blueprint, current_app, g, request
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+bp = Blueprint('metrics', __name__)
+
+_lock = threading.Lock()
+# name -> metric, in registration order
+_metrics = {}
+
+
+class Counter(object):
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _metrics[name] = self
+
+    def inc(self, labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labelnames": self.labelnames,
+                "values": [[list(labels), value] for labels, value in self.values.items()]}
+
+
+class Histogram(object):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> per bucket counts (last one is +Inf), then sum
+        self.values = {}
+        _metrics[name] = self
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            data[index] += 1
+            data[-1] += value
+
+    def snapshot(self):
+        return {"type": self.type, "help": self.help, "labelnames": self.labelnames, "buckets": self.buckets,
+                "values": [[list(labels), list(data)] for labels, data in self.values.items()]}
+
+
+http_requests = Counter('http_requests_total', 'HTTP requests by route', ('route', 'method', 'status'))
+http_errors = Counter(
+    'http_request_errors_total', 'HTTP requests answered with status >= 500 or succeeded false', ('route', 'method')
+)
+http_latency = Histogram('http_request_duration_seconds', 'Time spent in the view', ('route', 'method'))
+sql_latency = Histogram(
+    'sqlite_statement_duration_seconds', 'SQLite statements issued through get_db', ('operation', 'table'),
+    SQL_BUCKETS
+)
+aws_requests = Counter('aws_requests_total', 'AWS operations by outcome', ('service', 'operation', 'outcome'))
+aws_latency = Histogram('aws_request_duration_seconds', 'AWS operations, retries included', ('service', 'operation'))
+
+
+TABLE_RE = re.compile(r'\b(?:from|into|update|join|table)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+_statement_labels = {}
+
+
+def statement_labels(sql):
+    """
+    (operation, table) of a statement, statements are mostly constants so the result is cached
+    """
+    labels = _statement_labels.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        operation = words[0].lower() if words else ''
+        match = TABLE_RE.search(sql)
+        labels = (operation, match.group(1).lower() if match else '')
+        if len(_statement_labels) < 10000:
+            _statement_labels[sql] = labels
+    return labels
+
+
+def observe_statement(sql, seconds):
+    sql_latency.observe(statement_labels(sql), seconds)
+
+
+def install_aws(client):
+    """
+    time every operation of a botocore client, from the first attempt to the parsed response
+    """
+    service = client.meta.service_model.service_id.hyphenize()
+
+    def before_call(context=None, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+
+    # event names end with the operation, e.g. after-call.iam.GetUser
+    def after_call(event_name=None, context=None, parsed=None, **kwargs):
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        operation = event_name.rsplit('.', 1)[-1]
+        aws_latency.observe((service, operation), time.perf_counter() - start)
+        error = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+        aws_requests.inc((service, operation, error or 'ok'))
+
+    def after_call_error(event_name=None, context=None, exception=None, **kwargs):
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        operation = event_name.rsplit('.', 1)[-1]
+        aws_latency.observe((service, operation), time.perf_counter() - start)
+        aws_requests.inc((service, operation, type(exception).__name__))
+
+    events = client.meta.events
+    events.register(f'before-call.{service}', before_call, unique_id='metrics-before-call')
+    events.register(f'after-call.{service}', after_call, unique_id='metrics-after-call')
+    events.register(f'after-call-error.{service}', after_call_error, unique_id='metrics-after-call-error')
+    return client
+
+
+def start_request():
+    g.metrics_start = time.perf_counter()
+
+
+def finish_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    method = request.method
+    http_latency.observe((route, method), time.perf_counter() - start)
+    http_requests.inc((route, method, str(response.status_code)))
+    if response.status_code >= 500 or g.get('api_failed'):
+        http_errors.inc((route, method))
+    flush_if_due()
+    return response
+
+
+def snapshot():
+    with _lock:
+        return {name: metric.snapshot() for name, metric in _metrics.items()}
+
+
+def merge(snapshots):
+    """
+    add up snapshots of several processes
+    """
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            for labels, value in metric['values']:
+                key = tuple(labels)
+                if metric['type'] == 'counter':
+                    target['values'][key] = target['values'].get(key, 0) + value
+                else:
+                    current = target['values'].get(key)
+                    target['values'][key] = value if current is None else [a + b for a, b in zip(current, value)]
+    return merged
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_text(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def exposition(merged):
+    lines = []
+    for name, metric in merged.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric['labelnames']
+        for labels, value in sorted(metric['values'].items()):
+            if metric['type'] == 'counter':
+                lines.append(f'{name}{label_text(names, labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{name}_bucket{label_text(names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{label_text(names, labels)} {value[-1]}')
+            lines.append(f'{name}_count{label_text(names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+_last_flush = 0.0
+
+
+def flush(directory):
+    """
+    write the snapshot of this process, replacing the previous one atomically
+    """
+    global _last_flush
+    _last_flush = time.monotonic()
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot(), f)
+    os.replace(path, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+def flush_if_due():
+    directory = current_app.config['METRICS_DIR']
+    if directory and time.monotonic() - _last_flush >= current_app.config['METRICS_FLUSH_INTERVAL']:
+        flush(directory)
+
+
+def collect():
+    """
+    :return: merged metrics of every process
+    """
+    directory = current_app.config['METRICS_DIR']
+    if not directory:
+        return merge([snapshot()])
+    flush(directory)
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # a file being replaced, its process is counted on the next scrape
+            continue
+    return merge(snapshots)
+
+
+@bp.route('/metrics', methods=('GET',))
+def metrics():
+    """
+    Prometheus 格式的监控指标
+    ---
+    tags:
+      - metrics
+    responses:
+        '200':
+          description: text exposition format
+    """
+    return current_app.response_class(exposition(collect()), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    if app.config['METRICS_DIR']:
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    app.register_blueprint(bp)
+    app.before_request(start_request)
+    app.after_request(finish_request)
@@ -0,0 +1,16 @@
+-- team_policy had no primary key, rebuild it keeping one row per (team_name, policy_arn)
+CREATE TABLE team_policy_new(
+    team_name text not null,
+    policy_arn text not null,
+    primary key(team_name, policy_arn)
+);
+INSERT OR IGNORE INTO team_policy_new (team_name, policy_arn) SELECT team_name, policy_arn FROM team_policy;
+DROP TABLE team_policy;
+ALTER TABLE team_policy_new RENAME TO team_policy;
+
+-- primary keys only cover lookups by their leading column
+CREATE INDEX IF NOT EXISTS team_member_team_name ON team_member(team_name);
+CREATE INDEX IF NOT EXISTS team_policy_policy_arn ON team_policy(policy_arn);
+CREATE INDEX IF NOT EXISTS team_project_project_id ON team_project(project_id);
+CREATE INDEX IF NOT EXISTS repo_project_id ON repo(project_id);
+-- user.email is unique, so it is already backed by sqlite_autoindex_user_2
@@ -0,0 +1,3 @@
+-- sha256 of the canonical policy document, lets /policy/create reuse an identical policy
+ALTER TABLE policy ADD COLUMN content_hash text;
+CREATE INDEX IF NOT EXISTS policy_content_hash ON policy(content_hash);
@@ -0,0 +1,26 @@
+-- existence of AWS entities as last seen by the reconciler or by a mutation of this service
+-- kind is one of user, group, policy, repo; name is UserName, GroupName, policy arn or repositoryName
+-- both tables only hold derived data, a rerun over a reset user_version starts them empty
+DROP TABLE IF EXISTS aws_state;
+DROP TABLE IF EXISTS reconcile_run;
+
+CREATE TABLE aws_state(
+    kind text not null,
+    name text not null,
+    aws_arn text,
+    exists_in_aws integer not null,
+    exists_in_db integer not null,
+    drift text,
+    checked TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    primary key(kind, name)
+);
+CREATE INDEX IF NOT EXISTS aws_state_drift ON aws_state(kind, drift);
+
+CREATE TABLE reconcile_run(
+    kind text primary key,
+    started TIMESTAMP,
+    finished TIMESTAMP,
+    aws_count integer,
+    db_count integer,
+    drift_count integer
+);
@@ -0,0 +1,17 @@
+-- codecommit resources granted by each policy, parsed from policy.detail by source.access
+-- resource is an arn or an IAM wildcard pattern, prefix is its part before the first wildcard
+DROP TABLE IF EXISTS policy_resource;
+CREATE TABLE policy_resource(
+    policy_arn text not null,
+    resource text not null,
+    prefix text not null,
+    access text not null,
+    primary key(policy_arn, resource)
+);
+
+-- policies not parsed yet, the partial index keeps the check for them O(1)
+ALTER TABLE policy ADD COLUMN resources_indexed integer not null default 0;
+CREATE INDEX IF NOT EXISTS policy_resources_pending ON policy(resources_indexed) WHERE resources_indexed = 0;
+
+CREATE INDEX IF NOT EXISTS policy_aws_arn ON policy(aws_arn);
+CREATE INDEX IF NOT EXISTS repo_aws_arn ON repo(aws_arn);
@@ -0,0 +1,22 @@
+-- (user, repo, access) materialized from team_member, team_policy, policy_resource and repo.
+-- Each column counts the grant paths of one level, so removing one path never needs a recompute.
+DROP TABLE IF EXISTS access_matrix;
+CREATE TABLE access_matrix(
+    user_name text not null,
+    repo_name text not null,
+    read_grants integer not null default 0,
+    write_grants integer not null default 0,
+    admin_grants integer not null default 0,
+    access text generated always as (
+        case when admin_grants > 0 then 'admin' when write_grants > 0 then 'write'
+        when read_grants > 0 then 'read' end
+    ) virtual,
+    primary key(user_name, repo_name)
+);
+CREATE INDEX IF NOT EXISTS access_matrix_repo_name ON access_matrix(repo_name);
+CREATE INDEX IF NOT EXISTS access_matrix_empty ON access_matrix(user_name)
+    WHERE read_grants = 0 AND write_grants = 0 AND admin_grants = 0;
+
+-- policies are parsed again, each one adds its grant paths to the matrix as it is indexed
+DELETE FROM policy_resource;
+UPDATE policy SET resources_indexed = 0;
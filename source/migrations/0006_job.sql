@@ -0,0 +1,19 @@
+-- outbox of AWS mutations, drained by source.jobs workers
+-- status is pending, running, succeeded or failed; a running job whose lease expired is claimed again
+CREATE TABLE IF NOT EXISTS job(
+    id integer primary key autoincrement,
+    kind text not null,
+    payload text,
+    status text not null default 'pending',
+    attempts integer not null default 0,
+    max_attempts integer not null,
+    result text,
+    error text,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by text,
+    locked_until TIMESTAMP,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS job_pending ON job(run_after) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS job_running ON job(locked_until) WHERE status = 'running';
@@ -0,0 +1,2 @@
+-- Deny statements lower the parsed access, policies that have one are parsed again
+UPDATE policy SET resources_indexed = 0 WHERE detail LIKE '%Deny%';
@@ -0,0 +1,18 @@
+-- secret payload keys of unfinished jobs, e.g. passwords, kept out of job.payload
+-- rows are deleted when their job finishes, a job whose secret expired fails
+CREATE TABLE IF NOT EXISTS job_secret(
+    job_id integer not null,
+    name text not null,
+    value text not null,
+    expires TIMESTAMP not null,
+    primary key(job_id, name)
+);
+
+-- user.create jobs carried the password in their payload, unfinished ones still need it,
+-- finished ones would never delete their job_secret row
+INSERT OR REPLACE INTO job_secret (job_id, name, value, expires)
+    SELECT id, 'password', json_extract(payload, '$.password'), datetime('now', '+3600 seconds') FROM job
+    WHERE kind = 'user.create' AND json_extract(payload, '$.password') IS NOT NULL
+        AND status IN ('pending', 'running');
+UPDATE job SET payload = json_remove(payload, '$.password')
+    WHERE kind = 'user.create' AND json_extract(payload, '$.password') IS NOT NULL;
@@ -0,0 +1,62 @@
+from flask import current_app, request
+
+from source.api_response import *
+from source.db import get_db
+
+
+def page_args():
+    """
+    read keyset pagination arguments from query string
+    :return: (after, limit, stream)
+    """
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    if limit is not None:
+        limit = max(1, min(limit, current_app.config['INDEX_MAX_PAGE_SIZE']))
+    stream = request.args.get('stream', '0') not in ('0', 'false', '')
+    return after, limit, stream
+
+
+def select_after(db, table, after, limit=None):
+    """
+    keyset query on id, table name must be a trusted constant
+    :return: sqlite cursor
+    """
+    if limit is None:
+        return db.execute(f'select * from {table} where id > ? order by id', (after,))
+    return db.execute(f'select * from {table} where id > ? order by id limit ?', (after, limit))
+
+
+def fetch_page(db, table, row_to_dict, after, limit):
+    """
+    fetch one page and the cursor of the next page, next cursor is None on the last page
+    """
+    rows = select_after(db, table, after, limit + 1).fetchall()
+    items = [row_to_dict(row) for row in rows[:limit]]
+    next_after = items[-1]['id'] if len(rows) > limit else None
+    return items, next_after
+
+
+def iter_table(table, row_to_dict, after, limit, batch_size):
+    """
+    yield rows one batch at a time, the cursor is opened lazily inside the streaming context
+    because the connection of the view is closed once the view returns
+    """
+    cursor = select_after(get_db(), table, after, limit)
+    for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+        for row in rows:
+            yield row_to_dict(row)
+
+
+def index_response(db, table, row_to_dict):
+    """
+    shared implementation of index views.
+    ?limit=n&after=id returns one page, otherwise rows are streamed from the cursor
+    """
+    after, limit, stream = page_args()
+    if limit is not None and not stream:
+        items, next_after = fetch_page(db, table, row_to_dict, after, limit)
+        return succeeded_with_page(items, next_after)
+    batch_size = current_app.config['INDEX_STREAM_BATCH']
+    items = iter_table(table, row_to_dict, after, limit, batch_size)
+    return stream_response(items, batch_size)
@@ -1,17 +1,26 @@
 import datetime
+import hashlib
+import os
+import secrets
+import threading
 
-import boto3
+import click
 
 from source.api_response import *
 from source.db import get_db
+from source.aws import LazyClient
+from source.cache import iam_cache
+from source.policy_compiler import compile_policies
+from source.batch import run_batch
+from source.reconcile import record_aws_state
 from flask import(
-    Blueprint, request
+    Blueprint, current_app, request
 )
 from source.decorators import check_token
 from io import StringIO
 
 bp = Blueprint('policy', __name__, url_prefix='/policy')
-iam_client = boto3.client('iam')
+iam_client = LazyClient('iam')
 
 """
 To simplify current design, we just use aws managed policies to implement. There are three aws managed policies
@@ -68,11 +77,74 @@ def index():
     return succeeded_with_data(policies)
 
 
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aws_policies')
+POLICY_TYPES = ('readonly', 'developer', 'admin')
+RESOURCE_PLACEHOLDER = '__codecommit_resource__'
+
+
+class PolicyTemplate(object):
+    """
+    template compiled into the compact json text around Statement[0].Resource,
+    rendering only serializes the resource and concatenates
+    """
+    __slots__ = ('policy_type', 'mtime', 'document', 'prefix', 'suffix')
+
+    def __init__(self, policy_type, mtime, document):
+        placeholder = json.loads(json.dumps(document))
+        placeholder['Statement'][0]['Resource'] = RESOURCE_PLACEHOLDER
+        text = json.dumps(placeholder, ensure_ascii=False, separators=(',', ':'))
+        prefix, suffix = text.split(json.dumps(RESOURCE_PLACEHOLDER))
+        object.__setattr__(self, 'policy_type', policy_type)
+        object.__setattr__(self, 'mtime', mtime)
+        object.__setattr__(self, 'document', json.dumps(document))
+        object.__setattr__(self, 'prefix', prefix)
+        object.__setattr__(self, 'suffix', suffix)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PolicyTemplate is immutable")
+
+    def render(self, resource):
+        """
+        :param resource: '*', one arn or a list of arns
+        :return: policy document text
+        """
+        return self.prefix + json.dumps(resource, ensure_ascii=False, separators=(',', ':')) + self.suffix
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_policy_template(policy_type):
+    """
+    compiled template of a policy type, the file is parsed again only when its mtime changes
+    """
+    if policy_type not in POLICY_TYPES:
+        raise ValueError(f"Unknown policy type {policy_type}, expected one of {', '.join(POLICY_TYPES)}")
+    path = os.path.join(TEMPLATE_DIR, f'{policy_type}_template.json')
+    mtime = os.stat(path).st_mtime_ns
+    template = _templates.get(policy_type)
+    if template is None or template.mtime != mtime:
+        with _templates_lock:
+            template = _templates.get(policy_type)
+            if template is None or template.mtime != mtime:
+                with open(path, 'r', encoding='utf-8') as json_file:
+                    template = PolicyTemplate(policy_type, mtime, json.load(json_file))
+                _templates[policy_type] = template
+    return template
+
+
 def load_policy_template(policy_type):
-    with open(f'aws_policies/{policy_type}_template.json', 'r') as json_file:
-        print(json_file.read())
-        json_file.close()
-        # return json.load(json_file)
+    """
+    :return: a fresh dict of the template that the caller may modify
+    """
+    return json.loads(get_policy_template(policy_type).document)
+
+
+@bp.record_once
+def preload_policy_templates(state):
+    for policy_type in POLICY_TYPES:
+        get_policy_template(policy_type)
 
 
 @bp.route('/create', methods=('PUT',))
@@ -99,6 +171,12 @@ def create():
                   - readonly
                   - developer
                   - admin
+              dry_run:
+                type: integer
+                description: 1 只返回拆分计划, 不创建策略
+                enum:
+                  - 0
+                  - 1
             required:
               - repos
               - policy_type
@@ -109,51 +187,88 @@ def create():
       '505':
         description: Server internal issue
     """
+    policy_type = request.form.get('policy_type', '')
+    # deleted policies keep their row, the suffix keeps names unique within the same second
+    policy_name = f'codecommit_{policy_type}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}_{secrets.token_hex(3)}'
     try:
         db = get_db()
-        policy_type = request.form['policy_type']
-        policy_template = load_policy_template(policy_type)
-        # print('--------------')
-        # print(policy_template)
+        policy_template = get_policy_template(policy_type)
         str_repos = request.form['repos']
+        dry_run = request.form.get('dry_run', '0') not in ('0', 'false', '')
 
         if str_repos is None or len(str_repos) == 0 or str_repos == '*':
-            policy_template['Statement'][0]['Resource'] = '*'
+            arns = '*'
         else:
             repos = str_repos.split(',')
             rows = db.execute('SELECT aws_arn FROM repo WHERE repo_name IN (%s)' % ("?," * len(repos))[:-1],
                               repos).fetchall()
             if rows is None or len(rows) == 0:
                 return failed_without_data(f"No repo found, please verify repo name and try again")
-            if len(rows) == 1:
-                policy_template['Statement'][0]['Resource'] = rows[0][0]
-            else:
-                # https://docs.aws.amazon.com/codecommit/latest/userguide/customer-managed-policies.html
-                resources = []
-                for row in rows:
-                    resources.append(row[0])
-                policy_template['Statement'][0]['Resource'] = resources
-
-        policy_name = f'codecommit_{policy_type}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}'
-        policy_detail = json.dumps(policy_template)
-        # print('--------------------')
-        # print(policy_detail)
-
-        policy = iam_client.create_policy(
-            PolicyName=policy_name,
-            PolicyDocument=policy_detail
+            # https://docs.aws.amazon.com/codecommit/latest/userguide/customer-managed-policies.html
+            arns = [row[0] for row in rows]
+        known_arns = [row[0] for row in db.execute('SELECT aws_arn FROM repo WHERE aws_arn IS NOT NULL')]
+        documents = compile_policies(
+            policy_template, arns, known_arns,
+            current_app.config['IAM_POLICY_MAX_SIZE'], current_app.config['POLICY_MIN_WILDCARD_PREFIX']
         )
+
+        plan = []
+        for index, policy_detail in enumerate(documents):
+            name = policy_name if len(documents) == 1 else f'{policy_name}_{index + 1}'
+            resource = json.loads(policy_detail)['Statement'][0]['Resource']
+            plan.append({
+                "policy_name": name,
+                "size": len(policy_detail),
+                "resources": resource if isinstance(resource, list) else [resource],
+            })
+        if dry_run:
+            return succeeded_with_data(plan, f"{len(plan)} policies planned")
+
         operator = 1
-        aws_arn = policy['Policy']['Arn']
-        db.execute(
-            "insert into policy (policy_name, detail,operator,aws_arn) values (?, ?, ?, ?)",
-            (policy_name, policy_detail, operator, aws_arn)
-        )
-        db.commit()
+        for item, policy_detail in zip(plan, documents):
+            content_hash = policy_content_hash(policy_detail)
+            existing = db.execute(REUSABLE_POLICY_SQL, (content_hash,)).fetchone()
+            if existing is not None:
+                # identical document exists already, no need to ask IAM
+                item.update(policy_name=existing[0], aws_arn=existing[1], reused=True)
+                continue
+            policy = iam_client.create_policy(
+                PolicyName=item['policy_name'],
+                PolicyDocument=policy_detail
+            )
+            item.update(aws_arn=policy['Policy']['Arn'], reused=False)
+            db.execute(
+                "insert into policy (policy_name, detail,operator,aws_arn,content_hash) values (?, ?, ?, ?, ?)",
+                (item['policy_name'], policy_detail, operator, item['aws_arn'], content_hash)
+            )
+            record_aws_state(db, 'policy', item['aws_arn'], item['aws_arn'], True)
+            db.commit()
     except Exception as e:
         return failed_without_data(f"Policy {policy_name} created failed: {str(e)}")
     else:
-        return succeeded_without_data(f'Policy {policy_name} created successfully')
+        if len(plan) == 1 and plan[0]['reused']:
+            return succeeded_with_data(plan, f"Policy {plan[0]['policy_name']} has the same content, reused")
+        if len(plan) == 1:
+            return succeeded_with_data(plan, f'Policy {policy_name} created successfully')
+        return succeeded_with_data(plan, f'Policies {policy_name}_1..{len(plan)} created successfully')
+
+
+# oldest policy with the same content that has not been deleted from IAM
+REUSABLE_POLICY_SQL = """
+    select policy_name, aws_arn from policy
+    where content_hash = ? and not exists (
+        select 1 from aws_state where kind = 'policy' and name = policy.aws_arn and exists_in_aws = 0
+    )
+    order by created limit 1
+    """
+
+
+def policy_content_hash(policy_detail):
+    """
+    sha256 of the document with sorted keys and no whitespace, so formatting does not matter
+    """
+    canonical = json.dumps(json.loads(policy_detail), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
 
 @bp.route('/get_policy/<string:policy_name>', methods=("GET",))
@@ -189,6 +304,10 @@ def get_db_policy(policy_name):
 
 
 def get_iam_policy(policy_arn):
+    return iam_cache.get_or_load(f'policy:{policy_arn}', lambda: load_iam_policy(policy_arn))
+
+
+def load_iam_policy(policy_arn):
     try:
         policy = iam_client.get_policy(PolicyArn=policy_arn)
     except iam_client.exceptions.NoSuchEntityException:
@@ -228,10 +347,111 @@ def delete_policy(policy_name):
     iam_policy = get_iam_policy(aws_arn)
     if iam_policy:
         iam_client.delete_policy(PolicyArn=aws_arn)
+        iam_cache.invalidate(f'policy:{aws_arn}')
+        # the policy row is kept, so this leaves it drifted until it is removed locally
+        db = get_db()
+        record_aws_state(db, 'policy', aws_arn, aws_arn, False, True)
+        db.commit()
         return succeeded_without_data(f"Policy {policy_name} removed")
     return succeeded_without_data(f"Policy {policy_name} not found")
 
 
+def backfill_content_hashes(db):
+    rows = db.execute(
+        "select policy_name, detail from policy where content_hash is null and detail is not null"
+    ).fetchall()
+    db.executemany(
+        "update policy set content_hash = ? where policy_name = ?",
+        [(policy_content_hash(row[1]), row[0]) for row in rows]
+    )
+    db.commit()
+    return len(rows)
+
+
+def find_duplicate_policies(db):
+    """
+    :return: rows of every policy whose content is identical to an older one, policies deleted from IAM aside
+    """
+    rows = db.execute(
+        """
+        with live as (
+            select content_hash, policy_name, aws_arn, created from policy
+            where content_hash is not null and not exists (
+                select 1 from aws_state where kind = 'policy' and name = policy.aws_arn and exists_in_aws = 0
+            )
+        )
+        select content_hash, policy_name, aws_arn from live
+        where content_hash in (select content_hash from live group by content_hash having count(*) > 1)
+        order by content_hash, created, policy_name
+        """
+    ).fetchall()
+    duplicates = []
+    previous = None
+    for row in rows:
+        if row[0] == previous:
+            duplicates.append({"policy_name": row[1], "aws_arn": row[2]})
+        previous = row[0]
+    return duplicates
+
+
+def gc_duplicate_policies(dry_run=False):
+    """
+    delete duplicate policies that are attached to nothing, in IAM and in team_policy.
+    The oldest policy of each content is always kept
+    :return: list of {policy_name, aws_arn, action}
+    """
+    db = get_db()
+    backfill_content_hashes(db)
+    duplicates = find_duplicate_policies(db)
+    attached = {row[0] for row in db.execute("select distinct policy_arn from team_policy")}
+    # attachment counts must be fresh, bypass iam_cache
+    lookups = run_batch(lambda item: load_iam_policy(item['aws_arn']), duplicates)
+    removable = []
+    for item, (iam_policy, error) in zip(duplicates, lookups):
+        if error is not None:
+            item['action'] = f"skipped: {str(error)}"
+        elif item['aws_arn'] in attached or (iam_policy and iam_policy.get('AttachmentCount', 0) > 0):
+            item['action'] = "kept: attached"
+        else:
+            item['action'] = "deleted" if iam_policy else "deleted: missing in iam"
+            item['in_iam'] = iam_policy is not None
+            removable.append(item)
+    if dry_run:
+        for item in removable:
+            item.pop('in_iam')
+            item['action'] = "would be " + item['action']
+        return duplicates
+
+    results = run_batch(
+        lambda item: iam_client.delete_policy(PolicyArn=item['aws_arn']) if item['in_iam'] else None,
+        removable
+    )
+    deleted = []
+    for item, (_, error) in zip(removable, results):
+        item.pop('in_iam')
+        if error is not None:
+            item['action'] = f"skipped: {str(error)}"
+        else:
+            iam_cache.invalidate(f"policy:{item['aws_arn']}")
+            deleted.append((item['policy_name'], item['aws_arn']))
+    with db:
+        db.executemany("delete from policy where policy_name = ?", [(name,) for name, _ in deleted])
+        db.executemany("delete from policy_resource where policy_arn = ?", [(arn,) for _, arn in deleted])
+        for _, aws_arn in deleted:
+            record_aws_state(db, 'policy', aws_arn, None, False)
+    return duplicates
+
+
+@bp.cli.command('gc')
+@click.option('--dry-run', is_flag=True, help='only report what would be deleted')
+def gc_command(dry_run):
+    """Delete unattached policies whose content duplicates an older policy."""
+    report = gc_duplicate_policies(dry_run)
+    for item in report:
+        click.echo(f"{item['policy_name']}\t{item['aws_arn']}\t{item['action']}")
+    click.echo(f"{len(report)} duplicate policies found")
+
+
 def row_to_dict(row):
     return {
         "policy_name": row[0],
@@ -240,5 +460,6 @@ def row_to_dict(row):
         "created": str(row[3]),
         "updated": str(row[4]),
         "operator": row[5],
-        "aws_arn": row[6]
+        "aws_arn": row[6],
+        "content_hash": row[7]
     }
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""
+Fit repo ARNs into as few managed policies as IAM allows.
+
+https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_iam-quotas.html
+A managed policy document may hold at most 6,144 characters (whitespace excluded).
+
+A 'prefix*' wildcard also grants repos created later under the prefix, so requested names
+are only collapsed when their literal list does not fit into one document.
+"""
+import json
+
+IAM_POLICY_MAX_SIZE = 6144
+
+
+def common_prefix_length(first, last):
+    size = min(len(first), len(last))
+    for i in range(size):
+        if first[i] != last[i]:
+            return i
+    return size
+
+
+def collapse_names(requested, known, min_prefix):
+    """
+    replace groups of requested repo names by name prefix wildcards.
+    A wildcard is only used when every known repo matching it is requested,
+    and its prefix has at least min_prefix characters
+    :param requested: set of names
+    :param known: iterable of every repo name under the same account and region
+    :return: list of names and 'prefix*' patterns
+    """
+    names = sorted(set(known) | requested)
+    counts = [0]
+    for name in names:
+        counts.append(counts[-1] + (name in requested))
+    patterns = []
+
+    def walk(lo, hi, depth):
+        wanted = counts[hi] - counts[lo]
+        if wanted == 0:
+            return
+        if hi - lo == 1:
+            patterns.append(names[lo])
+            return
+        depth = max(depth, common_prefix_length(names[lo], names[hi - 1]))
+        if wanted == hi - lo and depth >= min_prefix:
+            patterns.append(names[lo][:depth] + '*')
+            return
+        i = lo
+        if len(names[i]) == depth:
+            # the prefix itself is a repo name, it sorts first
+            if names[i] in requested:
+                patterns.append(names[i])
+            i += 1
+        while i < hi:
+            char = names[i][depth]
+            j = i + 1
+            while j < hi and names[j][depth] == char:
+                j += 1
+            walk(i, j, depth + 1)
+            i = j
+
+    walk(0, len(names), 0)
+    return patterns
+
+
+def collapse_arns(arns, known_arns, min_prefix=3):
+    """
+    :param arns: requested repo arns
+    :param known_arns: arns of every repo in the repo table
+    :return: sorted list of arns and arn wildcards covering exactly the requested repos today
+    """
+    requested = {}
+    known = {}
+    for arn in arns:
+        base, name = arn.rsplit(':', 1)
+        requested.setdefault(base, set()).add(name)
+    for arn in known_arns:
+        base, name = arn.rsplit(':', 1)
+        if base in requested:
+            known.setdefault(base, []).append(name)
+    resources = []
+    for base, names in requested.items():
+        resources.extend(f'{base}:{pattern}' for pattern in collapse_names(names, known.get(base, ()), min_prefix))
+    return sorted(resources)
+
+
+def pack_resources(template, resources, max_size=IAM_POLICY_MAX_SIZE):
+    """
+    split resources over the fewest documents that each fit max_size, first fit decreasing
+    :param template: source.policy.PolicyTemplate
+    :return: list of resource lists
+    """
+    # a list of n items costs its encoded items plus n - 1 commas inside "[]"
+    capacity = max_size - len(template.render([])) + 1
+    bins = []
+    free = []
+    for resource in sorted(resources, key=len, reverse=True):
+        cost = len(json.dumps(resource, ensure_ascii=False)) + 1
+        if cost > capacity:
+            raise ValueError(f"Resource {resource} does not fit into a policy of {max_size} characters")
+        for i, space in enumerate(free):
+            if cost <= space:
+                bins[i].append(resource)
+                free[i] -= cost
+                break
+        else:
+            bins.append([resource])
+            free.append(capacity - cost)
+    return [sorted(resources) for resources in bins]
+
+
+def compile_policies(template, arns, known_arns, max_size=IAM_POLICY_MAX_SIZE, min_prefix=3):
+    """
+    :param min_prefix: shortest wildcard prefix, 0 never collapses
+    :return: list of policy document texts, one per managed policy to create
+    """
+    if arns == '*':
+        return [template.render('*')]
+    resources = sorted(set(arns))
+    literal = template.render(resources[0] if len(resources) == 1 else resources)
+    if len(literal) <= max_size:
+        return [literal]
+    if min_prefix > 0:
+        resources = collapse_arns(resources, known_arns, min_prefix)
+    documents = []
+    for group in pack_resources(template, resources, max_size):
+        documents.append(template.render(group[0] if len(group) == 1 else group))
+    return documents
@@ -0,0 +1,260 @@
+"""
+Per-statement profiling of the SQLite connections handed out by get_db.
+
+A statement is timed from execute until its cursor is exhausted, fetches included, along
+with the rows it returned (or changed) and the VM steps counted by a progress handler.
+Statements whose cursor is not read to the end are closed when the connection goes back at
+the end of the app context.
+
+With SQL_SLOW_THRESHOLD set, statements taking longer are logged as warnings together with
+their EXPLAIN QUERY PLAN. With SQL_PROFILE on, every statement is logged at debug level, a
+statement run SQL_PROFILE_REPEAT times in one request is reported as a likely N+1, the plan
+of each distinct statement is checked once for full table scans, and responses carry the
+query count and the database time in X-SQL-Queries and Server-Timing headers. Statements of
+a streamed body run after the headers are sent and are only counted in the log.
+"""
+import re
+import sqlite3
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+
+from source import metrics
+
+# the progress handler is called every PROGRESS_STEPS virtual machine instructions
+PROGRESS_STEPS = 1000
+
+EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'replace', 'with')
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+
+# sql -> full scanned tables, SQL_PROFILE explains and reports every statement once per process
+_plan_checked = {}
+
+
+class Statement(object):
+    __slots__ = ('sql', 'parameters', 'seconds', 'rows', 'steps', 'closed')
+
+    def __init__(self, sql, parameters):
+        self.sql = sql
+        self.parameters = parameters
+        self.seconds = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.closed = False
+
+
+class Profile(object):
+    """
+    statements of one use of a connection, i.e. one request, job or command
+    """
+
+    def __init__(self, conn, threshold, verbose, repeat):
+        self.conn = conn
+        self.threshold = threshold
+        self.verbose = verbose
+        self.repeat = repeat
+        self.logger = current_app.logger
+        self.count = 0
+        self.seconds = 0.0
+        self.steps = 0
+        self.repeats = Counter()
+        # statements whose cursor has not been read to the end
+        self.pending = set()
+
+    def progress(self):
+        self.steps += PROGRESS_STEPS
+        return 0
+
+    def open(self, sql, parameters):
+        statement = Statement(sql, parameters)
+        self.count += 1
+        self.pending.add(statement)
+        if self.verbose:
+            self.repeats[sql] += 1
+        return statement
+
+    def close(self, statement):
+        if statement.closed:
+            return
+        statement.closed = True
+        self.pending.discard(statement)
+        self.seconds += statement.seconds
+        if self.verbose:
+            self.logger.debug(f"sql {statement.seconds * 1000:.3f} ms, {statement.rows} rows, "
+                              f"{statement.steps} steps: {one_line(statement.sql)}")
+            scanned = None if statement.sql in _plan_checked else full_scans(self.conn, statement.sql,
+                                                                              statement.parameters)
+            if scanned:
+                self.logger.warning(f"sql full scan of {', '.join(scanned)}: {one_line(statement.sql)}")
+        if self.threshold is not None and statement.seconds >= self.threshold:
+            plan = explain(self.conn, statement.sql, statement.parameters)
+            self.logger.warning(
+                f"slow sql {statement.seconds * 1000:.3f} ms, {statement.rows} rows, {statement.steps} steps: "
+                f"{one_line(statement.sql)}" + ''.join(f"\n    {line}" for line in plan)
+            )
+        statement.parameters = None
+
+    def total_seconds(self):
+        return self.seconds + sum(statement.seconds for statement in self.pending)
+
+    def finish(self):
+        for statement in list(self.pending):
+            self.close(statement)
+        if self.verbose:
+            for sql, count in self.repeats.items():
+                if count >= self.repeat:
+                    self.logger.warning(f"sql run {count} times in one {context_name()}: {one_line(sql)}")
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    cursor of a profiled connection, attributes time, rows and steps to its current statement
+    """
+    statement = None
+    profile = None
+
+    def run(self, method, *args):
+        profile = self.profile
+        statement = self.statement
+        steps = profile.steps
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            statement.seconds += time.perf_counter() - start
+            statement.steps += profile.steps - steps
+
+    def execute(self, sql, parameters=()):
+        self.profile = self.connection.profile
+        self.statement = self.profile.open(sql, parameters)
+        start = time.perf_counter()
+        try:
+            self.run(super().execute, sql, parameters)
+        finally:
+            metrics.observe_statement(sql, time.perf_counter() - start)
+        if self.description is None:
+            self.statement.rows = max(self.rowcount, 0)
+            self.profile.close(self.statement)
+        return self
+
+    def executemany(self, sql, parameters):
+        self.profile = self.connection.profile
+        # parameters of executemany are consumed, its plan is explained without them
+        self.statement = self.profile.open(sql, None)
+        start = time.perf_counter()
+        try:
+            self.run(super().executemany, sql, parameters)
+        finally:
+            metrics.observe_statement(sql, time.perf_counter() - start)
+        self.statement.rows = max(self.rowcount, 0)
+        self.profile.close(self.statement)
+        return self
+
+    def __next__(self):
+        try:
+            row = self.run(super().__next__)
+        except StopIteration:
+            self.profile.close(self.statement)
+            raise
+        self.statement.rows += 1
+        return row
+
+    def fetchone(self):
+        row = self.run(super().fetchone)
+        if row is None:
+            self.profile.close(self.statement)
+        else:
+            self.statement.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.run(super().fetchmany, self.arraysize if size is None else size)
+        self.statement.rows += len(rows)
+        if not rows:
+            self.profile.close(self.statement)
+        return rows
+
+    def fetchall(self):
+        rows = self.run(super().fetchall)
+        self.statement.rows += len(rows)
+        self.profile.close(self.statement)
+        return rows
+
+
+def one_line(sql):
+    return ' '.join(sql.split())
+
+
+def context_name():
+    if has_request_context():
+        return f"{request.method} {request.path}"
+    return 'app context'
+
+
+def explain(conn, sql, parameters):
+    """
+    :return: detail lines of EXPLAIN QUERY PLAN, empty for statements that cannot be explained
+    """
+    words = sql.split(None, 1)
+    if not words or words[0].lower() not in EXPLAINABLE:
+        return []
+    try:
+        # the plain execute, explaining must not be profiled itself
+        if parameters is None:
+            rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql.replace('?', 'NULL'))
+        else:
+            rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters)
+        return [row[3] for row in rows]
+    except sqlite3.Error:
+        return []
+
+
+def full_scans(conn, sql, parameters):
+    scanned = _plan_checked.get(sql)
+    if scanned is None:
+        scanned = []
+        for line in explain(conn, sql, parameters):
+            match = FULL_SCAN_RE.match(line)
+            if match:
+                scanned.append(match.group(1))
+        if len(_plan_checked) < 10000:
+            _plan_checked[sql] = scanned
+    return scanned
+
+
+def start(conn):
+    """
+    profile a connection handed out by get_db, a no-op unless profiling is configured
+    """
+    config = current_app.config
+    if config['SQL_SLOW_THRESHOLD'] is None and not config['SQL_PROFILE']:
+        return
+    conn.profile = Profile(conn, config['SQL_SLOW_THRESHOLD'], config['SQL_PROFILE'], config['SQL_PROFILE_REPEAT'])
+    conn.set_progress_handler(conn.profile.progress, PROGRESS_STEPS)
+
+
+def stop(conn):
+    profile = getattr(conn, 'profile', None)
+    if profile is None:
+        return
+    conn.profile = None
+    conn.set_progress_handler(None, 0)
+    profile.finish()
+
+
+def add_profile_header(response):
+    if not current_app.config['SQL_PROFILE']:
+        return response
+    db = g.get('db')
+    profile = getattr(db, 'profile', None)
+    count, seconds = 0, 0.0
+    if profile is not None:
+        count, seconds = profile.count, profile.total_seconds()
+    response.headers['X-SQL-Queries'] = str(count)
+    response.headers['Server-Timing'] = f'db;dur={seconds * 1000:.3f};desc="{count} queries"'
+    return response
+
+
+def init_app(app):
+    app.after_request(add_profile_header)
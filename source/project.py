@@ -1,5 +1,6 @@
 from source.api_response import *
 from source.db import get_db
+from source.pagination import index_response
 
 from flask import (
     Blueprint, request,
@@ -15,6 +16,28 @@ def index():
     ---
     tags:
       - project
+    parameters:
+        - name: after
+          in: query
+          description: 上一页最后一条记录的id
+          required: false
+          schema:
+            type: integer
+        - name: limit
+          in: query
+          description: 每页记录数, 不指定时流式返回全部记录
+          required: false
+          schema:
+            type: integer
+        - name: stream
+          in: query
+          description: 是否流式返回
+          required: false
+          schema:
+            type: integer
+            enum:
+              - 0
+              - 1
     responses:
         '200':
           description: Successful operation
@@ -23,16 +46,9 @@ def index():
     """
     try:
         db = get_db()
-        rows = db.execute(
-            "select * from project"
-        ).fetchall()
-        projects = []
-        for row in rows:
-            projects.append(row_to_dict(row))
+        return index_response(db, 'project', row_to_dict)
     except db.InternalError as e:
         return failed_with_data(e, e.strerror)
-    else:
-        return succeeded_with_data(projects)
 
 
 @bp.route('/get/<int:project_id>', methods=('GET',))
@@ -0,0 +1,170 @@
+"""
+Token buckets for AWS API calls, shared by every thread and process of the service.
+
+Calls are grouped in families, e.g. iam:read for Get/List operations and iam:write for the rest,
+each with a rate and a burst from AWS_RATE_LIMITS. The buckets live in a small SQLite file,
+so gunicorn workers, job workers and CLI commands draw from the same tokens. The limiter is
+hooked into botocore events, so every HTTP attempt waits for a token, retries and paginated
+calls included.
+
+Backoff is adaptive: a throttling error halves the rate of its family and empties the bucket,
+every successful call gives back a little of the rate until it is whole again.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+READ_PREFIXES = ('Get', 'List', 'Describe', 'BatchGet', 'BatchDescribe')
+
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'Rate exceeded',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket(
+    family text primary key,
+    tokens real not null,
+    updated real not null,
+    factor real not null default 1.0
+);
+"""
+
+
+def operation_family(service, operation):
+    kind = 'read' if operation.startswith(READ_PREFIXES) else 'write'
+    return f'{service}:{kind}'
+
+
+class RateLimiter(object):
+    """
+    :param limits: dict of family -> (requests per second, burst), families not listed are not limited
+    """
+
+    def __init__(self, path, limits, min_factor=0.05, recovery=0.02, clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.limits = {family: (float(rate), float(burst)) for family, (rate, burst) in limits.items()}
+        self.min_factor = min_factor
+        self.recovery = recovery
+        self.clock = clock
+        self.sleep = sleep
+        self.local = threading.local()
+        # last factor seen per family, successes only write while it is below 1
+        self.factors = {}
+
+    def connect(self):
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode = WAL')
+            # bucket state is disposable, no need to sync it to disk
+            db.execute('PRAGMA synchronous = OFF')
+            db.executescript(SCHEMA)
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def take(self, family):
+        """
+        take one token if there is one
+        :return: seconds to wait before trying again, 0 when the token was taken
+        """
+        rate, burst = self.limits[family]
+        db = self.connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            now = self.clock()
+            row = db.execute('select tokens, updated, factor from bucket where family = ?', (family,)).fetchone()
+            tokens, updated, factor = row if row is not None else (burst, now, 1.0)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate * factor)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / (rate * factor)
+            db.execute(
+                'insert or replace into bucket (family, tokens, updated, factor) values (?, ?, ?, ?)',
+                (family, tokens, now, factor)
+            )
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        self.factors[family] = factor
+        return wait
+
+    def acquire(self, family):
+        """
+        block until a token of the family is available
+        :return: seconds waited
+        """
+        if family not in self.limits:
+            return 0.0
+        waited = 0.0
+        while True:
+            wait = self.take(family)
+            if wait == 0:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+    def throttled(self, family):
+        if family not in self.limits:
+            return
+        db = self.connect()
+        db.execute(
+            'update bucket set factor = max(?, factor / 2), tokens = min(tokens, 0) where family = ?',
+            (self.min_factor, family)
+        )
+        self.factors[family] = max(self.min_factor, self.factors.get(family, 1.0) / 2)
+
+    def succeeded(self, family):
+        if self.factors.get(family, 1.0) >= 1.0:
+            return
+        db = self.connect()
+        db.execute('update bucket set factor = min(1.0, factor + ?) where family = ?', (self.recovery, family))
+        self.factors[family] = min(1.0, self.factors[family] + self.recovery)
+
+    def state(self):
+        """
+        :return: dict of family -> {tokens, factor} as last written
+        """
+        rows = self.connect().execute('select family, tokens, factor from bucket').fetchall()
+        return {row[0]: {"tokens": row[1], "factor": row[2]} for row in rows}
+
+
+def event_family(event_name):
+    # e.g. before-send.iam.GetUser
+    _, service, operation = event_name.split('.', 2)
+    return operation_family(service, operation)
+
+
+def error_code(parsed):
+    if isinstance(parsed, dict):
+        return parsed.get('Error', {}).get('Code')
+    return None
+
+
+def install(client, limiter):
+    """
+    register the limiter on the events of a botocore client
+    """
+    service = client.meta.service_model.service_id.hyphenize()
+
+    def before_send(event_name=None, **kwargs):
+        limiter.acquire(event_family(event_name))
+
+    def needs_retry(event_name=None, response=None, **kwargs):
+        if response is not None and error_code(response[1]) in THROTTLE_CODES:
+            limiter.throttled(event_family(event_name))
+
+    def after_call(event_name=None, parsed=None, **kwargs):
+        if error_code(parsed) is None:
+            limiter.succeeded(event_family(event_name))
+
+    events = client.meta.events
+    events.register(f'before-send.{service}', before_send, unique_id='ratelimit-before-send')
+    events.register(f'needs-retry.{service}', needs_retry, unique_id='ratelimit-needs-retry')
+    events.register(f'after-call.{service}', after_call, unique_id='ratelimit-after-call')
+    return client
@@ -0,0 +1,239 @@
+"""
+Reconcile AWS entities with the local tables.
+
+A run lists users, groups, local policies and repositories through paginators and stores
+the existence of each entity on both sides in aws_state. Mutations of this service record
+their outcome there as well, so /user/get and /team/get answer from SQLite while the last
+run is younger than RECONCILE_MAX_AGE.
+"""
+import threading
+import time
+
+import click
+from flask import Blueprint, current_app, request
+
+from source.api_response import *
+from source.aws import LazyClient
+from source.db import get_db
+
+bp = Blueprint('reconcile', __name__, url_prefix='/reconcile')
+iam_client = LazyClient('iam')
+codecommit_client = LazyClient('codecommit')
+
+KINDS = ('user', 'group', 'policy', 'repo')
+
+# local name column, arn column
+DB_QUERIES = {
+    'user': "select email, aws_arn from user",
+    'group': "select team_name, aws_arn from team",
+    'policy': "select aws_arn, aws_arn from policy where aws_arn is not null",
+    'repo': "select repo_name, aws_arn from repo",
+}
+
+
+def list_aws(kind):
+    """
+    :return: dict of name -> arn of every entity of a kind in AWS
+    """
+    if kind == 'user':
+        pages = iam_client.get_paginator('list_users').paginate()
+        return {user['UserName']: user['Arn'] for page in pages for user in page['Users']}
+    if kind == 'group':
+        pages = iam_client.get_paginator('list_groups').paginate()
+        return {group['GroupName']: group['Arn'] for page in pages for group in page['Groups']}
+    if kind == 'policy':
+        pages = iam_client.get_paginator('list_policies').paginate(Scope='Local')
+        return {policy['Arn']: policy['Arn'] for page in pages for policy in page['Policies']}
+    if kind == 'repo':
+        # ListRepositories returns no arn, the local one is kept
+        pages = codecommit_client.get_paginator('list_repositories').paginate()
+        return {repo['repositoryName']: None for page in pages for repo in page['repositories']}
+    raise ValueError(f"Unknown kind {kind}")
+
+
+def drift_of(in_aws, in_db, aws_arn=None, db_arn=None):
+    if not in_aws and not in_db:
+        # deleted on both sides, the row stays so aws_exists answers False
+        return None
+    if not in_aws:
+        return 'missing_in_aws'
+    if not in_db:
+        return 'missing_in_db'
+    if aws_arn and db_arn and aws_arn != db_arn:
+        return 'arn_mismatch'
+    return None
+
+
+def record_aws_state(db, kind, name, aws_arn, in_aws, in_db=None):
+    """
+    record the outcome of a mutation, caller commits together with its own change
+    """
+    if in_db is None:
+        in_db = in_aws
+    db.execute(
+        """
+        insert into aws_state (kind, name, aws_arn, exists_in_aws, exists_in_db, drift, checked)
+        values (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        on conflict(kind, name) do update set aws_arn = excluded.aws_arn,
+            exists_in_aws = excluded.exists_in_aws, exists_in_db = excluded.exists_in_db,
+            drift = excluded.drift, checked = excluded.checked
+        """,
+        (kind, name, aws_arn, int(in_aws), int(in_db), drift_of(in_aws, in_db))
+    )
+
+
+def aws_exists(kind, name):
+    """
+    :return: True or False from the last reconcile run, None when it is missing or too old
+    """
+    db = get_db()
+    max_age = current_app.config['RECONCILE_MAX_AGE']
+    run = db.execute(
+        "select 1 from reconcile_run where kind = ? and finished > datetime('now', ?)",
+        (kind, f'-{int(max_age)} seconds')
+    ).fetchone()
+    if run is None:
+        return None
+    row = db.execute(
+        "select exists_in_aws from aws_state where kind = ? and name = ?", (kind, name)
+    ).fetchone()
+    return bool(row and row[0])
+
+
+def reconcile(kind):
+    """
+    diff AWS against the local table of a kind and store the result in aws_state
+    :return: summary dict
+    """
+    db = get_db()
+    started = db.execute("select CURRENT_TIMESTAMP").fetchone()[0]
+    aws = list_aws(kind)
+    local = {row[0]: row[1] for row in db.execute(DB_QUERIES[kind]) if row[0] is not None}
+    if kind == 'policy':
+        # AWS managed policies are not listed with Scope=Local but always exist
+        aws.update({arn: arn for arn in local if ':aws:policy/' in arn})
+    rows = []
+    drift_count = 0
+    for name in aws.keys() | local.keys():
+        in_aws = name in aws
+        in_db = name in local
+        drift = drift_of(in_aws, in_db, aws.get(name), local.get(name))
+        drift_count += drift is not None
+        rows.append((kind, name, aws.get(name) or local.get(name), int(in_aws), int(in_db), drift, started))
+    with db:
+        # rows written by mutations since the run started are newer than what was listed,
+        # CURRENT_TIMESTAMP has whole seconds so a mutation in the same second wins
+        db.executemany(
+            """
+            insert into aws_state (kind, name, aws_arn, exists_in_aws, exists_in_db, drift, checked)
+            values (?, ?, ?, ?, ?, ?, ?)
+            on conflict(kind, name) do update set aws_arn = excluded.aws_arn,
+                exists_in_aws = excluded.exists_in_aws, exists_in_db = excluded.exists_in_db,
+                drift = excluded.drift, checked = excluded.checked
+            where aws_state.checked < excluded.checked
+            """,
+            rows
+        )
+        db.execute("delete from aws_state where kind = ? and checked < ?", (kind, started))
+        db.execute(
+            """
+            insert or replace into reconcile_run (kind, started, finished, aws_count, db_count, drift_count)
+            values (?, ?, CURRENT_TIMESTAMP, ?, ?, ?)
+            """,
+            (kind, started, len(aws), len(local), drift_count)
+        )
+    return {"kind": kind, "aws_count": len(aws), "db_count": len(local), "drift_count": drift_count}
+
+
+def reconcile_all(kinds=KINDS):
+    return [reconcile(kind) for kind in kinds]
+
+
+@bp.route('/drift', methods=('GET',))
+def drift():
+    """
+    展示AWS与数据库不一致的资源
+    ---
+    tags:
+      - reconcile
+    parameters:
+        - name: kind
+          in: query
+          description: 资源类型
+          required: false
+          schema:
+            type: string
+            enum:
+              - user
+              - group
+              - policy
+              - repo
+    responses:
+        '200':
+          description: Successful operation
+    """
+    db = get_db()
+    kind = request.args.get('kind', None)
+    sql = "select kind, name, aws_arn, drift, checked from aws_state where drift is not null"
+    params = ()
+    if kind:
+        sql += " and kind = ?"
+        params = (kind,)
+    rows = db.execute(sql + " order by kind, name", params).fetchall()
+    runs = db.execute("select * from reconcile_run order by kind").fetchall()
+    return succeeded_with_data({
+        "runs": [dict(run) for run in runs],
+        "drift": [{"kind": row[0], "name": row[1], "aws_arn": row[2], "drift": row[3], "checked": str(row[4])}
+                  for row in rows],
+    })
+
+
+@click.command('reconcile')
+@click.option('--kind', type=click.Choice(KINDS), multiple=True, help='defaults to every kind')
+def reconcile_command(kind):
+    """Diff IAM and CodeCommit against the local tables."""
+    for summary in reconcile_all(kind or KINDS):
+        click.echo(f"{summary['kind']}: {summary['aws_count']} in aws, {summary['db_count']} in database, "
+                   f"{summary['drift_count']} drifted")
+
+
+class Reconciler(threading.Thread):
+    """
+    in-process reconcile loop, one per worker process
+    """
+
+    def __init__(self, app, interval):
+        super().__init__(name='reconciler', daemon=True)
+        self.app = app
+        self.interval = interval
+
+    def run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    reconcile_all()
+                except Exception as e:
+                    self.app.logger.warning(f"reconcile failed: {str(e)}")
+            time.sleep(self.interval)
+
+
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+
+def ensure_reconciler():
+    # started on first request so that it runs in the worker process, not in a preloading master
+    global _reconciler
+    if _reconciler is not None and _reconciler.is_alive():
+        return
+    with _reconciler_lock:
+        if _reconciler is None or not _reconciler.is_alive():
+            _reconciler = Reconciler(current_app._get_current_object(), current_app.config['RECONCILE_INTERVAL'])
+            _reconciler.start()
+
+
+def init_app(app):
+    app.cli.add_command(reconcile_command)
+    app.register_blueprint(bp)
+    if app.config['RECONCILE_INTERVAL'] > 0:
+        app.before_request(ensure_reconciler)
@@ -1,13 +1,17 @@
-import boto3
-
 from source.api_response import *
 from flask import(
     Blueprint, request
 )
 from source.db import get_db
+from source.aws import LazyClient
+from source.pagination import index_response
+from source.batch import run_batch
+from source.reconcile import record_aws_state
+from source.access import add_repo_access, remove_repo_access
+from source.jobs import JobFailed, async_requested, current_job, enqueue_response, job_handler
 
 bp = Blueprint('repo', __name__, url_prefix='/repo')
-codecommit_client = boto3.client('codecommit')
+codecommit_client = LazyClient('codecommit')
 
 
 @bp.route('/index', methods=('GET',))
@@ -17,19 +21,39 @@ def index():
     ---
     tags:
       - repo
+    parameters:
+        - name: after
+          in: query
+          description: 上一页最后一条记录的id
+          required: false
+          schema:
+            type: integer
+        - name: limit
+          in: query
+          description: 每页记录数, 不指定时流式返回全部记录
+          required: false
+          schema:
+            type: integer
+        - name: stream
+          in: query
+          description: 是否流式返回
+          required: false
+          schema:
+            type: integer
+            enum:
+              - 0
+              - 1
     responses:
         '200':
           description: Successful operation
         '400':
           description: Invalid ID supplied
     """
-    db = get_db()
-    rows = db.execute('select * from repo').fetchall()
-    print(len(rows))
-    repos = []
-    for row in rows:
-        repos.append(row_to_dict(row))
-    return succeeded_with_data(repos)
+    try:
+        db = get_db()
+        return index_response(db, 'repo', row_to_dict)
+    except db.InternalError as e:
+        return failed_with_data(e, e.strerror)
 
 
 @bp.route('/create', methods=('PUT',))
@@ -39,6 +63,13 @@ def create():
     ---
     tags:
       - repo
+    parameters:
+        - name: async
+          in: query
+          description: 为1时排队执行并返回任务id, 通过 /jobs/<id> 查询结果
+          required: false
+          schema:
+            type: integer
     requestBody:
       required: true
       content:
@@ -80,50 +111,193 @@ def create():
         description: Server internal issue
     """
     repo_name = request.form['repo_name']
-    project_id = request.form['project_id']
-    project_name = request.form['project_name']
-    owner_id = request.form['owner_id']
-    owner_name = request.form['owner_name']
-    description = request.form['description']
-    status = request.form['status']
-    tags = {
-        "project_id": project_id,
-        "project_name": project_name,
-        "owner_id": owner_id,
-        "owner_name": owner_name,
-    }
+    if async_requested():
+        return enqueue_response('repo.create', request.form.to_dict())
     try:
-        repo = codecommit_client.create_repository(repositoryName=repo_name, repositoryDescription=description,
-                                                   tags=tags)
-        if (not repo) or ('repositoryMetadata' not in repo):
-            return None
-        repository_meta_data = repo['repositoryMetadata']
-        aws_arn = repository_meta_data['Arn']
-        clone_url_http = repository_meta_data['cloneUrlHttp']
-        clone_url_ssh = repository_meta_data['cloneUrlSsh']
-        db = get_db()
-        db.execute(
-            """
-            insert into repo (repo_name
-            , description
-            , project_id
-            , project_name
-            , owner_id
-            , owner_name
-            , status
-            , aws_arn
-            , clone_url_https
-            , clone_url_ssh) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (repo_name, description, project_id, project_name, owner_id, owner_name, status, aws_arn, clone_url_http, clone_url_ssh)
-        )
-        db.commit()
+        create_repo(request.form)
     except Exception as e:
         return failed_without_data(str(e))
     else:
         return succeeded_without_data(f"CodeCommit repository {repo_name} created successfully")
 
 
+@bp.route('/batch_create', methods=('PUT',))
+def batch_create():
+    """
+    批量创建CodeCommit代码库
+    ---
+    tags:
+      - repo
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: array
+            items:
+              type: object
+              properties:
+                repo_name:
+                  type: string
+                  example: xxx_web
+                project_id:
+                  type: integer
+                project_name:
+                  type: string
+                owner_id:
+                  type: integer
+                owner_name:
+                  type: string
+                description:
+                  type: string
+                status:
+                  type: string
+                  default: '正常'
+              required:
+                - repo_name
+                - project_id
+                - project_name
+                - owner_id
+                - owner_name
+                - status
+    responses:
+      '200':
+        description: Per repo result
+      '505':
+        description: Server internal issue
+    """
+    specs = request.get_json(silent=True)
+    if not isinstance(specs, list) or len(specs) == 0:
+        return failed_without_data("Please post a json list of repos")
+    db = get_db()
+    report = []
+    pending = []
+    existing = set()
+    names = [spec.get('repo_name') for spec in specs if isinstance(spec, dict)]
+    for offset in range(0, len(names), 500):
+        chunk = names[offset:offset + 500]
+        rows = db.execute(
+            'SELECT repo_name FROM repo WHERE repo_name IN (%s)' % ("?," * len(chunk))[:-1], chunk
+        ).fetchall()
+        existing.update(row[0] for row in rows)
+    for spec in specs:
+        repo_name = spec.get('repo_name') if isinstance(spec, dict) else None
+        if not repo_name:
+            report.append({"repo_name": repo_name, "succeeded": False, "message": "repo_name is required"})
+        elif repo_name in existing:
+            report.append({"repo_name": repo_name, "succeeded": False, "message": f"{repo_name} is existed"})
+        else:
+            existing.add(repo_name)
+            report.append({"repo_name": repo_name, "succeeded": True, "message": None})
+            pending.append((len(report) - 1, spec))
+
+    results = run_batch(lambda item: create_codecommit_repo(item[1]), pending)
+    rows = []
+    for (index, spec), (row, error) in zip(pending, results):
+        if error is None:
+            rows.append(row)
+        else:
+            report[index]["succeeded"] = False
+            report[index]["message"] = str(error)
+    try:
+        with db:
+            db.executemany(INSERT_REPO_SQL, rows)
+            for row in rows:
+                add_repo_access(db, row[0])
+                record_aws_state(db, 'repo', row[0], row[7], True)
+    except Exception as e:
+        # repositories exist in CodeCommit at this point, report them so they can be imported
+        return failed_with_data(report, f"CodeCommit repositories created but saving failed: {str(e)}")
+    succeeded = len(rows)
+    return succeeded_with_data(report, f"{succeeded} of {len(specs)} repositories created")
+
+
+INSERT_REPO_SQL = """
+    insert into repo (repo_name
+    , description
+    , project_id
+    , project_name
+    , owner_id
+    , owner_name
+    , status
+    , aws_arn
+    , clone_url_https
+    , clone_url_ssh) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+
+@job_handler('repo.create')
+def create_repo(spec):
+    """
+    create the repository in CodeCommit and save it
+    """
+    repo_name = spec['repo_name']
+    db = get_db()
+    # /repo/create calls it directly, outside of a job
+    job = current_job()
+    retry = job is not None and job[1] > 1
+    if retry:
+        # an earlier attempt may have stopped anywhere up to the commit, carry on from there
+        saved = db.execute("select aws_arn from repo where repo_name = ?", (repo_name,)).fetchone()
+        if saved is not None:
+            return {"aws_arn": saved[0]}
+    try:
+        row = create_codecommit_repo(spec)
+    except codecommit_client.exceptions.RepositoryNameExistsException:
+        if not retry:
+            raise JobFailed(f"Repository {repo_name} existed already, please use another name")
+        repo = codecommit_client.get_repository(repositoryName=repo_name)
+        row = codecommit_repo_row(spec, repo['repositoryMetadata'])
+    db.execute(INSERT_REPO_SQL, row)
+    add_repo_access(db, row[0])
+    record_aws_state(db, 'repo', row[0], row[7], True)
+    db.commit()
+    return {"aws_arn": row[7]}
+
+
+def create_codecommit_repo(spec):
+    """
+    create repository in CodeCommit
+    :param spec: mapping with the fields of /repo/create
+    :return: parameters of INSERT_REPO_SQL
+    """
+    repo_name = spec['repo_name']
+    project_id = spec['project_id']
+    project_name = spec['project_name']
+    owner_id = spec['owner_id']
+    owner_name = spec['owner_name']
+    description = spec.get('description', '')
+    tags = {
+        "project_id": str(project_id),
+        "project_name": project_name,
+        "owner_id": str(owner_id),
+        "owner_name": owner_name,
+    }
+    repo = codecommit_client.create_repository(repositoryName=repo_name, repositoryDescription=description,
+                                               tags=tags)
+    if (not repo) or ('repositoryMetadata' not in repo):
+        raise Exception(f"CodeCommit returned no metadata for {repo_name}")
+    return codecommit_repo_row(spec, repo['repositoryMetadata'])
+
+
+def codecommit_repo_row(spec, repository_meta_data):
+    """
+    :return: parameters of INSERT_REPO_SQL for a repository described by CodeCommit
+    """
+    repo_name = spec['repo_name']
+    project_id = spec['project_id']
+    project_name = spec['project_name']
+    owner_id = spec['owner_id']
+    owner_name = spec['owner_name']
+    description = spec.get('description', '')
+    status = spec.get('status', '正常')
+    aws_arn = repository_meta_data['Arn']
+    clone_url_http = repository_meta_data['cloneUrlHttp']
+    clone_url_ssh = repository_meta_data['cloneUrlSsh']
+    return (repo_name, description, project_id, project_name, owner_id, owner_name, status, aws_arn,
+            clone_url_http, clone_url_ssh)
+
+
 @bp.route('/get/<string:repo_name>', methods=('GET',))
 def get_one(repo_name):
     """
@@ -179,6 +353,8 @@ def delete(repo_name):
         codecommit_client.delete_repository(repositoryName=repo_name)
         db = get_db()
         db.execute("delete from repo where repo_name = ?", (repo_name,))
+        remove_repo_access(db, repo_name)
+        record_aws_state(db, 'repo', repo_name, None, False)
         db.commit()
     except db.InternalError as e:
         return failed_without_data(e.strerror)
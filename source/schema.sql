@@ -1,4 +1,7 @@
 -- team is reserved word in sqlite
+-- this is the baseline schema, later changes live in migrations/ and are applied by migrate_db
+
+PRAGMA user_version = 0;
 
 DROP TABLE IF EXISTS team;
 DROP TABLE IF EXISTS project;
@@ -0,0 +1,91 @@
+"""
+Production launcher: ``python -m source.server`` or ``flask serve``.
+
+Runs the ASGI app (source.asgi) under gunicorn with uvicorn workers. The app is built once in
+the master (preload) and forked, listening on the HOST/PORT config. SQLite stays safe to share:
+connections are opened per worker process (pools and AWS clients reset after fork), the
+database runs in WAL mode with busy_timeout, and pending migrations are applied once in the
+master before any worker starts. Without gunicorn (e.g. on Windows) a single uvicorn process
+is started instead.
+"""
+import importlib
+import os
+import tempfile
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from source.db import migrate_db
+
+
+def default_worker_class():
+    for module, worker in (('uvicorn_worker', 'uvicorn_worker.UvicornWorker'),
+                           ('uvicorn.workers', 'uvicorn.workers.UvicornWorker')):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+        return worker
+    raise ImportError("uvicorn is required to serve the ASGI app, pip install uvicorn-worker")
+
+
+def serve(flask_app, host=None, port=None, workers=None):
+    from source.asgi import AsgiApp
+
+    config = flask_app.config
+    host = host or config['HOST']
+    port = port or config['PORT']
+    workers = workers or config['SERVER_WORKERS'] or (os.cpu_count() or 1) * 2 + 1
+    if workers > 1 and not config['METRICS_DIR']:
+        # every worker writes its metrics here so that /metrics answers for all of them
+        config['METRICS_DIR'] = tempfile.mkdtemp(prefix='source-metrics-')
+    if config['SERVER_MIGRATE']:
+        with flask_app.app_context():
+            migrate_db()
+    application = AsgiApp(flask_app)
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        import uvicorn
+        uvicorn.run(application, host=host, port=port, lifespan='on')
+        return
+
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'worker_class': config['SERVER_WORKER_CLASS'] or default_worker_class(),
+        'preload_app': True,
+        'timeout': config['SERVER_TIMEOUT'],
+        'keepalive': config['SERVER_KEEPALIVE'],
+    }
+
+    class Launcher(BaseApplication):
+
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    Launcher().run()
+
+
+@click.command('serve')
+@click.option('--host', default=None, help='defaults to HOST config')
+@click.option('--port', type=int, default=None, help='defaults to PORT config')
+@click.option('--workers', type=int, default=None, help='defaults to SERVER_WORKERS config')
+@with_appcontext
+def serve_command(host, port, workers):
+    serve(current_app._get_current_object(), host, port, workers)
+
+
+def init_app(app):
+    app.cli.add_command(serve_command)
+
+
+if __name__ == '__main__':
+    from source import create_app
+    serve(create_app())
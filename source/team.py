@@ -1,14 +1,22 @@
-import boto3
-
 from source.api_response import *
 from source.db import get_db
+from source import aws
+from source.aws import LazyClient
+from source.cache import iam_cache
+from source.batch import run_batch
+from source.jobs import async_requested, enqueue_response, job_handler
+from source.pagination import index_response
+from source.reconcile import aws_exists, record_aws_state
+from source.access import (
+    add_member_access, remove_member_access, add_policy_access, remove_policy_access, remove_team_access
+)
 
 from flask import (
-    Blueprint, request,
+    Blueprint, current_app, request,
 )
 
 bp = Blueprint('team', __name__, url_prefix='/team')
-iam_client = boto3.client("iam")
+iam_client = LazyClient('iam')
 
 
 @bp.route('/index', methods=('GET',))
@@ -18,6 +26,28 @@ def index():
     ---
     tags:
       - team
+    parameters:
+        - name: after
+          in: query
+          description: 上一页最后一条记录的id
+          required: false
+          schema:
+            type: integer
+        - name: limit
+          in: query
+          description: 每页记录数, 不指定时流式返回全部记录
+          required: false
+          schema:
+            type: integer
+        - name: stream
+          in: query
+          description: 是否流式返回
+          required: false
+          schema:
+            type: integer
+            enum:
+              - 0
+              - 1
     responses:
         '200':
           description: Successful operation
@@ -26,16 +56,9 @@ def index():
     """
     try:
         db = get_db()
-        rows = db.execute(
-            "select * from team"
-        ).fetchall()
-        teams = []
-        for row in rows:
-            teams.append(row_to_dict(row))
+        return index_response(db, 'team', row_to_dict)
     except db.InternalError as e:
         return failed_with_data(e, e.strerror)
-    else:
-        return succeeded_with_data(teams)
 
 
 @bp.route('/get/<int:team_id>', methods=('GET',))
@@ -63,8 +86,11 @@ def get_team(team_id):
         db_group = get_db_group(team_id)
         if db_group is None:
             return succeeded_without_data(f"team {team_id} not found")
-        iam_group = get_iam_group(db_group['team_name'])
-        if iam_group is None:
+        # a recent reconcile run answers without asking IAM
+        exists = aws_exists('group', db_group['team_name'])
+        if exists is None:
+            exists = get_iam_group(db_group['team_name']) is not None
+        if not exists:
             return succeeded_without_data(f"Group {db_group['team_name']} not found")
         return succeeded_with_data(db_group)
 
@@ -75,6 +101,10 @@ def get_team(team_id):
 
 
 def get_iam_group(team_name):
+    return iam_cache.get_or_load(f'group:{team_name}', lambda: load_iam_group(team_name))
+
+
+def load_iam_group(team_name):
     try:
         group = iam_client.get_group(GroupName=team_name)
     except iam_client.exceptions.NoSuchEntityException:
@@ -149,11 +179,13 @@ def create():
         iam_group = get_iam_group(team_name)
         if iam_group is None:
             response = iam_client.create_group(GroupName=team_name)
+            iam_cache.invalidate(f'group:{team_name}')
             aws_arn = response['Group']['Arn']
             db.execute(
                 "insert into team (team_name, status, operator, aws_arn) values (?, ?, ?, ?)",
                 (team_name, status, operator, aws_arn)
             )
+            record_aws_state(db, 'group', team_name, aws_arn, True)
             db.commit()
         else:
             return succeeded_without_data(f"team {team_name} is existed")
@@ -287,11 +319,9 @@ def delete(team_id):
         db_group = get_db_group(team_id)
         if db_group is None:
             return succeeded_without_data("Team not found")
-        iam_group = get_iam_group(db_group['team_name'])
-        if iam_group:
-            iam_client.delete_group(GroupName=db_group['team_name'])
-
-        db.execute('delete from team where id = ?', (team_id,))
+        empty_and_delete_group(db_group['team_name'])
+        iam_cache.invalidate(f"group:{db_group['team_name']}")
+        delete_team_rows(db, team_id, db_group['team_name'])
         db.commit()
     except Exception as e:
         print(e)
@@ -300,6 +330,59 @@ def delete(team_id):
         return succeeded_without_data("team removed successfully")
 
 
+def list_group_entities(team_name):
+    """
+    :return: (member user names, attached policy arns, inline policy names) of an IAM group
+    """
+    def members():
+        pages = iam_client.get_paginator('get_group').paginate(GroupName=team_name)
+        return [user['UserName'] for page in pages for user in page['Users']]
+
+    def attached():
+        pages = iam_client.get_paginator('list_attached_group_policies').paginate(GroupName=team_name)
+        return [policy['PolicyArn'] for page in pages for policy in page['AttachedPolicies']]
+
+    def inline():
+        pages = iam_client.get_paginator('list_group_policies').paginate(GroupName=team_name)
+        return [name for page in pages for name in page['PolicyNames']]
+
+    return aws.gather(aws.submit(members), aws.submit(attached), aws.submit(inline))
+
+
+def empty_and_delete_group(team_name):
+    """
+    remove every member and policy of an IAM group concurrently, then delete the group.
+    IAM refuses to delete a group that still has either
+    :return: dict of counts, None when the group does not exist
+    """
+    try:
+        members, attached, inline = list_group_entities(team_name)
+    except iam_client.exceptions.NoSuchEntityException:
+        return None
+    aws.gather(
+        *(aws.submit(iam_client.remove_user_from_group, GroupName=team_name, UserName=user_name)
+          for user_name in members),
+        *(aws.submit(iam_client.detach_group_policy, GroupName=team_name, PolicyArn=policy_arn)
+          for policy_arn in attached),
+        *(aws.submit(iam_client.delete_group_policy, GroupName=team_name, PolicyName=policy_name)
+          for policy_name in inline),
+    )
+    iam_client.delete_group(GroupName=team_name)
+    return {"members": len(members), "policies": len(attached) + len(inline)}
+
+
+def delete_team_rows(db, team_id, team_name):
+    """
+    remove a team and its members, policies and projects, caller commits
+    """
+    remove_team_access(db, team_name)
+    db.execute('delete from team_member where team_name = ?', (team_name,))
+    db.execute('delete from team_policy where team_name = ?', (team_name,))
+    db.execute('delete from team_project where team_id = ?', (team_id,))
+    db.execute('delete from team where id = ?', (team_id,))
+    record_aws_state(db, 'group', team_name, None, False)
+
+
 @bp.route('/add_member', methods=("PUT",))
 def add_member():
     """
@@ -307,6 +390,13 @@ def add_member():
     ---
     tags:
       - team
+    parameters:
+        - name: async
+          in: query
+          description: 为1时排队执行并返回任务id, 通过 /jobs/<id> 查询结果
+          required: false
+          schema:
+            type: integer
     requestBody:
       required: true
       content:
@@ -331,12 +421,15 @@ def add_member():
     """
     user_name = request.form['user_name']
     team_name = request.form['team_name']
+    if async_requested():
+        return enqueue_response('team.add_member', {"user_name": user_name, "team_name": team_name})
     db = get_db()
     try:
         db.execute(
             "insert into team_member (user_name, team_name) values (?, ?)",
             (user_name, team_name)
         )
+        add_member_access(db, user_name, team_name)
         iam_client.add_user_to_group(UserName=user_name, GroupName=team_name)
         db.commit()
     except Exception as e:
@@ -379,6 +472,7 @@ def delete_member():
     team_name = request.form['team_name']
     db = get_db()
     try:
+        remove_member_access(db, user_name, team_name)
         db.execute(
             "delete from team_member where team_name = ? and user_name = ?",
             (team_name, user_name)
@@ -391,6 +485,156 @@ def delete_member():
         return succeeded_without_data(f"Removed user {user_name} from team {team_name}")
 
 
+@job_handler('team.add_member')
+def add_member_job(payload):
+    iam_client.add_user_to_group(UserName=payload['user_name'], GroupName=payload['team_name'])
+    db = get_db()
+    add_members(db, [(payload['user_name'], payload['team_name'])])
+    db.commit()
+
+
+@job_handler('team.attach_policy')
+def attach_policy_job(payload):
+    iam_client.attach_group_policy(GroupName=payload['team_name'], PolicyArn=payload['policy_arn'])
+    db = get_db()
+    cursor = db.execute(
+        "insert or ignore into team_policy (team_name, policy_arn) values (?, ?)",
+        (payload['team_name'], payload['policy_arn'])
+    )
+    if cursor.rowcount:
+        add_policy_access(db, payload['team_name'], payload['policy_arn'])
+    db.commit()
+
+
+def read_member_pairs():
+    pairs = request.get_json(silent=True)
+    if not isinstance(pairs, list):
+        return None
+    report = []
+    valid = []
+    seen = set()
+    for pair in pairs:
+        user_name = pair.get('user_name') if isinstance(pair, dict) else None
+        team_name = pair.get('team_name') if isinstance(pair, dict) else None
+        item = {"user_name": user_name, "team_name": team_name, "succeeded": True, "message": None}
+        if not user_name or not team_name:
+            item.update(succeeded=False, message="user_name and team_name are required")
+        elif (user_name, team_name) in seen:
+            item.update(succeeded=False, message="duplicated pair")
+        else:
+            seen.add((user_name, team_name))
+            valid.append((len(report), (user_name, team_name)))
+        report.append(item)
+    return report, valid
+
+
+def add_members(db, rows):
+    for user_name, team_name in rows:
+        cursor = db.execute(
+            "insert or ignore into team_member (user_name, team_name) values (?, ?)", (user_name, team_name)
+        )
+        if cursor.rowcount:
+            add_member_access(db, user_name, team_name)
+
+
+def remove_members(db, rows):
+    for user_name, team_name in rows:
+        remove_member_access(db, user_name, team_name)
+        db.execute("delete from team_member where user_name = ? and team_name = ?", (user_name, team_name))
+
+
+def apply_member_batch(iam_call, save):
+    """
+    run iam_call for every pair concurrently, then save(db, pairs) the pairs that succeeded in one transaction
+    """
+    parsed = read_member_pairs()
+    if not parsed or len(parsed[0]) == 0:
+        return failed_without_data("Please post a json list of user_name/team_name pairs")
+    report, valid = parsed
+    results = run_batch(lambda item: iam_call(UserName=item[1][0], GroupName=item[1][1]), valid)
+    rows = []
+    for (index, pair), (_, error) in zip(valid, results):
+        if error is None:
+            rows.append((pair[0], pair[1]))
+        else:
+            report[index].update(succeeded=False, message=str(error))
+    db = get_db()
+    try:
+        with db:
+            save(db, rows)
+    except Exception as e:
+        return failed_with_data(report, f"IAM updated but saving members failed: {str(e)}")
+    return succeeded_with_data(report, f"{len(rows)} of {len(report)} pairs applied")
+
+
+@bp.route('/batch_add_member', methods=("PUT",))
+def batch_add_member():
+    """
+    批量将用户添加到项目组
+    ---
+    tags:
+      - team
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: array
+            items:
+              type: object
+              properties:
+                user_name:
+                  type: string
+                  example: 'tom@nwcdcloud.cn'
+                team_name:
+                  type: string
+                  example: 'team1'
+              required:
+                - user_name
+                - team_name
+    responses:
+      '200':
+        description: Per pair result
+      '505':
+        description: Server internal issue
+    """
+    return apply_member_batch(iam_client.add_user_to_group, add_members)
+
+
+@bp.route('/batch_delete_member', methods=("DELETE",))
+def batch_delete_member():
+    """
+    批量将用户从项目组中移除
+    ---
+    tags:
+      - team
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: array
+            items:
+              type: object
+              properties:
+                user_name:
+                  type: string
+                  example: 'tom@nwcdcloud.cn'
+                team_name:
+                  type: string
+                  example: 'team1'
+              required:
+                - user_name
+                - team_name
+    responses:
+      '200':
+        description: Per pair result
+      '505':
+        description: Server internal issue
+    """
+    return apply_member_batch(iam_client.remove_user_from_group, remove_members)
+
+
 @bp.route('/attach_policy',methods=('PUT',))
 def attach_policy():
     """
@@ -398,6 +642,13 @@ def attach_policy():
     ---
     tags:
       - team
+    parameters:
+        - name: async
+          in: query
+          description: 为1时排队执行并返回任务id, 通过 /jobs/<id> 查询结果
+          required: false
+          schema:
+            type: integer
     requestBody:
       required: true
       content:
@@ -422,16 +673,20 @@ def attach_policy():
     """
     policy_arn = request.form['policy_arn']
     team_name = request.form['team_name']
+    if async_requested():
+        return enqueue_response('team.attach_policy', {"team_name": team_name, "policy_arn": policy_arn})
     db = get_db()
     try:
         iam_client.attach_group_policy(
             GroupName=team_name,
             PolicyArn=policy_arn
         )
-        db.execute(
-            "insert into team_policy (team_name, policy_arn) values (?,?)",
+        cursor = db.execute(
+            "insert or ignore into team_policy (team_name, policy_arn) values (?, ?)",
             (team_name, policy_arn)
         )
+        if cursor.rowcount:
+            add_policy_access(db, team_name, policy_arn)
         db.commit()
     except Exception as e:
         return failed_without_data(str(e))
@@ -476,6 +731,7 @@ def detach_policy():
             GroupName=team_name,
             PolicyArn=policy_arn
         )
+        remove_policy_access(db, team_name, policy_arn)
         db.execute(
             "delete from team_policy where team_name = ? and policy_arn = ?",
             (team_name, policy_arn)
@@ -560,6 +816,13 @@ def batch_delete():
     ---
     tags:
       - team
+    parameters:
+        - name: concurrency
+          in: query
+          description: 同时删除的项目组数
+          required: false
+          schema:
+            type: integer
     requestBody:
       required: true
       content:
@@ -575,23 +838,55 @@ def batch_delete():
 
     responses:
       '200':
-        description: Successful operation
+        description: Per team result
       '505':
         description: Server internal issue
     """
     try:
-        db = get_db()
-        team_ids = request.form['team_ids']
-        if team_ids is None or len(team_ids) == '':
-            return failed_without_data(f"Please specify team")
-        db.execute(
-            'delete from team where id in (' + team_ids + ')'
+        team_ids = [int(team_id) for team_id in request.form.get('team_ids', '').split(',') if team_id.strip()]
+    except ValueError:
+        return failed_without_data("team_ids must be a comma separated list of ids")
+    team_ids = list(dict.fromkeys(team_ids))
+    if len(team_ids) == 0:
+        return failed_without_data("Please specify team")
+    concurrency = request.args.get('concurrency', None, type=int)
+    max_workers = current_app.config['BATCH_MAX_WORKERS']
+    if concurrency is not None:
+        max_workers = max(1, min(concurrency, max_workers))
+
+    db = get_db()
+    teams = {
+        row[0]: row[1] for row in db.execute(
+            f"select id, team_name from team where id in ({', '.join('?' * len(team_ids))})", team_ids
         )
-        db.commit()
-    except db.InternalError as e:
-        return failed_without_data(e.strerror)
-    else:
-        return succeeded_without_data(f"team delete in batch successfully")
+    }
+    report = []
+    pending = []
+    for team_id in team_ids:
+        item = {"team_id": team_id, "team_name": teams.get(team_id), "succeeded": True, "message": None}
+        if team_id in teams:
+            pending.append(item)
+        else:
+            item.update(succeeded=False, message="Team not found")
+        report.append(item)
+
+    results = run_batch(lambda item: empty_and_delete_group(item['team_name']), pending, max_workers)
+    deleted = []
+    for item, (counts, error) in zip(pending, results):
+        iam_cache.invalidate(f"group:{item['team_name']}")
+        if error is not None:
+            item.update(succeeded=False, message=str(error))
+        else:
+            item['message'] = "Group not found in IAM" if counts is None else \
+                f"{counts['members']} members removed, {counts['policies']} policies detached"
+            deleted.append(item)
+    try:
+        with db:
+            for item in deleted:
+                delete_team_rows(db, item['team_id'], item['team_name'])
+    except Exception as e:
+        return failed_with_data(report, f"IAM groups deleted but removing teams failed: {str(e)}")
+    return succeeded_with_data(report, f"{len(deleted)} of {len(team_ids)} teams deleted")
 
 
 def row_to_dict(row):
@@ -0,0 +1,50 @@
+import datetime
+import hashlib
+import hmac
+
+import jwt
+from flask import current_app
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+def identity_hmac(email, ak):
+    """
+    bind a token to user email and access key without a password hash
+    """
+    secret = current_app.config['TOKEN_SECRET'].encode('utf-8')
+    return hmac.new(secret, f'{email}\n{ak}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def issue_token(email, ak, token_type=ACCESS):
+    if token_type == REFRESH:
+        lifetime = current_app.config['REFRESH_TOKEN_LIFETIME']
+    else:
+        lifetime = current_app.config['ACCESS_TOKEN_LIFETIME']
+    now = datetime.datetime.utcnow()
+    payload = {
+        "iss": ak,
+        "exp": now + datetime.timedelta(seconds=lifetime),
+        "iat": now,
+        "typ": token_type,
+        "data": {
+            "hmac": identity_hmac(email, ak)
+        }
+    }
+    return jwt.encode(payload, current_app.config['TOKEN_SECRET'], algorithm="HS256")
+
+
+def decode_token(token, email, token_type=ACCESS):
+    """
+    verify signature, expiry, type and identity binding of a token
+    :return: payload, or None when the token does not belong to email
+    :raise jwt.exceptions.InvalidTokenError
+    """
+    payload = jwt.decode(token, current_app.config['TOKEN_SECRET'], algorithms="HS256")
+    if payload.get('typ', ACCESS) != token_type:
+        raise jwt.exceptions.InvalidTokenError(f"Not an {token_type} token")
+    expected = identity_hmac(email, payload['iss'])
+    if not hmac.compare_digest(payload['data'].get('hmac', ''), expected):
+        return None
+    return payload
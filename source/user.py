@@ -1,17 +1,26 @@
-import datetime
+import csv
+import io
+import sqlite3
 
 import jwt
 
 from source.api_response import *
 from source.db import get_db
+from source import aws
+from source.aws import LazyClient
+from source.pagination import index_response
+from source.cache import iam_cache
+from source.batch import run_batch
+from source.reconcile import aws_exists, record_aws_state
+from source.tokens import ACCESS, REFRESH, decode_token, issue_token
+from source.jobs import JobFailed, async_requested, current_job, enqueue_response, job_handler
 from flask import (
-    Blueprint, request
+    Blueprint, current_app, request
 )
-import boto3
 from werkzeug.security import generate_password_hash, check_password_hash
 
 bp = Blueprint('user', __name__, url_prefix='/user')
-iam_client = boto3.client('iam')
+iam_client = LazyClient('iam')
 
 
 @bp.route('/index', methods=('GET',))
@@ -21,6 +30,28 @@ def index():
     ---
     tags:
       - user
+    parameters:
+        - name: after
+          in: query
+          description: 上一页最后一条记录的id
+          required: false
+          schema:
+            type: integer
+        - name: limit
+          in: query
+          description: 每页记录数, 不指定时流式返回全部记录
+          required: false
+          schema:
+            type: integer
+        - name: stream
+          in: query
+          description: 是否流式返回
+          required: false
+          schema:
+            type: integer
+            enum:
+              - 0
+              - 1
     responses:
         '200':
           description: Successful operation
@@ -28,19 +59,10 @@ def index():
           description: Invalid ID supplied
     """
     try:
-        # json_data = create_readonly_policy()
-        # print(json_data)
         db = get_db()
-        rows = db.execute(
-            "select * from user"
-        ).fetchall()
-        users = []
-        for row in rows:
-            users.append(row_to_dict(row))
+        return index_response(db, 'user', row_to_dict)
     except db.InternalError as e:
         return failed_with_data(e, e.strerror)
-    else:
-        return succeeded_with_data(users)
 
 
 @bp.route('/create', methods=('PUT',))
@@ -50,6 +72,13 @@ def create():
     ---
     tags:
       - user
+    parameters:
+        - name: async
+          in: query
+          description: 为1时排队执行并返回任务id, 通过 /jobs/<id> 查询结果
+          required: false
+          schema:
+            type: integer
     requestBody:
       required: true
       content:
@@ -82,32 +111,19 @@ def create():
       '505':
         description: Server internal issue
     """
+    if async_requested():
+        spec = request.form.to_dict()
+        if spec.get('password'):
+            # the clear password only lives in job_secret until the job finishes
+            spec['password_hash'] = generate_password_hash(spec['password'])
+        return enqueue_response('user.create', spec)
     try:
         db = get_db()
         user_name = request.form['user_name']
         email = request.form['email']
-        password = generate_password_hash(request.form['password'])
-        status = request.form['status']
-        user = get_iam_user(email)
-        if user is None:
-            # create account
-            user = iam_client.create_user(UserName=email)
-            # create password
-            iam_client.create_login_profile(UserName=email, Password=request.form['password'])
-            # create AKSK
-            access_key = iam_client.create_access_key(
-                UserName=email
-            )
-            ak = access_key['AccessKey']['AccessKeyId']
-            sk = access_key['AccessKey']['SecretAccessKey']
-            operator = 1
-            db.execute(
-                """
-                insert into user (user_name, email, password, status, operator, aws_arn, ak, sk) 
-                values (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (user_name, email, password, status, operator, user['User']['Arn'],ak, sk)
-            )
+        row = create_iam_user(request.form)
+        if row is not None:
+            save_user(db, row)
             db.commit()
             return succeeded_without_data(f"User {email} added successfully")
 
@@ -117,6 +133,221 @@ def create():
         return succeeded_without_data(f"User {user_name} existed already, please use another one")
 
 
+@bp.route('/batch_create', methods=('PUT',))
+def batch_create():
+    """
+    批量创建用户, 支持json列表或csv文件(表头 user_name,email,password,status)
+    ---
+    tags:
+      - user
+    parameters:
+        - name: concurrency
+          in: query
+          description: 同时创建的用户数
+          required: false
+          schema:
+            type: integer
+    requestBody:
+      required: true
+      content:
+        application/json:
+          schema:
+            type: array
+            items:
+              type: object
+              properties:
+                user_name:
+                  type: string
+                  example: '张三'
+                email:
+                  type: string
+                  example: 'zhangsan@sample.com'
+                password:
+                  type: string
+                  example: 'Asia_Info_888'
+                status:
+                  type: string
+                  default: '正常'
+              required:
+                - user_name
+                - email
+                - password
+        multipart/form-data:
+          schema:
+            type: object
+            properties:
+              file:
+                type: string
+                format: binary
+    responses:
+      '200':
+        description: Per user result
+      '505':
+        description: Server internal issue
+    """
+    try:
+        specs = read_user_specs()
+    except Exception as e:
+        return failed_without_data(f"Invalid user list: {str(e)}")
+    if len(specs) == 0:
+        return failed_without_data("Please post a json list or csv file of users")
+    concurrency = request.args.get('concurrency', None, type=int)
+    max_workers = current_app.config['BATCH_MAX_WORKERS']
+    if concurrency is not None:
+        max_workers = max(1, min(concurrency, max_workers))
+
+    db = get_db()
+    existing_names, existing_emails = existing_users(db, specs)
+    report = []
+    pending = []
+    for spec in specs:
+        email = spec.get('email')
+        user_name = spec.get('user_name')
+        if not email or not user_name or not spec.get('password'):
+            report.append({"email": email, "succeeded": False, "message": "user_name, email and password are required"})
+        elif email in existing_emails:
+            report.append({"email": email, "succeeded": False, "message": f"{email} is existed"})
+        elif user_name in existing_names:
+            report.append({"email": email, "succeeded": False, "message": f"{user_name} is existed"})
+        else:
+            existing_emails.add(email)
+            existing_names.add(user_name)
+            report.append({"email": email, "succeeded": True, "message": None})
+            pending.append((len(report) - 1, spec))
+
+    results = run_batch(lambda item: create_iam_user(item[1]), pending, max_workers)
+    saved = 0
+    try:
+        with db:
+            for (index, spec), (row, error) in zip(pending, results):
+                if error is not None:
+                    report[index].update(succeeded=False, message=str(error))
+                elif row is None:
+                    report[index].update(succeeded=False, message=f"User {spec['email']} existed already")
+                else:
+                    # a failed insert only undoes itself, the rows saved before it stay in the transaction
+                    try:
+                        save_user(db, row)
+                    except sqlite3.IntegrityError as e:
+                        report[index].update(succeeded=False, message=f"IAM user created but saving failed: {str(e)}")
+                    else:
+                        saved += 1
+    except Exception as e:
+        return failed_with_data(report, f"IAM users created but saving failed: {str(e)}")
+    return succeeded_with_data(report, f"{saved} of {len(specs)} users created")
+
+
+def existing_users(db, specs):
+    """
+    :return: sets of the user names and emails of specs that are in the user table already
+    """
+    names, emails = set(), set()
+    for column, found in (('user_name', names), ('email', emails)):
+        values = [spec.get(column) for spec in specs if spec.get(column)]
+        for offset in range(0, len(values), 500):
+            chunk = values[offset:offset + 500]
+            rows = db.execute(
+                'SELECT %s FROM user WHERE %s IN (%s)' % (column, column, ("?," * len(chunk))[:-1]), chunk
+            ).fetchall()
+            found.update(row[0] for row in rows)
+    return names, emails
+
+
+def read_user_specs():
+    upload = request.files.get('file')
+    if upload is not None or request.mimetype == 'text/csv':
+        content = upload.read() if upload is not None else request.get_data()
+        reader = csv.DictReader(io.StringIO(content.decode('utf-8-sig')))
+        return [{key.strip(): (value or '').strip() for key, value in row.items() if key} for row in reader]
+    specs = request.get_json(silent=True)
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError("json body must be a list of objects")
+    return specs
+
+
+INSERT_USER_SQL = """
+    insert into user (user_name, email, password, status, operator, aws_arn, ak, sk)
+    values (?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+
+# tag of the IAM users created by a user.create job, lets a retry tell them from existing ones
+JOB_TAG = 'source-job'
+
+
+@job_handler('user.create', secrets=('password',))
+def create_user_job(spec):
+    job_id, attempt = current_job()
+    tag = {"Key": JOB_TAG, "Value": str(job_id)}
+    email = spec['email']
+    db = get_db()
+    row = None
+    if attempt > 1:
+        # an earlier attempt may have stopped anywhere up to the commit, carry on from there
+        iam_cache.invalidate(f'user:{email}')
+        iam_user = get_iam_user(email)
+        if iam_user is not None and tag in iam_user['User'].get('Tags', []):
+            saved = db.execute("select aws_arn from user where email = ?", (email,)).fetchone()
+            if saved is not None:
+                return {"aws_arn": saved[0]}
+            row = provision_iam_user(spec, iam_user['User']['Arn'], resume=True)
+    if row is None:
+        row = create_iam_user(spec, tags=[tag])
+    if row is None:
+        raise JobFailed(f"User {spec['user_name']} existed already, please use another one")
+    save_user(db, row)
+    db.commit()
+    return {"aws_arn": row[5]}
+
+
+def save_user(db, row):
+    db.execute(INSERT_USER_SQL, row)
+    record_aws_state(db, 'user', row[1], row[5], True)
+
+
+def create_iam_user(spec, tags=()):
+    """
+    create IAM user with console password and access key
+    :param spec: mapping with the fields of /user/create
+    :return: parameters of INSERT_USER_SQL, None if the IAM user exists already
+    """
+    email = spec['email']
+    if get_iam_user(email) is not None:
+        return None
+    # create account
+    user = iam_client.create_user(UserName=email, **({'Tags': list(tags)} if tags else {}))
+    iam_cache.invalidate(f'user:{email}')
+    return provision_iam_user(spec, user['User']['Arn'])
+
+
+def provision_iam_user(spec, aws_arn, resume=False):
+    """
+    give an IAM user its console password and access key
+    :param resume: an earlier attempt may have created either of them already
+    :return: parameters of INSERT_USER_SQL
+    """
+    email = spec['email']
+    # create password
+    try:
+        iam_client.create_login_profile(UserName=email, Password=spec['password'])
+    except iam_client.exceptions.EntityAlreadyExistsException:
+        if not resume:
+            raise
+    if resume:
+        # the secret of a key is only returned on creation, keys of the earlier attempt are useless
+        for key in iam_client.list_access_keys(UserName=email)['AccessKeyMetadata']:
+            iam_client.delete_access_key(UserName=email, AccessKeyId=key['AccessKeyId'])
+    # create AKSK
+    access_key = iam_client.create_access_key(
+        UserName=email
+    )
+    ak = access_key['AccessKey']['AccessKeyId']
+    sk = access_key['AccessKey']['SecretAccessKey']
+    password = spec.get('password_hash') or generate_password_hash(spec['password'])
+    operator = 1
+    return (spec['user_name'], email, password, spec.get('status') or '正常', operator, aws_arn, ak, sk)
+
+
 @bp.route('/delete/<string:email>', methods=('DELETE',))
 def delete(email):
     """
@@ -140,28 +371,35 @@ def delete(email):
     db = get_db()
     try:
 
-        iam_user = get_iam_user(email)
+        # IAM lookup runs while the database is read
+        iam_future = aws.submit(get_iam_user, email)
+        db_user = get_db_user(email)
+        iam_user = iam_future.result()
         if iam_user is None:
             return succeeded_without_data(f"User {email} not found in iam")
-        db_user = get_db_user(email)
         if db_user is None:
             return succeeded_without_data(f"User {email} not found in database")
-        try:
-            iam_client.delete_access_key(UserName=email, AccessKeyId=db_user['ak'])
-        except Exception as e:
-            print(f'warning: when removing delete_access_key for {email} occurred error')
-
-        try:
-            iam_client.delete_login_profile(UserName=email)
-        except Exception as e:
-            print(f'warning: when removing delete_access_key for {email} occurred error')
+        # access key and login profile are independent, IAM deletes the user only once both are gone
+        teardown = {
+            'delete_access_key': aws.submit(iam_client.delete_access_key, UserName=email, AccessKeyId=db_user['ak']),
+            'delete_login_profile': aws.submit(iam_client.delete_login_profile, UserName=email),
+        }
+        for operation, future in teardown.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f'warning: when removing {operation} for {email} occurred error')
 
+        in_aws = False
         try:
             iam_client.delete_user(UserName=email)
         except Exception as e:
-            print(f'warning: when removing delete_access_key for {email} occurred error')
+            in_aws = True
+            print(f'warning: when removing delete_user for {email} occurred error')
+        iam_cache.invalidate(f'user:{email}')
 
         db.execute("delete from user where email = ?", (email,))
+        record_aws_state(db, 'user', email, None, in_aws, False)
         db.commit()
     except Exception as e:
         return failed_without_data(str(e))
@@ -189,14 +427,25 @@ def get_user(email):
         '505':
           description: Server internal issue
     """
-    user = get_iam_user(email)
-    if user is None:
+    # a recent reconcile run answers without asking IAM
+    exists = aws_exists('user', email)
+    if exists is None:
+        # IAM lookup runs while the database is read
+        iam_future = aws.submit(get_iam_user, email)
+        db_user = get_db_user(email)
+        exists = iam_future.result() is not None
+    else:
+        db_user = get_db_user(email)
+    if not exists:
         return succeeded_without_data(f"User {email} not existed")
-    db_user = get_db_user(email)
     return succeeded_with_data(db_user)
 
 
 def get_iam_user(email):
+    return iam_cache.get_or_load(f'user:{email}', lambda: load_iam_user(email))
+
+
+def load_iam_user(email):
     try:
         user = iam_client.get_user(UserName=email)
     except iam_client.exceptions.NoSuchEntityException:
@@ -252,19 +501,62 @@ def get_token():
         return failed_without_data(f"User {email} not found")
     if check_password_hash(db_user['password'], password) is False:
         return failed_without_data(f"Invalid user or password, please try again")
-    identify = email + db_user['ak']
-    identify_hash = generate_password_hash(identify)
-    secret = "Asia_Info_88*"
-    payload = {
-        "iss": db_user['ak'],
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(minutes=1),
-        "iat": datetime.datetime.utcnow(),
-        "data": {
-            "hash": identify_hash
-        }
+    return token_response(email, db_user['ak'])
+
+
+@bp.route('/refresh_token', methods=("GET",))
+def refresh_token():
+    """
+    根据refresh token获取新的用户token
+    ---
+    tags:
+      - user
+    parameters:
+        - name: X-USER-NAME
+          in: header
+          description: 用户邮箱
+          required: true
+          schema:
+            type: string
+        - name: X-REFRESH-TOKEN
+          in: header
+          description: get_token返回的refresh_token
+          required: true
+          schema:
+            type: string
+    responses:
+        '200':
+          description: Successful operation
+        '505':
+          description: Server internal issue
+    """
+    email = request.headers.get("X-USER-NAME", None)
+    token = request.headers.get("X-REFRESH-TOKEN", None)
+    if email is None or token is None:
+        return failed_without_data("Please specify user name and refresh token")
+    try:
+        payload = decode_token(token, email, REFRESH)
+    except jwt.exceptions.ExpiredSignatureError:
+        return failed_without_data("Refresh token expired, please retrieve a new token")
+    except jwt.exceptions.InvalidTokenError:
+        return failed_without_data("Invalid refresh token, please retrieve a valid token")
+    if payload is None:
+        return failed_without_data(f"User {email} not authorized")
+    db_user = get_db_user(email)
+    # access key rotation or user removal revokes refresh tokens
+    if db_user is None or db_user['ak'] != payload['iss']:
+        return failed_without_data(f"User {email} not authorized")
+    return token_response(email, db_user['ak'])
+
+
+def token_response(email, ak):
+    tokens = {
+        "token": issue_token(email, ak, ACCESS),
+        "refresh_token": issue_token(email, ak, REFRESH),
+        "expires_in": current_app.config['ACCESS_TOKEN_LIFETIME']
     }
-    token = jwt.encode(payload, secret, algorithm="HS256")
-    return succeeded_without_data(token)
+    # message keeps carrying the access token for existing clients
+    return succeeded_with_data(tokens, tokens['token'])
 
 
 def row_to_dict(row):
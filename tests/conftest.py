@@ -0,0 +1,221 @@
+import pytest
+
+from source import create_app
+from source.db import init_db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'test.sqlite'),
+        'JOB_WORKERS': 0,
+    })
+    with app.app_context():
+        init_db()
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class NoSuchEntityException(Exception):
+    pass
+
+
+class DeleteConflictException(Exception):
+    pass
+
+
+class EntityAlreadyExistsException(Exception):
+    pass
+
+
+class RepositoryNameExistsException(Exception):
+    pass
+
+
+class FakePaginator(object):
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        yield self.method(**kwargs)
+
+
+class FakeIAM(object):
+    """
+    in memory stand-in for the parts of the IAM client used by the blueprints
+    """
+
+    class exceptions(object):
+        NoSuchEntityException = NoSuchEntityException
+        DeleteConflictException = DeleteConflictException
+        EntityAlreadyExistsException = EntityAlreadyExistsException
+
+    def __init__(self):
+        self.users = {}
+        self.groups = {}
+        self.policies = {}
+        self.members = {}
+        self.attached = {}
+        self.login_profiles = set()
+        self.access_keys = {}
+        self.fail = set()
+        # (operation, name) pairs that fail once, like a throttled call
+        self.fail_once = set()
+
+    def get_paginator(self, name):
+        return FakePaginator(getattr(self, name))
+
+    def check(self, name, operation=None):
+        if name in self.fail:
+            raise Exception(f'injected failure for {name}')
+        if (operation, name) in self.fail_once:
+            self.fail_once.discard((operation, name))
+            raise Exception(f'injected throttling of {operation} for {name}')
+
+    def get_user(self, UserName):
+        if UserName not in self.users:
+            raise NoSuchEntityException(UserName)
+        return {"User": self.users[UserName]}
+
+    def create_user(self, UserName, Tags=()):
+        self.check(UserName)
+        if UserName in self.users:
+            raise EntityAlreadyExistsException(UserName)
+        self.users[UserName] = {
+            "UserName": UserName, "Arn": f"arn:aws-cn:iam::123456789012:user/{UserName}", "Tags": list(Tags)
+        }
+        return {"User": self.users[UserName]}
+
+    def create_login_profile(self, UserName, Password):
+        self.check(Password)
+        self.check(UserName, 'create_login_profile')
+        if UserName in self.login_profiles:
+            raise EntityAlreadyExistsException(UserName)
+        self.login_profiles.add(UserName)
+        return {}
+
+    def create_access_key(self, UserName):
+        keys = self.access_keys.setdefault(UserName, [])
+        keys.append(f"AK{UserName}{len(keys) or ''}")
+        return {"AccessKey": {"AccessKeyId": keys[-1], "SecretAccessKey": "SK"}}
+
+    def list_access_keys(self, UserName):
+        return {"AccessKeyMetadata": [{"AccessKeyId": key} for key in self.access_keys.get(UserName, [])]}
+
+    def delete_access_key(self, UserName, AccessKeyId):
+        self.access_keys[UserName].remove(AccessKeyId)
+
+    def get_group(self, GroupName):
+        if GroupName not in self.groups:
+            raise NoSuchEntityException(GroupName)
+        users = [{"UserName": user_name} for user_name in sorted(self.members.get(GroupName, ()))]
+        return {"Group": self.groups[GroupName], "Users": users}
+
+    def list_attached_group_policies(self, GroupName):
+        return {"AttachedPolicies": [{"PolicyArn": arn} for arn in sorted(self.attached.get(GroupName, ()))]}
+
+    def list_group_policies(self, GroupName):
+        return {"PolicyNames": []}
+
+    def delete_group(self, GroupName):
+        self.check(GroupName)
+        if GroupName not in self.groups:
+            raise NoSuchEntityException(GroupName)
+        if self.members.get(GroupName) or self.attached.get(GroupName):
+            raise DeleteConflictException(GroupName)
+        del self.groups[GroupName]
+
+    def create_group(self, GroupName):
+        self.groups[GroupName] = {"GroupName": GroupName, "Arn": f"arn:aws-cn:iam::123456789012:group/{GroupName}"}
+        return {"Group": self.groups[GroupName]}
+
+    def create_policy(self, PolicyName, PolicyDocument):
+        arn = f"arn:aws-cn:iam::123456789012:policy/{PolicyName}"
+        self.policies[arn] = {"PolicyName": PolicyName, "Arn": arn, "AttachmentCount": 0}
+        return {"Policy": self.policies[arn]}
+
+    def get_policy(self, PolicyArn):
+        if PolicyArn not in self.policies:
+            raise NoSuchEntityException(PolicyArn)
+        return {"Policy": self.policies[PolicyArn]}
+
+    def delete_policy(self, PolicyArn):
+        self.policies.pop(PolicyArn)
+
+    def add_user_to_group(self, UserName, GroupName):
+        self.check(UserName)
+        self.members.setdefault(GroupName, set()).add(UserName)
+
+    def remove_user_from_group(self, UserName, GroupName):
+        self.check(UserName)
+        self.members.get(GroupName, set()).discard(UserName)
+
+    def attach_group_policy(self, GroupName, PolicyArn):
+        self.check(PolicyArn)
+        self.attached.setdefault(GroupName, set()).add(PolicyArn)
+
+    def detach_group_policy(self, GroupName, PolicyArn):
+        self.check(PolicyArn)
+        self.attached.get(GroupName, set()).discard(PolicyArn)
+
+
+class FakeCodeCommit(object):
+    """
+    in memory stand-in for the CodeCommit calls of the repo blueprint
+    """
+
+    class exceptions(object):
+        RepositoryNameExistsException = RepositoryNameExistsException
+
+    def __init__(self):
+        self.repos = {}
+        # repository names whose creation fails once after it went through
+        self.lost_responses = set()
+
+    def create_repository(self, repositoryName, repositoryDescription, tags):
+        if repositoryName == 'broken':
+            raise Exception('RepositoryLimitExceededException')
+        if repositoryName in self.repos:
+            raise RepositoryNameExistsException(repositoryName)
+        self.repos[repositoryName] = {
+            "Arn": f"arn:aws-cn:codecommit:cn-north-1:123456789012:{repositoryName}",
+            "cloneUrlHttp": f"https://example.com/{repositoryName}",
+            "cloneUrlSsh": f"ssh://example.com/{repositoryName}",
+        }
+        if repositoryName in self.lost_responses:
+            self.lost_responses.discard(repositoryName)
+            raise Exception(f'connection reset creating {repositoryName}')
+        return {"repositoryMetadata": self.repos[repositoryName]}
+
+    def get_repository(self, repositoryName):
+        return {"repositoryMetadata": self.repos[repositoryName]}
+
+
+@pytest.fixture
+def fake_iam(monkeypatch):
+    import source.policy
+    import source.team
+    import source.user
+    from source.cache import iam_cache
+
+    iam = FakeIAM()
+    for module in (source.user, source.team, source.policy):
+        monkeypatch.setattr(module, 'iam_client', iam)
+    iam_cache.clear()
+    yield iam
+    iam_cache.clear()
+
+
+@pytest.fixture
+def fake_codecommit(monkeypatch):
+    import source.repo
+
+    codecommit = FakeCodeCommit()
+    monkeypatch.setattr(source.repo, 'codecommit_client', codecommit)
+    yield codecommit
@@ -0,0 +1,125 @@
+import json
+
+from source.access import get_repo_access, get_user_access, policy_resources, resource_prefix
+from source.db import get_db
+from source.policy import get_policy_template
+
+ARN = 'arn:aws-cn:codecommit:cn-north-1:123456789012'
+
+
+def test_policy_resources():
+    detail = get_policy_template('developer').render([f'{ARN}:app-*', f'{ARN}:web'])
+    assert policy_resources(detail) == {f'{ARN}:app-*': 'write', f'{ARN}:web': 'write'}
+    assert policy_resources(get_policy_template('admin').render('*')) == {'*': 'admin'}
+    assert resource_prefix(f'{ARN}:app-*') == f'{ARN}:app-'
+    assert resource_prefix('*') == ''
+
+
+def test_policy_resources_deny():
+    detail = json.loads(get_policy_template('developer').render([f'{ARN}:app-*', f'{ARN}:web']))
+    detail['Statement'].append({"Effect": "Deny", "Action": "codecommit:GitPush", "Resource": f'{ARN}:app-*'})
+    detail['Statement'].append({"Effect": "Deny", "Action": "codecommit:*", "Resource": f'{ARN}:web'})
+    assert policy_resources(json.dumps(detail)) == {f'{ARN}:app-*': 'read'}
+
+
+def test_effective_access(app, client):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "insert into repo (repo_name, aws_arn) values (?, ?)",
+            [(name, f'{ARN}:{name}') for name in ('app-api', 'app-web', 'web', 'tools')]
+        )
+        db.executemany(
+            "insert into policy (policy_name, detail, operator, aws_arn) values (?, ?, 1, ?)",
+            [
+                ('app_developer', get_policy_template('developer').render(f'{ARN}:app-*'), 'arn:p/app_developer'),
+                ('web_readonly', get_policy_template('readonly').render([f'{ARN}:web', f'{ARN}:app-web']),
+                 'arn:p/web_readonly'),
+            ]
+        )
+        db.executemany(
+            "insert into team_policy (team_name, policy_arn) values (?, ?)",
+            [('app', 'arn:p/app_developer'), ('web', 'arn:p/web_readonly'),
+             ('ops', 'arn:aws-cn:iam::aws:policy/AWSCodeCommitFullAccess')]
+        )
+        db.executemany(
+            "insert into team_member (user_name, team_name) values (?, ?)",
+            [('alice@sample.com', 'app'), ('alice@sample.com', 'web'), ('bob@sample.com', 'web'),
+             ('carol@sample.com', 'ops')]
+        )
+        db.commit()
+
+        repos = get_user_access('alice@sample.com')
+        assert [(r['repo_name'], r['access']) for r in repos] == [
+            ('app-api', 'write'), ('app-web', 'write'), ('web', 'read')
+        ]
+        assert sorted(via['team_name'] for via in repos[1]['via']) == ['app', 'web']
+        assert len(get_user_access('carol@sample.com')) == 4
+
+        users = get_repo_access('app-web')
+        assert [(u['user_name'], u['access']) for u in users] == [
+            ('alice@sample.com', 'write'), ('bob@sample.com', 'read'), ('carol@sample.com', 'admin')
+        ]
+
+    result = client.get('/access/user/alice@sample.com?access=write').get_json()
+    assert [r['repo_name'] for r in result['payload']] == ['app-api', 'app-web']
+    result = client.get('/access/repo/tools').get_json()
+    assert [u['user_name'] for u in result['payload']] == ['carol@sample.com']
+    assert not client.get('/access/repo/tools?access=owner').get_json()['succeeded']
+
+
+def test_access_matrix_follows_mutations(app, client, fake_iam, fake_codecommit):
+    from source.access import check_access_matrix
+
+    spec = {"project_id": 1, "project_name": "p1", "owner_id": 1, "owner_name": "tom"}
+    client.put('/repo/batch_create', json=[dict(spec, repo_name=name) for name in ('app-api', 'web')])
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "insert into policy (policy_name, detail, operator, aws_arn) values (?, ?, 1, ?)",
+            ('app_developer', get_policy_template('developer').render(f'{ARN}:app-*'), 'arn:p/app_developer')
+        )
+        db.commit()
+
+    def matrix():
+        with app.app_context():
+            assert check_access_matrix(get_db()) == []
+        result = client.get('/access/matrix').get_json()
+        return [(row['user_name'], row['repo_name'], row['access']) for row in result['payload']]
+
+    client.put('/team/add_member', data={"user_name": "alice@sample.com", "team_name": "app"})
+    client.put('/team/batch_add_member', json=[
+        {"user_name": "bob@sample.com", "team_name": "app"}, {"user_name": "alice@sample.com", "team_name": "ops"}
+    ])
+    client.put('/team/attach_policy', data={"team_name": "app", "policy_arn": "arn:p/app_developer"})
+    assert matrix() == [('alice@sample.com', 'app-api', 'write'), ('bob@sample.com', 'app-api', 'write')]
+
+    client.put('/team/attach_policy', data={
+        "team_name": "ops", "policy_arn": "arn:aws-cn:iam::aws:policy/AWSCodeCommitReadOnly"
+    })
+    client.put('/repo/create', data=dict(spec, repo_name='app-web', description=''))
+    assert matrix() == [
+        ('alice@sample.com', 'app-api', 'write'), ('alice@sample.com', 'app-web', 'write'),
+        ('alice@sample.com', 'web', 'read'), ('bob@sample.com', 'app-api', 'write'),
+        ('bob@sample.com', 'app-web', 'write'),
+    ]
+
+    client.delete('/team/detach_policy', data={"team_name": "app", "policy_arn": "arn:p/app_developer"})
+    client.delete('/team/batch_delete_member', json=[{"user_name": "bob@sample.com", "team_name": "app"}])
+    assert matrix() == [
+        ('alice@sample.com', 'app-api', 'read'), ('alice@sample.com', 'app-web', 'read'),
+        ('alice@sample.com', 'web', 'read'),
+    ]
+    client.delete('/team/delete_member', data={"user_name": "alice@sample.com", "team_name": "ops"})
+    assert matrix() == []
+
+
+def test_check_access_matrix_repairs(app):
+    from source.access import check_access_matrix
+
+    with app.app_context():
+        db = get_db()
+        db.execute("insert into access_matrix (user_name, repo_name, read_grants) values ('ghost', 'web', 1)")
+        db.commit()
+        assert check_access_matrix(db, repair=True) == [('ghost', 'web', (1, 0, 0), None)]
+        assert check_access_matrix(db) == []
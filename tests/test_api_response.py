@@ -0,0 +1,21 @@
+import json
+
+import pytest
+
+from source.api_response import ENCODERS, succeeded_with_data
+
+
+@pytest.mark.parametrize('encoder', sorted(ENCODERS))
+def test_compact_and_pretty(app, encoder):
+    app.config['JSON_ENCODER'] = encoder
+    data = {"name": "张三", "ids": [1, 2]}
+    with app.test_request_context('/'):
+        response = succeeded_with_data(data)
+    assert response.mimetype == 'application/json'
+    assert b'\n' not in response.data
+    assert json.loads(response.data)['payload'] == data
+
+    with app.test_request_context('/?pretty=1'):
+        response = succeeded_with_data(data)
+    assert b'\n  ' in response.data
+    assert '张三' in response.get_data(as_text=True)
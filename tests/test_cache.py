@@ -0,0 +1,54 @@
+import pytest
+
+from source.cache import MemoryBackend, SqliteBackend, TTLCache
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        backend = MemoryBackend(2)
+    else:
+        backend = SqliteBackend(str(tmp_path / 'cache.sqlite'), 2)
+    return TTLCache(backend, 60, 60)
+
+
+def test_read_through(cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {"User": {"UserName": "tom"}}
+
+    assert cache.get_or_load('user:tom', loader) == {"User": {"UserName": "tom"}}
+    assert cache.get_or_load('user:tom', loader) == {"User": {"UserName": "tom"}}
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+    cache.invalidate('user:tom')
+    cache.get_or_load('user:tom', loader)
+    assert len(calls) == 2
+
+
+def test_negative_caching(cache):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return None
+
+    assert cache.get_or_load('group:missing', loader) is None
+    assert cache.get_or_load('group:missing', loader) is None
+    assert len(calls) == 1
+
+
+def test_expiry_and_lru():
+    cache = TTLCache(MemoryBackend(2), 60, 0)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('b', lambda: 2)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('c', lambda: 3)
+    assert cache.backend.get('b') == (False, None)
+    assert cache.backend.get('a') == (True, 1)
+
+    cache.get_or_load('missing', lambda: None)
+    assert cache.backend.get('missing') == (False, None)
@@ -0,0 +1,29 @@
+from source.db import get_db, list_migrations, migrate_db
+
+
+def test_init_db_applies_migrations(app):
+    with app.app_context():
+        db = get_db()
+        latest = list_migrations()[-1][0]
+        assert db.execute('PRAGMA user_version').fetchone()[0] == latest
+        plan = db.execute(
+            'EXPLAIN QUERY PLAN select * from team_member where team_name = ?', ('team1',)
+        ).fetchall()
+        assert 'USING' in plan[0][3]
+        assert migrate_db() == []
+
+
+def test_migrate_legacy_database(app):
+    with app.app_context():
+        db = get_db()
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf-8'))
+        db.executemany(
+            "insert into team_policy (team_name, policy_arn) values (?, ?)",
+            [('team1', 'arn1'), ('team1', 'arn1'), ('team2', 'arn1')]
+        )
+        db.commit()
+
+        applied = migrate_db()
+        assert applied == [name for _, name in list_migrations()]
+        assert db.execute('select count(*) from team_policy').fetchone()[0] == 2
@@ -0,0 +1,92 @@
+from source.db import get_db
+from source.jobs import claim, run_pending
+
+
+def job(client, job_id):
+    return client.get(f'/jobs/{job_id}').get_json()['payload']
+
+
+def test_async_add_member(app, client, fake_iam):
+    result = client.put('/team/add_member?async=1', data={"user_name": "tom@sample.com", "team_name": "team1"})
+    job_id = result.get_json()['payload']['job_id']
+    assert job(client, job_id)['status'] == 'pending'
+    assert 'tom@sample.com' not in fake_iam.members.get('team1', ())
+
+    with app.app_context():
+        assert run_pending() == 1
+    assert job(client, job_id)['status'] == 'succeeded'
+    assert fake_iam.members['team1'] == {'tom@sample.com'}
+    assert [u['user_name'] for u in client.get('/team/get_users/team1').get_json()] == ['tom@sample.com']
+
+
+def test_failed_job_is_retried(app, client, fake_iam):
+    app.config['JOB_RETRY_BASE'] = 0
+    fake_iam.fail.add('tom@sample.com')
+    result = client.put('/team/add_member?async=1', data={"user_name": "tom@sample.com", "team_name": "team1"})
+    job_id = result.get_json()['payload']['job_id']
+    with app.app_context():
+        # JOB_RETRY_BASE 0 makes every retry runnable at once
+        assert run_pending() == app.config['JOB_MAX_ATTEMPTS']
+    status = job(client, job_id)
+    assert status['status'] == 'failed' and status['attempts'] == app.config['JOB_MAX_ATTEMPTS']
+    assert 'injected failure' in status['error']
+
+    app.config['JOB_MAX_ATTEMPTS'] = 2
+    result = client.put('/team/add_member?async=1', data={"user_name": "tom@sample.com", "team_name": "team1"})
+    job_id = result.get_json()['payload']['job_id']
+    with app.app_context():
+        db = get_db()
+        job_row = claim(db, 'w1', 60)
+        assert job_row[0] == job_id
+        # w1 died, its lease ran out
+        db.execute("update job set locked_until = datetime('now', '-1 seconds') where id = ?", (job_id,))
+        db.commit()
+        fake_iam.fail.clear()
+        assert run_pending('w2') == 1
+    status = job(client, job_id)
+    assert (status['status'], status['attempts']) == ('succeeded', 2)
+
+
+def test_async_create_user_keeps_password_out_of_job(app, client, fake_iam):
+    app.config['JOB_RETRY_BASE'] = 0
+    fake_iam.fail_once.add(('create_login_profile', 'tom@sample.com'))
+    data = {"user_name": "tom", "email": "tom@sample.com", "password": "Secret_123"}
+    job_id = client.put('/user/create?async=1', data=data).get_json()['payload']['job_id']
+    with app.app_context():
+        db = get_db()
+        assert 'Secret_123' not in db.execute("select payload from job where id = ?", (job_id,)).fetchone()[0]
+        assert db.execute("select value from job_secret where job_id = ?", (job_id,)).fetchone()[0] == 'Secret_123'
+        # the first attempt created the IAM user, then its login profile was throttled
+        assert run_pending() == 2
+        assert db.execute("select count(*) from job_secret").fetchone()[0] == 0
+        assert db.execute("select ak from user where email = 'tom@sample.com'").fetchone()[0] == 'AKtom@sample.com'
+    status = job(client, job_id)
+    assert (status['status'], status['attempts']) == ('succeeded', 2)
+    assert status['result'] == {"aws_arn": "arn:aws-cn:iam::123456789012:user/tom@sample.com"}
+    assert fake_iam.login_profiles == {'tom@sample.com'}
+    headers = {"X-USER-NAME": "tom@sample.com", "X-USER-PASSWORD": "Secret_123"}
+    assert client.get('/user/get_token', headers=headers).get_json()['succeeded']
+
+    job_id = client.put('/user/create?async=1', data=data).get_json()['payload']['job_id']
+    with app.app_context():
+        run_pending()
+        assert get_db().execute("select count(*) from job_secret").fetchone()[0] == 0
+    status = job(client, job_id)
+    assert (status['status'], status['attempts']) == ('failed', 1)
+
+
+def test_async_create_repo_retries(app, client, fake_codecommit):
+    app.config['JOB_RETRY_BASE'] = 0
+    fake_codecommit.lost_responses.add('web')
+    spec = {"repo_name": "web", "project_id": 1, "project_name": "p1", "owner_id": 1, "owner_name": "tom"}
+    job_id = client.put('/repo/create?async=1', data=spec).get_json()['payload']['job_id']
+    with app.app_context():
+        assert run_pending() == 2
+    status = job(client, job_id)
+    assert (status['status'], status['attempts']) == ('succeeded', 2)
+    assert client.get('/repo/get/web').get_json()['payload']['aws_arn'] == fake_codecommit.repos['web']['Arn']
+
+    job_id = client.put('/repo/create?async=1', data=spec).get_json()['payload']['job_id']
+    with app.app_context():
+        run_pending()
+    assert job(client, job_id)['status'] == 'failed'
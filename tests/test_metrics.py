@@ -0,0 +1,49 @@
+import json
+import re
+
+from source import metrics
+
+
+def sample(text, line_prefix):
+    match = re.search('^' + re.escape(line_prefix) + r' (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_metrics_exposition(client, fake_iam):
+    before = client.get('/metrics').get_data(as_text=True)
+    # the index is streamed, its statements run while the body is read
+    client.get('/repo/index').get_data()
+    client.get('/user/get/nobody@sample.com')
+    client.delete('/team/batch_delete', data={"team_ids": "x"})
+    text = client.get('/metrics').get_data(as_text=True)
+
+    key = 'http_requests_total{route="/repo/index",method="GET",status="200"}'
+    assert sample(text, key) == sample(before, key) + 1
+    key = 'http_request_errors_total{route="/team/batch_delete",method="DELETE"}'
+    assert sample(text, key) == sample(before, key) + 1
+    assert 'http_request_duration_seconds_bucket{route="/repo/index",method="GET",le="+Inf"}' in text
+    assert 'sqlite_statement_duration_seconds_count{operation="select",table="repo"}' in text
+    assert '# TYPE aws_request_duration_seconds histogram' in text
+
+
+def test_metrics_merge_processes(app, client, tmp_path):
+    app.config['METRICS_DIR'] = str(tmp_path)
+    other = {
+        "http_requests_total": {
+            "type": "counter", "help": "HTTP requests by route", "labelnames": ["route", "method", "status"],
+            "values": [[["/repo/index", "GET", "200"], 5]]
+        },
+        "aws_request_duration_seconds": {
+            "type": "histogram", "help": "AWS operations", "labelnames": ["service", "operation"],
+            "buckets": list(metrics.DEFAULT_BUCKETS),
+            "values": [[["iam", "GetUser"], [0, 0, 1] + [0] * 11 + [0.004]]]
+        },
+    }
+    (tmp_path / '999999.json').write_text(json.dumps(other))
+    single = client.get('/metrics').get_data(as_text=True)
+    key = 'http_requests_total{route="/repo/index",method="GET",status="200"}'
+    own = sum(value for labels, value in metrics.http_requests.snapshot()['values']
+              if labels == ['/repo/index', 'GET', '200'])
+    assert sample(single, key) == own + 5
+    assert sample(single, 'aws_request_duration_seconds_bucket{service="iam",operation="GetUser",le="0.005"}') == 1
+    assert sample(single, 'aws_request_duration_seconds_count{service="iam",operation="GetUser"}') == 1
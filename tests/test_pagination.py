@@ -0,0 +1,36 @@
+import json
+
+from source.db import get_db
+
+
+def seed_projects(app, count):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "insert into project (project_name, operator) values (?, 1)",
+            [(f'project{i}',) for i in range(count)]
+        )
+        db.commit()
+
+
+def test_index_page(app, client):
+    seed_projects(app, 5)
+    result = json.loads(client.get('/project/index?limit=2').data)
+    assert [p['id'] for p in result['payload']] == [1, 2]
+    assert result['next_after'] == 2
+
+    result = json.loads(client.get('/project/index?limit=2&after=4').data)
+    assert [p['id'] for p in result['payload']] == [5]
+    assert result['next_after'] is None
+
+
+def test_index_stream(app, client):
+    seed_projects(app, 5)
+    response = client.get('/project/index')
+    assert response.is_streamed
+    result = json.loads(response.data)
+    assert result['succeeded']
+    assert [p['id'] for p in result['payload']] == [1, 2, 3, 4, 5]
+
+    result = json.loads(client.get('/project/index?stream=1&after=3').data)
+    assert [p['id'] for p in result['payload']] == [4, 5]
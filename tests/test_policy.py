@@ -1,8 +1,90 @@
-from source.policy import load_policy_template
+import json
+import os
+
+import pytest
+
+import source.policy as policy
+from source.policy import get_policy_template, load_policy_template
 
 
 class TestPolicy(object):
 
     def test_load_policy_template(self):
         policy_type = 'developer'
-        load_policy_template(policy_type)
\ No newline at end of file
+        template = load_policy_template(policy_type)
+        assert template['Statement'][0]['Resource'] == '*'
+        template['Statement'][0]['Resource'] = 'changed'
+        assert load_policy_template(policy_type)['Statement'][0]['Resource'] == '*'
+
+    def test_render(self):
+        template = get_policy_template('readonly')
+        arns = ['arn:aws-cn:codecommit:cn-north-1:123456789012:web', 'arn:aws-cn:codecommit:cn-north-1:123456789012:api']
+        document = json.loads(template.render(arns))
+        assert document['Statement'][0]['Resource'] == arns
+        assert document['Statement'][1] == load_policy_template('readonly')['Statement'][1]
+        with pytest.raises(AttributeError):
+            template.prefix = ''
+
+    def test_reload_on_mtime_change(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(policy, 'TEMPLATE_DIR', str(tmp_path))
+        monkeypatch.setattr(policy, '_templates', {})
+        path = tmp_path / 'admin_template.json'
+        path.write_text(json.dumps({"Statement": [{"Action": "codecommit:*", "Resource": "*"}]}))
+        first = get_policy_template('admin')
+        assert get_policy_template('admin') is first
+
+        path.write_text(json.dumps({"Statement": [{"Action": "codecommit:Get*", "Resource": "*"}]}))
+        os.utime(path, ns=(first.mtime + 10 ** 9, first.mtime + 10 ** 9))
+        assert json.loads(get_policy_template('admin').render('*'))['Statement'][0]['Action'] == 'codecommit:Get*'
+
+    def test_unknown_type(self):
+        with pytest.raises(ValueError):
+            get_policy_template('../../etc/passwd')
+
+
+def test_create_reuses_identical_policy(app, client, fake_iam):
+    form = {'repos': '*', 'policy_type': 'readonly'}
+    first = client.put('/policy/create', data=form).get_json()
+    assert first['succeeded'] and not first['payload'][0]['reused']
+    second = client.put('/policy/create', data=form).get_json()
+    assert second['payload'][0]['reused']
+    assert second['payload'][0]['aws_arn'] == first['payload'][0]['aws_arn']
+    assert len(fake_iam.policies) == 1
+
+
+def test_gc_duplicate_policies(app, fake_iam):
+    from source.db import get_db
+
+    with app.app_context():
+        db = get_db()
+        document = get_policy_template('readonly').render('*')
+        for name in ('p1', 'p2', 'p3'):
+            arn = fake_iam.create_policy(PolicyName=name, PolicyDocument=document)['Policy']['Arn']
+            db.execute(
+                "insert into policy (policy_name, detail, aws_arn, created) values (?, ?, ?, ?)",
+                (name, document, arn, f'2022-01-0{name[1]}')
+            )
+        fake_iam.policies['arn:aws-cn:iam::123456789012:policy/p2']['AttachmentCount'] = 1
+        db.commit()
+
+        report = policy.gc_duplicate_policies(dry_run=True)
+        assert [(item['policy_name'], item['action']) for item in report] == [('p2', 'kept: attached'), ('p3', 'would be deleted')]
+        assert len(fake_iam.policies) == 3
+
+        policy.gc_duplicate_policies()
+        assert sorted(row[0] for row in db.execute("select policy_name from policy where detail is not null")) == ['p1', 'p2']
+        assert len(fake_iam.policies) == 2
+
+
+def test_create_after_delete(app, client, fake_iam):
+    form = {'repos': '*', 'policy_type': 'readonly'}
+    first = client.put('/policy/create', data=form).get_json()['payload'][0]
+    assert client.delete(f"/policy/delete_policy/{first['policy_name']}").get_json()['succeeded']
+    assert fake_iam.policies == {}
+
+    second = client.put('/policy/create', data=form).get_json()['payload'][0]
+    assert not second['reused']
+    assert second['policy_name'] != first['policy_name']
+    assert list(fake_iam.policies) == [second['aws_arn']]
+    third = client.put('/policy/create', data=form).get_json()['payload'][0]
+    assert third['reused'] and third['aws_arn'] == second['aws_arn']
@@ -0,0 +1,42 @@
+import json
+
+from source.policy import get_policy_template
+from source.policy_compiler import collapse_arns, collapse_names, compile_policies
+
+BASE = 'arn:aws-cn:codecommit:cn-north-1:123456789012'
+
+
+def test_collapse_names():
+    known = ['pay-api', 'pay-web', 'pay-worker', 'payroll', 'shop-api', 'shop-web']
+    assert collapse_names({'pay-api', 'pay-web', 'pay-worker'}, known, 3) == ['pay-*']
+    # shop-* would also grant shop-web
+    assert collapse_names({'shop-api'}, known, 3) == ['shop-api']
+    assert collapse_names({'pay-api', 'pay-web'}, known, 3) == ['pay-api', 'pay-web']
+    assert collapse_names({'pay-api', 'pay-web', 'pay-worker', 'payroll'}, known, 3) == ['pay*']
+    assert collapse_names({'pay-api', 'pay-web', 'pay-worker', 'payroll'}, known, 4) == ['pay-*', 'payroll']
+
+
+def test_collapse_arns_keeps_accounts_apart():
+    arns = [f'{BASE}:app-1', f'{BASE}:app-2', 'arn:aws-cn:codecommit:cn-north-1:999999999999:app-3']
+    assert collapse_arns(arns, arns) == sorted([f'{BASE}:app-*', 'arn:aws-cn:codecommit:cn-north-1:999999999999:app-3'])
+
+
+def test_split_under_size_limit():
+    template = get_policy_template('developer')
+    # names without a shared prefix cannot be collapsed
+    arns = [f'{BASE}:{i:04d}{chr(97 + i % 26)}repository' for i in range(0, 400, 3)]
+    known = arns + [f'{BASE}:{i:04d}{chr(97 + i % 26)}repository' for i in range(1, 400, 3)]
+    documents = compile_policies(template, arns, known, min_prefix=20)
+    assert len(documents) > 1
+    assert all(len(document) <= 6144 for document in documents)
+    resources = []
+    for document in documents:
+        resources.extend(json.loads(document)['Statement'][0]['Resource'])
+    assert sorted(resources) == sorted(arns)
+
+
+def test_list_that_fits_stays_literal():
+    template = get_policy_template('readonly')
+    arns = [f'{BASE}:pay-api', f'{BASE}:pay-web']
+    documents = compile_policies(template, arns, arns, min_prefix=3)
+    assert json.loads(documents[0])['Statement'][0]['Resource'] == arns
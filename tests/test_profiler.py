@@ -0,0 +1,42 @@
+import logging
+
+from source import create_app
+from source.db import close_db, get_db, init_db
+
+
+def test_profile_header(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'test.sqlite'),
+        'JOB_WORKERS': 0,
+        'SQL_PROFILE': True,
+    })
+    with app.app_context():
+        init_db()
+    response = app.test_client().get('/team/get/1')
+    assert int(response.headers['X-SQL-Queries']) > 0
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+
+
+def test_slow_statements_and_repeats(app, caplog):
+    app.config.update(SQL_PROFILE=True, SQL_SLOW_THRESHOLD=0, SQL_PROFILE_REPEAT=3)
+    caplog.set_level(logging.DEBUG, logger=app.logger.name)
+    with app.app_context():
+        db = get_db()
+        db.executemany("insert into job (kind, payload, max_attempts) values (?, '{}', 1)", [('a',), ('b',)])
+        assert len(db.execute("select id from job where kind != ?", ('x',)).fetchall()) == 2
+        for kind in ('a', 'b', 'c'):
+            # a and b are left unread and closed when the connection is released, c has no row
+            db.execute("select id from job where kind = ?", (kind,)).fetchone()
+        profile = db.profile
+        assert profile.count == 5
+        assert len(profile.pending) == 2
+        close_db()
+        assert profile.pending == set()
+        assert db.profile is None
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(m.startswith('sql ') and '2 rows' in m and 'kind != ?' in m for m in messages)
+    assert any(m.startswith('slow sql') and 'SCAN job' in m for m in messages)
+    assert sum(m.startswith('sql full scan of job') for m in messages) == 2
+    assert any(m.startswith('sql run 3 times in one app context') for m in messages)
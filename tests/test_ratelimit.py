@@ -0,0 +1,93 @@
+from source import aws
+from source.ratelimit import RateLimiter, operation_family
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_operation_family():
+    assert operation_family('iam', 'ListAttachedGroupPolicies') == 'iam:read'
+    assert operation_family('iam', 'AddUserToGroup') == 'iam:write'
+
+
+def test_bucket_shared_and_adaptive(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / 'ratelimit.sqlite')
+    first = RateLimiter(path, {'iam:write': (2, 2)}, clock=clock, sleep=clock.sleep)
+    # a second process on the same file
+    second = RateLimiter(path, {'iam:write': (2, 2)}, clock=clock, sleep=clock.sleep)
+
+    assert first.acquire('iam:write') == 0
+    assert second.acquire('iam:write') == 0
+    assert first.acquire('iam:write') == 0.5
+    assert first.acquire('codecommit:write') == 0
+
+    second.throttled('iam:write')
+    assert first.state()['iam:write']['factor'] == 0.5
+    # bucket emptied, refilled at half the rate
+    assert first.acquire('iam:write') == 1.0
+    for _ in range(25):
+        first.succeeded('iam:write')
+    assert first.state()['iam:write']['factor'] == 1.0
+
+
+THROTTLED = b"""<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code>
+<Message>Rate exceeded</Message></Error><RequestId>1</RequestId></ErrorResponse>"""
+
+GET_USER = b"""<GetUserResponse><GetUserResult><User><Path>/</Path><UserName>tom</UserName>
+<UserId>AIDA</UserId><Arn>arn:aws:iam::123456789012:user/tom</Arn><CreateDate>2020-01-01T00:00:00Z</CreateDate>
+</User></GetUserResult><ResponseMetadata><RequestId>2</RequestId></ResponseMetadata></GetUserResponse>"""
+
+
+def test_limiter_sees_every_attempt(app, monkeypatch, tmp_path):
+    from botocore.awsrequest import AWSResponse
+
+    class Raw(object):
+        def __init__(self, body):
+            self.body = body
+
+        def stream(self, **kwargs):
+            yield self.body
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'AK')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'SK')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    # init_app changes module state, restore it after the test
+    for name in ('CLIENT_CONFIG', '_clients'):
+        monkeypatch.setattr(aws, name, dict(getattr(aws, name)))
+    monkeypatch.setattr(aws, 'rate_limiter', aws.rate_limiter)
+    app.config.update(AWS_RATE_LIMIT_DB=str(tmp_path / 'ratelimit.sqlite'), AWS_CLIENT_CONFIG={
+        'retries': {'mode': 'standard', 'max_attempts': 3}
+    })
+    aws.init_app(app)
+    sent = []
+    acquired = []
+    monkeypatch.setattr(aws.rate_limiter, 'sleep', lambda seconds: None)
+    original = aws.rate_limiter.acquire
+    monkeypatch.setattr(aws.rate_limiter, 'acquire', lambda family: acquired.append(family) or original(family))
+    client = aws.get_client('iam')
+
+    def respond(request, **kwargs):
+        sent.append(request)
+        if len(sent) == 1:
+            return AWSResponse(request.url, 400, {}, Raw(THROTTLED))
+        return AWSResponse(request.url, 200, {}, Raw(GET_USER))
+
+    client.meta.events.register('before-send.iam', respond)
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    assert client.get_user(UserName='tom')['User']['UserName'] == 'tom'
+    assert len(sent) == 2
+    assert acquired == ['iam:read', 'iam:read']
+    # halved by the throttle, then one success gave back a little
+    assert aws.rate_limiter.state()['iam:read']['factor'] == 0.52
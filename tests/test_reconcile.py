@@ -0,0 +1,55 @@
+import source.reconcile
+from source.db import get_db
+from source.reconcile import aws_exists, reconcile, record_aws_state
+
+
+def test_reconcile_records_drift(app, monkeypatch):
+    aws = {
+        'team1': 'arn:aws-cn:iam::123456789012:group/team1',
+        'team3': 'arn:aws-cn:iam::123456789012:group/team3',
+    }
+    monkeypatch.setattr(source.reconcile, 'list_aws', lambda kind: dict(aws))
+    with app.app_context():
+        db = get_db()
+        assert aws_exists('group', 'team1') is None
+        db.executemany(
+            "insert into team (team_name, status, operator, aws_arn) values (?, 1, 1, ?)",
+            [('team1', aws['team1']), ('team2', 'arn:aws-cn:iam::123456789012:group/team2')]
+        )
+        db.commit()
+
+        summary = reconcile('group')
+        assert summary == {"kind": 'group', "aws_count": 2, "db_count": 2, "drift_count": 2}
+        drift = dict(db.execute("select name, drift from aws_state where kind = 'group'").fetchall())
+        assert drift == {'team1': None, 'team2': 'missing_in_aws', 'team3': 'missing_in_db'}
+        assert aws_exists('group', 'team1') is True
+        assert aws_exists('group', 'team2') is False
+
+        record_aws_state(db, 'group', 'team2', aws['team1'], True)
+        db.commit()
+        assert aws_exists('group', 'team2') is True
+
+
+def test_get_team_answers_from_reconcile(app, client, fake_iam, monkeypatch):
+    client.put('/team/create', data={"team_name": "team1", "status": 1})
+    monkeypatch.setattr(source.reconcile, 'list_aws', lambda kind: {
+        name: group['Arn'] for name, group in fake_iam.groups.items()
+    })
+    with app.app_context():
+        reconcile('group')
+    # IAM is not asked while the run is fresh
+    fake_iam.groups.clear()
+    result = client.get('/team/get/1').get_json()
+    assert result['succeeded']
+    assert result['payload']['team_name'] == 'team1'
+
+
+def test_clean_delete_is_no_drift(app, client, fake_iam):
+    client.put('/team/create', data={"team_name": "team1", "status": 1})
+    assert client.delete('/team/delete/1').get_json()['succeeded']
+    assert client.get('/reconcile/drift').get_json()['payload']['drift'] == []
+    with app.app_context():
+        state = get_db().execute(
+            "select exists_in_aws, exists_in_db from aws_state where kind = 'group' and name = 'team1'"
+        ).fetchone()
+        assert tuple(state) == (0, 0)
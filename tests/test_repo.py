@@ -0,0 +1,11 @@
+import json
+
+
+def test_batch_create(app, client, fake_codecommit):
+    spec = {"project_id": 1, "project_name": "p1", "owner_id": 1, "owner_name": "tom"}
+    specs = [dict(spec, repo_name=name) for name in ('web', 'api', 'broken', 'web')]
+    result = json.loads(client.put('/repo/batch_create', json=specs).data)
+    assert [item['succeeded'] for item in result['payload']] == [True, True, False, False]
+
+    result = json.loads(client.get('/repo/index').data)
+    assert sorted(r['repo_name'] for r in result['payload']) == ['api', 'web']
@@ -0,0 +1,61 @@
+import json
+
+
+def test_batch_members(app, client, fake_iam):
+    fake_iam.fail.add('bad@sample.com')
+    pairs = [
+        {"user_name": "tom@sample.com", "team_name": "team1"},
+        {"user_name": "jerry@sample.com", "team_name": "team1"},
+        {"user_name": "bad@sample.com", "team_name": "team1"},
+    ]
+    result = json.loads(client.put('/team/batch_add_member', json=pairs).data)
+    assert [item['succeeded'] for item in result['payload']] == [True, True, False]
+    users = client.get('/team/get_users/team1').get_json()
+    assert sorted(u['user_name'] for u in users) == ['jerry@sample.com', 'tom@sample.com']
+
+    result = json.loads(client.delete('/team/batch_delete_member', json=pairs[:1]).data)
+    assert result['succeeded']
+    users = client.get('/team/get_users/team1').get_json()
+    assert [u['user_name'] for u in users] == ['jerry@sample.com']
+
+
+def test_batch_delete(app, client, fake_iam):
+    from source.db import get_db
+
+    for team_name in ('team1', 'team2', 'team3'):
+        client.put('/team/create', data={"team_name": team_name, "status": 1})
+    client.put('/team/batch_add_member', json=[
+        {"user_name": "tom@sample.com", "team_name": "team1"},
+        {"user_name": "jerry@sample.com", "team_name": "team1"},
+        {"user_name": "tom@sample.com", "team_name": "team2"},
+    ])
+    for team_name in ('team1', 'team3'):
+        client.put('/team/attach_policy', data={
+            "team_name": team_name, "policy_arn": "arn:aws-cn:iam::aws:policy/AWSCodeCommitReadOnly"
+        })
+    fake_iam.fail.add('team3')
+
+    result = client.delete('/team/batch_delete', data={"team_ids": "1,2,3,9"}).get_json()
+    assert [(item['team_id'], item['succeeded']) for item in result['payload']] == [
+        (1, True), (2, True), (3, False), (9, False)
+    ]
+    assert result['payload'][0]['message'] == "2 members removed, 1 policies detached"
+    assert sorted(fake_iam.groups) == ['team3']
+    with app.app_context():
+        db = get_db()
+        assert [row[0] for row in db.execute("select team_name from team")] == ['team3']
+        assert db.execute("select count(*) from team_member").fetchone()[0] == 0
+        assert [row[0] for row in db.execute("select team_name from team_policy")] == ['team3']
+
+    assert not client.delete('/team/batch_delete', data={"team_ids": "1) or (1=1"}).get_json()['succeeded']
+
+
+def test_attach_policy_twice(app, client, fake_iam):
+    from source.db import get_db
+
+    client.put('/team/create', data={"team_name": "team1", "status": 1})
+    form = {"team_name": "team1", "policy_arn": "arn:aws-cn:iam::aws:policy/AWSCodeCommitReadOnly"}
+    assert client.put('/team/attach_policy', data=form).get_json()['succeeded']
+    assert client.put('/team/attach_policy', data=form).get_json()['succeeded']
+    with app.app_context():
+        assert get_db().execute("select count(*) from team_policy").fetchone()[0] == 1
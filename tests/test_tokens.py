@@ -0,0 +1,51 @@
+import json
+
+from werkzeug.security import generate_password_hash
+
+from source.db import get_db
+from source.decorators import check_token
+
+
+def seed_user(app):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "insert into user (user_name, email, password, ak) values (?, ?, ?, ?)",
+            ('tom', 'tom@sample.com', generate_password_hash('secret'), 'AKIAEXAMPLE')
+        )
+        db.commit()
+
+
+def test_get_and_refresh_token(app, client):
+    seed_user(app)
+    result = json.loads(client.get('/user/get_token', headers={
+        'X-USER-NAME': 'tom@sample.com', 'X-USER-PASSWORD': 'secret'
+    }).data)
+    assert result['succeeded']
+    tokens = result['payload']
+    assert result['message'] == tokens['token']
+
+    @check_token
+    def view():
+        return 'ok'
+
+    with app.test_request_context('/', headers={'X-USER-NAME': 'tom@sample.com', 'X-USER-TOKEN': tokens['token']}):
+        assert view() == 'ok'
+    with app.test_request_context('/', headers={'X-USER-NAME': 'jerry@sample.com', 'X-USER-TOKEN': tokens['token']}):
+        assert view() != 'ok'
+    with app.test_request_context('/', headers={'X-USER-NAME': 'tom@sample.com', 'X-USER-TOKEN': tokens['refresh_token']}):
+        assert view() != 'ok'
+    for headers in ({}, {'X-USER-NAME': 'tom@sample.com'}, {'X-USER-TOKEN': tokens['token']}):
+        with app.test_request_context('/', headers=headers):
+            assert 'not authorized' in view().get_json()['message']
+
+    result = json.loads(client.get('/user/refresh_token', headers={
+        'X-USER-NAME': 'tom@sample.com', 'X-REFRESH-TOKEN': tokens['refresh_token']
+    }).data)
+    assert result['succeeded']
+    assert result['payload']['token']
+
+    result = json.loads(client.get('/user/refresh_token', headers={
+        'X-USER-NAME': 'tom@sample.com', 'X-REFRESH-TOKEN': tokens['token']
+    }).data)
+    assert not result['succeeded']
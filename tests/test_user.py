@@ -7,3 +7,50 @@ def test_create_readonly_policy():
     json_data = user.create_readonly_policy()
     assert json_data['Statement'][0]['Resource']
 
+
+
+def test_batch_create(app, client, fake_iam):
+    fake_iam.fail.add('bad-password')
+    users = [
+        {"user_name": "tom", "email": "tom@sample.com", "password": "Asia_Info_888"},
+        {"user_name": "jerry", "email": "jerry@sample.com", "password": "bad-password"},
+        {"user_name": "tom", "email": "tom@sample.com", "password": "Asia_Info_888"},
+    ]
+    result = json.loads(client.put('/user/batch_create', json=users).data)
+    assert [item['succeeded'] for item in result['payload']] == [True, False, False]
+
+    csv_body = "user_name,email,password\nspike,spike@sample.com,Asia_Info_888\ntom,tom@sample.com,x\n"
+    result = json.loads(client.put('/user/batch_create', data=csv_body, content_type='text/csv').data)
+    assert [item['succeeded'] for item in result['payload']] == [True, False]
+
+    result = json.loads(client.get('/user/index').data)
+    assert sorted(u['email'] for u in result['payload']) == ['spike@sample.com', 'tom@sample.com']
+
+
+def test_batch_create_checks_names(app, client, fake_iam):
+    from source.db import get_db
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "insert into user (user_name, email, password, operator) values ('amy', 'amy@sample.com', 'x', 1)"
+        )
+        db.commit()
+    users = [
+        {"user_name": "tom", "email": "tom@sample.com", "password": "Asia_Info_888"},
+        {"user_name": "tom", "email": "tom2@sample.com", "password": "Asia_Info_888"},
+        {"user_name": "amy2", "email": "amy@sample.com", "password": "Asia_Info_888"},
+        {"user_name": "amy", "email": "amy3@sample.com", "password": "Asia_Info_888"},
+    ]
+    result = client.put('/user/batch_create', json=users).get_json()
+    assert [item['succeeded'] for item in result['payload']] == [True, False, False, False]
+    assert sorted(fake_iam.users) == ['tom@sample.com']
+    with app.app_context():
+        rows = get_db().execute("select user_name from user order by user_name").fetchall()
+        assert [row[0] for row in rows] == ['amy', 'tom']
+
+
+def test_get_user(app, client, fake_iam):
+    client.put('/user/batch_create', json=[{"user_name": "tom", "email": "tom@sample.com", "password": "Asia_Info_888"}])
+    assert client.get('/user/get/tom@sample.com').get_json()['payload']['user_name'] == 'tom'
+    assert client.get('/user/get/nobody@sample.com').get_json()['message'] == "User nobody@sample.com not existed"